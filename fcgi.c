@@ -30,12 +30,16 @@
 #include <fcgiapp.h>
 
 #define UNKNOWN_STR "unknown"
+/* Write bodies larger than this are parsed as they are received */
+#define BODY_PRELOAD_MAX (64 * 1024)
 
 static req_callback g_cb;
 static const char *g_socket = NULL;
 static int g_sock = -1;
 static GThread *g_thread = NULL;
 static bool g_running = false;
+/* Requests accepted but not yet picked up by a worker thread */
+static guint g_queued = 0;
 
 static void
 dump_request (FCGX_Request * r)
@@ -190,6 +194,22 @@ get_flags (FCGX_Request * r)
     param = FCGX_GetParam ("REST_LEGACY_KEY_AS_OBJECT", r->envp);
     if (param && strcmp (param, "on") == 0)
         flags |= FLAGS_LEGACY_KEY_AS_OBJECT;
+    /* Compressed responses */
+    param = FCGX_GetParam ("HTTP_ACCEPT_ENCODING", r->envp);
+    if (!param)
+        param = FCGX_GetParam ("HTTP_Accept-Encoding", r->envp);
+    if (param && strstr (param, "gzip"))
+        flags |= FLAGS_ACCEPT_GZIP;
+    /* Stage timing */
+    if (rest_server_timing)
+        flags |= FLAGS_SERVER_TIMING;
+    param = FCGX_GetParam ("HTTP_X_SERVER_TIMING", r->envp);
+    if (!param)
+        param = FCGX_GetParam ("HTTP_X-Server-Timing", r->envp);
+    if (param && strcmp (param, "on") == 0)
+        flags |= FLAGS_SERVER_TIMING;
+    if (param && strcmp (param, "off") == 0)
+        flags &= ~FLAGS_SERVER_TIMING;
     if (flags & FLAGS_RESTCONF)
         flags |= FLAGS_CONDITIONS | FLAGS_IDREF_VALUES;
     /* PUT flags for RESTCONF compliance */
@@ -243,6 +263,7 @@ handle_http (void *arg)
     int i;
     int rc = 0;
 
+    __atomic_sub_fetch (&g_queued, 1, __ATOMIC_RELAXED);
     DEBUG ("FCGI(%p): New connection\n", request);
 
     /* Debug */
@@ -301,21 +322,34 @@ handle_http (void *arg)
         rc = 500;
         goto exit;
     }
+    rest_timing_start ((flags & FLAGS_SERVER_TIMING) || logging_slow_usec);
+    metrics_request_start ((req_handle) request, length ? strtol (length, NULL, 10) : 0);
+    logging_access_start ();
     if (length != NULL)
     {
+        gint64 start = g_get_monotonic_time ();
         len = strtol (length, NULL, 10);
-        data = calloc (len + 1, 1);
-        for (i = 0; i < len; i++)
+        if (len > BODY_PRELOAD_MAX && (flags & (FLAGS_METHOD_POST | FLAGS_METHOD_PUT | FLAGS_METHOD_PATCH)))
+        {
+            /* Large bodies are parsed as they arrive */
+            flags |= FLAGS_BODY_STREAM;
+        }
+        else
         {
-            if ((data[i] = FCGX_GetChar (request->in)) < 0)
+            data = calloc (len + 1, 1);
+            if ((i = FCGX_GetStr (data, len, request->in)) < len)
             {
                 ERROR ("ERROR: Not enough bytes received on standard input\n");
-                break;
+                data[i] = '\0';
             }
         }
+        rest_timing_add (TIMING_READ, start);
     }
     g_cb ((req_handle) request, flags, rpath, path, if_match, if_none_match, if_modified_since,
            if_unmodified_since, server_name, server_port, remote_addr, remote_user, data, len);
+    if (logging_access)
+        logging_access_end (flags, path, remote_user, remote_addr, len, if_none_match);
+    metrics_request_end (flags);
 
 exit:
     if (rc)
@@ -351,6 +385,7 @@ handle_fcgi (void *arg)
             g_free (request);
             break;
         }
+        __atomic_add_fetch (&g_queued, 1, __ATOMIC_RELAXED);
         g_thread_pool_push (workers, request, NULL);
     }
     DEBUG ("Stopping FCGI handler\n");
@@ -390,16 +425,50 @@ fcgi_start (const char *socket, req_callback cb)
     return true;
 }
 
+int
+read_request (req_handle handle, char *buffer, int length)
+{
+    FCGX_Request *request = (FCGX_Request *) handle;
+    return FCGX_GetStr (buffer, length, request->in);
+}
+
+unsigned int
+fcgi_queue_depth (void)
+{
+    return __atomic_load_n (&g_queued, __ATOMIC_RELAXED);
+}
+
 void
 send_response (req_handle handle, const char *data, bool flush)
 {
     FCGX_Request *request = (FCGX_Request *) handle;
-    DEBUG ("FCGI(%p): send %lu bytes\n", request, strlen (data));
+    size_t length = strlen (data);
+    DEBUG ("FCGI(%p): send %lu bytes\n", request, length);
+    metrics_response (handle, data, length);
     FCGX_PutS (data, request->out);
     if (flush)
         FCGX_FFlush (request->out);
 }
 
+/* False once sending the response has failed (the client has gone) */
+bool
+is_sending (req_handle handle)
+{
+    FCGX_Request *request = (FCGX_Request *) handle;
+    return FCGX_GetError (request->out) == 0;
+}
+
+void
+send_response_data (req_handle handle, const char *data, size_t length, bool flush)
+{
+    FCGX_Request *request = (FCGX_Request *) handle;
+    DEBUG ("FCGI(%p): send %lu bytes\n", request, length);
+    metrics_response (handle, data, length);
+    FCGX_PutStr (data, length, request->out);
+    if (flush)
+        FCGX_FFlush (request->out);
+}
+
 bool
 is_connected (req_handle handle, bool block)
 {
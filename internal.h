@@ -91,11 +91,17 @@ typedef enum
 #define FLAGS_CONFIG_ONLY           (1 << 23)   /* DELETE config only nodes */
 #define FLAGS_FORCE_NS_PREFIX       (1 << 24)   /* Always include namespace prefix in output */
 #define FLAGS_LEGACY_KEY_AS_OBJECT  (1 << 25)   /* Legacy appweb /api: present a by-key list entry as {key:{...}} not [{...}] */
+#define FLAGS_BODY_STREAM           (1 << 26)   /* Body not read yet - read it with read_request */
+#define FLAGS_SERVER_TIMING         (1 << 27)   /* Report the time spent in each stage in a Server-Timing header */
+#define FLAGS_ACCEPT_GZIP           (1 << 28)   /* Client accepts gzip content encoding */
 extern int default_accept_encoding;
 extern int default_content_encoding;
 typedef void *req_handle;
 void send_response (req_handle handle, const char *data, bool flush);
+void send_response_data (req_handle handle, const char *data, size_t length, bool flush);
 bool is_connected (req_handle handle, bool block);
+bool is_sending (req_handle handle);
+int read_request (req_handle handle, char *buffer, int length);
 typedef void (*req_callback) (req_handle handle, int flags, const char *rpath, const char *path,
                               const char *if_match, const char *if_none_match,
                               const char *if_modified_since, const char *if_unmodified_since,
@@ -106,10 +112,14 @@ typedef void (*req_callback) (req_handle handle, int flags, const char *rpath, c
 /* FastCGI */
 bool fcgi_start (const char *socket, req_callback cb);
 void fcgi_stop (void);
+unsigned int fcgi_queue_depth (void);
 
 /* Rest */
 extern bool rest_use_arrays;
 extern bool rest_use_types;
+extern bool rest_server_timing;
+extern char *rest_snapshot;
+extern bool rest_lazy_models;
 gboolean rest_init (const char *path);
 void rest_api (req_handle handle, int flags, const char *rpath, const char *path,
                const char *if_match, const char *if_none_match,
@@ -117,8 +127,27 @@ void rest_api (req_handle handle, int flags, const char *rpath, const char *path
                const char *server_name, const char *server_port,
                const char *remote_addr, const char *remote_user,
                const char *data, int length);
+void rest_jobs_shutdown (void);
 void rest_shutdown (void);
-void yang_library_create (sch_instance *schema);
+
+/* Time spent in each stage of the current request */
+typedef enum
+{
+    TIMING_READ,
+    TIMING_PARSE,
+    TIMING_QUERY,
+    TIMING_DEFAULTS,
+    TIMING_TRIM,
+    TIMING_SERIALIZE,
+    TIMING_BUILD,
+    TIMING_APPLY,
+    TIMING_RPC,
+    TIMING_MAX,
+} timing_stage;
+void rest_timing_start (bool enabled);
+void rest_timing_add (timing_stage stage, gint64 start);
+char *rest_timing_header (char *resp);
+char *yang_library_create (sch_instance *schema);
 void restconf_monitoring_create (sch_instance *schema);
 
 /* RPC */
@@ -129,12 +158,61 @@ typedef enum
     REST_RPC_E_NOT_FOUND,
     REST_RPC_E_INTERNAL,
 } rest_rpc_error;
+extern int rest_rpc_states;
+/* Threads that run async RPCs, each with a Lua state of its own */
+#define REST_JOBS_THREADS 4
+extern char *rest_rpc_cache;
+extern int rest_rpc_time_budget;
+extern int rest_rpc_instruction_budget;
 bool rest_rpc_init (const char *path);
 rest_rpc_error rest_rpc_execute (int flags, const char *path, GNode *input, GNode **output, char **error_message);
+typedef bool (*rest_rpc_chunk_fn) (GNode *chunk, void *data);
+rest_rpc_error rest_rpc_execute_stream (int flags, const char *path, GNode *input, rest_rpc_chunk_fn chunk, void *data,
+                                        GNode **output, char **error_message);
+bool rest_rpc_async (const char *path);
+bool rest_rpc_stream (const char *path);
+char *rest_rpc_cache_get (int flags, const char *path, GNode *input);
+void rest_rpc_cache_put (int flags, const char *path, GNode *input, const char *resp);
+void rest_rpc_cache_invalidate (const char *path);
+void rest_rpc_metrics (GString *out);
+void rest_rpc_cancel (void);
 void rest_rpc_shutdown (void);
 
+/* Metrics */
+#define METRICS_BUCKETS 14
+int metrics_bucket (gint64 usec);
+void metrics_histogram (GString *out, const char *name, const char *labels,
+                        const guint64 *buckets, guint64 sum_us);
+void metrics_request_start (req_handle handle, int length);
+void metrics_request_model (const char *model);
+void metrics_request_end (int flags);
+void metrics_request_summary (int *status, guint64 *bytes_out, gint64 *duration);
+void metrics_response (req_handle handle, const char *data, size_t length);
+void metrics_watch (bool active);
+void metrics_watch_event (void);
+char *metrics_dump (void);
+void metrics_shutdown (void);
+
 /* Logging */
 extern int logging;
+extern gint64 logging_slow_usec;
+extern int logging_slow_sample;
+typedef enum
+{
+    LOG_OVERFLOW_DROP,          /* Drop (and count) records when the audit queue is full */
+    LOG_OVERFLOW_BLOCK,         /* Wait for the audit logger to make room */
+} logging_overflow;
+extern logging_overflow logging_audit_overflow;
+extern guint64 logging_audit_dropped;
+void logging_audit (const char *fmt, ...) __attribute__ ((format (printf, 1, 2)));
+#define AUDIT(fmt, args...) logging_audit (fmt, ## args)
+void logging_audit_tree (GNode *root, GNodeTraverseFunc fn, gpointer data, GDestroyNotify data_free);
+const char *logging_method (int flags);
+extern bool logging_access;
+void logging_access_start (void);
+void logging_access_cache (bool hit);
+void logging_access_end (int flags, const char *uri, const char *remote_user, const char *remote_addr,
+                         int length, const char *if_none_match);
 
 void logging_shutdown (void);
 int logging_init (const char *path, const char *logging_arg);
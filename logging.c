@@ -19,9 +19,59 @@
  */
 #include "internal.h"
 #include <sys/inotify.h>
+#include <stdarg.h>
+#include <semaphore.h>
+#include <jansson.h>
 
 #define READ_BUF_SIZE 512
 
+/* Audit records are queued here by the request threads and written to
+   syslog by the audit logger thread (size must be a power of 2) */
+#define AUDIT_QUEUE_SIZE 4096
+#define AUDIT_BATCH_SIZE 64
+
+/* A tree queued as one record and written a leaf at a time by the logger thread */
+typedef struct _audit_tree
+{
+    GNode *root;
+    GNodeTraverseFunc fn;
+    gpointer data;
+    GDestroyNotify data_free;
+} audit_tree;
+
+typedef struct _audit_cell
+{
+    guint64 seq;
+    char *msg;
+    audit_tree *tree;
+    bool access;
+} audit_cell;
+
+static audit_cell *audit_queue = NULL;
+static guint64 audit_head = 0;
+static guint64 audit_tail = 0;
+static sem_t audit_sem;
+static GThread *audit_thread = NULL;
+static bool audit_stop = false;
+/* Producers that may be using the queue */
+static gint audit_users = 0;
+static guint64 audit_unreported = 0;
+guint64 logging_audit_dropped = 0;
+/* Set on the logger thread, which writes its own records directly */
+static __thread bool audit_direct = false;
+
+/* Access log file - written by the audit logger thread */
+#define ACCESS_SIZE_DEFAULT (10 * 1024 * 1024)
+static GMutex access_lock;
+static char *access_path = NULL;
+static gint64 access_size_max = ACCESS_SIZE_DEFAULT;
+static FILE *access_fp = NULL;
+static gint64 access_size = 0;
+bool logging_access = false;
+
+/* Details of the request being handled by this thread that only the handlers know */
+static __thread int access_cache;
+
 static int inotify_fd = -1;
 static GIOChannel *channel = NULL;
 static char *logging_filename = NULL;
@@ -30,6 +80,425 @@ static char *logging_directory = NULL;
 /* Logging flags */
 int logging = LOG_NONE;
 
+/* Slow request logging (threshold of 0 is off) */
+gint64 logging_slow_usec = 0;
+int logging_slow_sample = 1;
+
+/* What to do with audit records when the queue is full. A large write is
+   queued as a single record, so records are only dropped when asked to */
+logging_overflow logging_audit_overflow = LOG_OVERFLOW_BLOCK;
+
+/* Multiple producer, single consumer bounded queue. Each cell carries a
+   sequence number that says whether it is free for the producer that
+   claimed that position or filled for the consumer. */
+static bool
+audit_push (char *msg, audit_tree *tree, bool access)
+{
+    guint64 pos = __atomic_load_n (&audit_head, __ATOMIC_RELAXED);
+    audit_cell *cell;
+
+    while (true)
+    {
+        cell = &audit_queue[pos & (AUDIT_QUEUE_SIZE - 1)];
+        gint64 diff = (gint64) __atomic_load_n (&cell->seq, __ATOMIC_ACQUIRE) - (gint64) pos;
+        if (diff == 0)
+        {
+            if (__atomic_compare_exchange_n (&audit_head, &pos, pos + 1, true,
+                                             __ATOMIC_RELAXED, __ATOMIC_RELAXED))
+                break;
+        }
+        else if (diff < 0)
+            return false;
+        else
+            pos = __atomic_load_n (&audit_head, __ATOMIC_RELAXED);
+    }
+    cell->msg = msg;
+    cell->tree = tree;
+    cell->access = access;
+    __atomic_store_n (&cell->seq, pos + 1, __ATOMIC_RELEASE);
+    return true;
+}
+
+static bool
+audit_pop (char **msg, audit_tree **tree, bool *access)
+{
+    audit_cell *cell = &audit_queue[audit_tail & (AUDIT_QUEUE_SIZE - 1)];
+
+    if (__atomic_load_n (&cell->seq, __ATOMIC_ACQUIRE) != audit_tail + 1)
+        return false;
+    *msg = cell->msg;
+    *tree = cell->tree;
+    *access = cell->access;
+    __atomic_store_n (&cell->seq, audit_tail + AUDIT_QUEUE_SIZE, __ATOMIC_RELEASE);
+    audit_tail++;
+    return true;
+}
+
+static void
+audit_write (char *msg)
+{
+    if (debug)
+        printf ("%s", msg);
+    else
+        syslog (LOG_NOTICE, "%s", msg);
+}
+
+static void
+audit_tree_free (audit_tree *tree)
+{
+    apteryx_free_tree (tree->root);
+    if (tree->data_free)
+        tree->data_free (tree->data);
+    g_free (tree);
+}
+
+/* Audit each leaf of the tree (the callback's records are written directly) */
+static void
+audit_tree_write (audit_tree *tree)
+{
+    g_node_traverse (tree->root, G_IN_ORDER, G_TRAVERSE_LEAVES, -1, tree->fn, tree->data);
+    audit_tree_free (tree);
+}
+
+/* Append a line to the access log, moving the log to <path>.1 when it gets too big */
+static void
+access_write (char *msg)
+{
+    gint64 len = strlen (msg);
+
+    if (!access_fp && access_path)
+    {
+        access_fp = fopen (access_path, "a");
+        if (!access_fp)
+            ERROR ("LOG: Failed to open access log \"%s\"\n", access_path);
+        access_size = access_fp ? ftell (access_fp) : 0;
+    }
+    if (!access_fp)
+        return;
+    if (access_size && access_size + len > access_size_max)
+    {
+        char *old = g_strdup_printf ("%s.1", access_path);
+        fclose (access_fp);
+        rename (access_path, old);
+        g_free (old);
+        access_fp = fopen (access_path, "a");
+        access_size = 0;
+        if (!access_fp)
+        {
+            ERROR ("LOG: Failed to open access log \"%s\"\n", access_path);
+            return;
+        }
+    }
+    fputs (msg, access_fp);
+    access_size += len;
+}
+
+static gpointer
+audit_logger (gpointer data)
+{
+    char *batch[AUDIT_BATCH_SIZE];
+    audit_tree *trees[AUDIT_BATCH_SIZE];
+    bool access[AUDIT_BATCH_SIZE];
+    guint64 dropped;
+    int count;
+    int i;
+
+    audit_direct = true;
+    while (true)
+    {
+        while (sem_wait (&audit_sem) != 0 && errno == EINTR);
+
+        /* Empty the queue in batches so the writes do not hold up the producers */
+        do
+        {
+            for (count = 0; count < AUDIT_BATCH_SIZE; count++)
+            {
+                if (!audit_pop (&batch[count], &trees[count], &access[count]))
+                    break;
+            }
+            g_mutex_lock (&access_lock);
+            for (i = 0; i < count; i++)
+            {
+                if (trees[i])
+                    audit_tree_write (trees[i]);
+                else if (access[i])
+                    access_write (batch[i]);
+                else
+                    audit_write (batch[i]);
+                g_free (batch[i]);
+            }
+            if (access_fp)
+                fflush (access_fp);
+            g_mutex_unlock (&access_lock);
+        } while (count == AUDIT_BATCH_SIZE);
+
+        dropped = __atomic_exchange_n (&audit_unreported, 0, __ATOMIC_RELAXED);
+        if (dropped)
+        {
+            char *msg = g_strdup_printf ("AUDIT: %" PRIu64 " records dropped (queue full)\n", dropped);
+            audit_write (msg);
+            g_free (msg);
+        }
+        if (__atomic_load_n (&audit_stop, __ATOMIC_ACQUIRE) &&
+            __atomic_load_n (&audit_head, __ATOMIC_ACQUIRE) == audit_tail)
+            break;
+    }
+    return NULL;
+}
+
+/* Start using the queue. Returns false if the logger thread is not running */
+static bool
+audit_enter (void)
+{
+    __atomic_add_fetch (&audit_users, 1, __ATOMIC_SEQ_CST);
+    if (__atomic_load_n (&audit_thread, __ATOMIC_SEQ_CST))
+        return true;
+    __atomic_sub_fetch (&audit_users, 1, __ATOMIC_SEQ_CST);
+    return false;
+}
+
+static void
+audit_leave (void)
+{
+    __atomic_sub_fetch (&audit_users, 1, __ATOMIC_RELEASE);
+}
+
+static void
+audit_enqueue (char *msg, audit_tree *tree, bool access)
+{
+    while (!audit_push (msg, tree, access))
+    {
+        if (logging_audit_overflow == LOG_OVERFLOW_DROP)
+        {
+            __atomic_fetch_add (&logging_audit_dropped, 1, __ATOMIC_RELAXED);
+            __atomic_fetch_add (&audit_unreported, 1, __ATOMIC_RELAXED);
+            g_free (msg);
+            if (tree)
+                audit_tree_free (tree);
+            sem_post (&audit_sem);
+            return;
+        }
+        /* Block until the logger makes some room */
+        sem_post (&audit_sem);
+        g_usleep (100);
+    }
+    sem_post (&audit_sem);
+}
+
+/* Queue an audit record for the logger thread (written directly if it is not running) */
+void
+logging_audit (const char *fmt, ...)
+{
+    va_list args;
+    char *msg;
+
+    va_start (args, fmt);
+    msg = g_strdup_vprintf (fmt, args);
+    va_end (args);
+
+    if (audit_direct || !audit_enter ())
+    {
+        audit_write (msg);
+        g_free (msg);
+        return;
+    }
+    audit_enqueue (msg, NULL, false);
+    audit_leave ();
+}
+
+/* Queue a tree for the logger thread, which calls fn for each leaf. Takes the
+   tree and data (freed with data_free) */
+void
+logging_audit_tree (GNode *root, GNodeTraverseFunc fn, gpointer data, GDestroyNotify data_free)
+{
+    audit_tree *tree = g_new0 (audit_tree, 1);
+
+    tree->root = root;
+    tree->fn = fn;
+    tree->data = data;
+    tree->data_free = data_free;
+    if (audit_direct || !audit_enter ())
+    {
+        audit_tree_write (tree);
+        return;
+    }
+    audit_enqueue (NULL, tree, false);
+    audit_leave ();
+}
+
+const char *
+logging_method (int flags)
+{
+    if (flags & FLAGS_METHOD_GET)
+        return "GET";
+    if (flags & FLAGS_METHOD_HEAD)
+        return "HEAD";
+    if (flags & FLAGS_METHOD_POST)
+        return "POST";
+    if (flags & FLAGS_METHOD_PUT)
+        return "PUT";
+    if (flags & FLAGS_METHOD_PATCH)
+        return "PATCH";
+    if (flags & FLAGS_METHOD_DELETE)
+        return "DELETE";
+    if (flags & FLAGS_METHOD_OPTIONS)
+        return "OPTIONS";
+    return "OTHER";
+}
+
+/* Record whether a cache answered (part of) the current request */
+void
+logging_access_cache (bool hit)
+{
+    /* A miss anywhere makes the request a miss */
+    if (access_cache != 2)
+        access_cache = hit ? 1 : 2;
+}
+
+void
+logging_access_start (void)
+{
+    access_cache = 0;
+}
+
+/* Queue a JSON line describing the finished request for the access log */
+void
+logging_access_end (int flags, const char *uri, const char *remote_user, const char *remote_addr,
+                    int length, const char *if_none_match)
+{
+    json_t *json = json_object ();
+    const char *query = strchr (uri, '?');
+    gint64 now = g_get_real_time ();
+    gint64 duration;
+    guint64 bytes_out;
+    struct tm tm;
+    time_t secs = now / G_USEC_PER_SEC;
+    char timestamp[64];
+    char *line;
+    int status;
+
+    if (!audit_enter ())
+        return;
+    metrics_request_summary (&status, &bytes_out, &duration);
+    gmtime_r (&secs, &tm);
+    strftime (timestamp, sizeof (timestamp), "%Y-%m-%dT%H:%M:%S", &tm);
+    line = g_strdup_printf ("%s.%03dZ", timestamp, (int) ((now % G_USEC_PER_SEC) / 1000));
+    json_object_set_new (json, "timestamp", json_string (line));
+    g_free (line);
+    json_object_set_new (json, "method", json_string (logging_method (flags)));
+    json_object_set_new (json, "path", query ? json_stringn (uri, query - uri) : json_string (uri));
+    json_object_set_new (json, "query", query ? json_string (query + 1) : json_null ());
+    json_object_set_new (json, "status", json_integer (status));
+    json_object_set_new (json, "bytes_in", json_integer (length > 0 ? length : 0));
+    json_object_set_new (json, "bytes_out", json_integer (bytes_out));
+    json_object_set_new (json, "duration_ms", json_real (duration / 1000.0));
+    json_object_set_new (json, "remote_user", json_string (remote_user));
+    json_object_set_new (json, "remote_addr", json_string (remote_addr));
+    json_object_set_new (json, "cache", access_cache == 1 ? json_string ("hit") :
+                         access_cache == 2 ? json_string ("miss") : json_null ());
+    json_object_set_new (json, "etag", !if_none_match || !if_none_match[0] ? json_null () :
+                         json_string (status == 304 ? "not-modified" : "modified"));
+    line = json_dumps (json, JSON_COMPACT);
+    json_decref (json);
+    if (line)
+    {
+        audit_enqueue (g_strdup_printf ("%s\n", line), NULL, true);
+        free (line);
+    }
+    audit_leave ();
+}
+
+static void
+audit_start (void)
+{
+    guint64 i;
+
+    audit_queue = g_malloc0 (AUDIT_QUEUE_SIZE * sizeof (audit_cell));
+    for (i = 0; i < AUDIT_QUEUE_SIZE; i++)
+        audit_queue[i].seq = i;
+    audit_head = audit_tail = 0;
+    audit_stop = false;
+    sem_init (&audit_sem, 0, 0);
+    __atomic_store_n (&audit_thread, g_thread_new ("audit logger", audit_logger, NULL),
+                      __ATOMIC_RELEASE);
+}
+
+static void
+audit_finish (void)
+{
+    GThread *thread = __atomic_exchange_n (&audit_thread, NULL, __ATOMIC_SEQ_CST);
+
+    if (!thread)
+        return;
+    /* Anything logged from now on is written directly. Wait for producers that
+       already started using the queue, while the logger keeps making room */
+    while (__atomic_load_n (&audit_users, __ATOMIC_ACQUIRE))
+    {
+        sem_post (&audit_sem);
+        g_usleep (100);
+    }
+    __atomic_store_n (&audit_stop, true, __ATOMIC_RELEASE);
+    sem_post (&audit_sem);
+    g_thread_join (thread);
+    sem_destroy (&audit_sem);
+    g_free (audit_queue);
+    audit_queue = NULL;
+
+    logging_access = false;
+    if (access_fp)
+        fclose (access_fp);
+    access_fp = NULL;
+    g_free (access_path);
+    access_path = NULL;
+}
+
+/* Parse a duration such as 250ms, 2s or 500us (milliseconds if no unit) */
+static gint64
+parse_slow_threshold (const char *value)
+{
+    char *end = NULL;
+    gint64 duration = g_ascii_strtoll (value, &end, 10);
+
+    if (end == value || duration < 0)
+        return 0;
+    if (*end == '\0' || g_strcmp0 (end, "ms") == 0)
+        return duration * 1000;
+    if (g_strcmp0 (end, "s") == 0)
+        return duration * 1000000;
+    if (g_strcmp0 (end, "us") == 0)
+        return duration;
+    return 0;
+}
+
+/* Parse a size such as 10M, 512K or 1G (bytes if no unit) */
+static gint64
+parse_size (const char *value)
+{
+    char *end = NULL;
+    gint64 size = g_ascii_strtoll (value, &end, 10);
+
+    if (end == value || size <= 0)
+        return ACCESS_SIZE_DEFAULT;
+    if (*end == 'K' || *end == 'k')
+        size *= 1024;
+    else if (*end == 'M' || *end == 'm')
+        size *= 1024 * 1024;
+    else if (*end == 'G' || *end == 'g')
+        size *= 1024 * 1024 * 1024;
+    return size;
+}
+
+/* Parse a sample rate such as 1/100 as log one in every 100 */
+static int
+parse_slow_sample (const char *value)
+{
+    int num, den;
+
+    if (sscanf (value, "%d/%d", &num, &den) != 2 || num <= 0 || den <= 0)
+        return 1;
+    return MAX (den / num, 1);
+}
+
 static int
 load_logging_options (void)
 {
@@ -40,6 +509,11 @@ load_logging_options (void)
     int count;
     int i;
     int flags = LOG_NONE;
+    gint64 slow_usec = 0;
+    int slow_sample = 1;
+    logging_overflow overflow = LOG_OVERFLOW_BLOCK;
+    char *access = NULL;
+    gint64 access_max = ACCESS_SIZE_DEFAULT;
     int ret = 0;
 
     buf = g_malloc0 (READ_BUF_SIZE);
@@ -51,7 +525,7 @@ load_logging_options (void)
         {
             /* Remove any trailing LF */
             buf[strcspn(buf, "\n")] = '\0';
-            split = g_strsplit (buf, " ", 6);
+            split = g_strsplit (buf, " ", -1);
             count = g_strv_length (split);
             for (i = 0; i < count; i++)
             {
@@ -67,6 +541,21 @@ load_logging_options (void)
                     flags |= LOG_GET;
                 else if (g_strcmp0 (split[i], "head") == 0)
                     flags |= LOG_HEAD;
+                else if (g_str_has_prefix (split[i], "slow="))
+                    slow_usec = parse_slow_threshold (split[i] + strlen ("slow="));
+                else if (g_str_has_prefix (split[i], "slow-sample="))
+                    slow_sample = parse_slow_sample (split[i] + strlen ("slow-sample="));
+                else if (g_strcmp0 (split[i], "overflow=block") == 0)
+                    overflow = LOG_OVERFLOW_BLOCK;
+                else if (g_strcmp0 (split[i], "overflow=drop") == 0)
+                    overflow = LOG_OVERFLOW_DROP;
+                else if (g_str_has_prefix (split[i], "access=") && split[i][strlen ("access=")])
+                {
+                    g_free (access);
+                    access = g_strdup (split[i] + strlen ("access="));
+                }
+                else if (g_str_has_prefix (split[i], "access-size="))
+                    access_max = parse_size (split[i] + strlen ("access-size="));
             }
             g_strfreev (split);
         }
@@ -79,6 +568,22 @@ load_logging_options (void)
     g_free (filename);
     g_free (buf);
     logging = flags;
+    logging_slow_sample = slow_sample;
+    logging_slow_usec = slow_usec;
+    logging_audit_overflow = overflow;
+
+    /* The logger thread reopens the access log if the file has changed */
+    g_mutex_lock (&access_lock);
+    if (g_strcmp0 (access, access_path) != 0 && access_fp)
+    {
+        fclose (access_fp);
+        access_fp = NULL;
+    }
+    g_free (access_path);
+    access_path = access;
+    access_size_max = access_max;
+    g_mutex_unlock (&access_lock);
+    logging_access = access != NULL;
 
     return ret;
 }
@@ -149,6 +654,8 @@ logging_open_inotify (void)
 void
 logging_shutdown (void)
 {
+    audit_finish ();
+
     if (inotify_fd >= 0)
         close (inotify_fd);
 
@@ -184,6 +691,7 @@ logging_init (const char *path, const char *logging_arg)
     g_io_channel_unref (channel);
 
     openlog ("restconf", LOG_PID | LOG_NDELAY, LOG_USER);
+    audit_start ();
 
     return 0;
 }
@@ -32,6 +32,13 @@ int default_accept_encoding = FLAGS_ACCEPT_JSON;
 int default_content_encoding = FLAGS_CONTENT_JSON;
 bool rest_use_arrays = false;
 bool rest_use_types = false;
+bool rest_server_timing = false;
+char *rest_snapshot = NULL;
+bool rest_lazy_models = false;
+int rest_rpc_states = 1;
+char *rest_rpc_cache = NULL;
+int rest_rpc_time_budget = 0;
+int rest_rpc_instruction_budget = 0;
 
 /* Logging Path */
 static gchar *logging_arg = NULL;
@@ -47,8 +54,9 @@ termination_handler (gpointer arg1)
 void
 help (char *app_name)
 {
-    printf ("Usage: %s [-h] [-b] [-d] [-v] [-a] [-t] [-l <path>] [-m <path>] [-r <path>] [-p <pidfile>]\n"
-            "                [-r] [-s <socket>] [-e <encoding>]\n"
+    printf ("Usage: %s [-h] [-b] [-d] [-v] [-a] [-t] [-T] [-l <path>] [-m <path>] [-r <path>] [-p <pidfile>]\n"
+            "                [-r] [-s <socket>] [-e <encoding>] [-c <file>] [-L] [-j <count>]\n"
+            "                [-w <ms>] [-i <count>] [-C <path>]\n"
             "  -h   show this help\n"
             "  -b   background mode\n"
             "  -d   enable debug\n"
@@ -56,9 +64,16 @@ help (char *app_name)
             "  -e   set default data encoding (defaults to \"application/json\")\n"
             "  -a   enable the use of JSON arrays for lists\n"
             "  -t   encode values as JSON types where possible\n"
+            "  -T   report the time spent in each stage of every request in a Server-Timing header\n"
             "  -l   name of a file containing a list of events to log\n"
             "  -m   search <path> for modules\n"
+            "  -c   keep a snapshot of the generated /api.xml in <file> to speed up restarts\n"
+            "  -L   only index the modules at startup and load each one when first needed\n"
             "  -r   search <path> for rpc handlers\n"
+            "  -j   run rpc handlers in <count> independent Lua states (defaults to 1)\n"
+            "  -C   keep compiled rpc handlers in <path> to speed up restarts\n"
+            "  -w   abort rpc handlers that run for longer than <ms> milliseconds\n"
+            "  -i   abort rpc handlers that run more than <count> Lua instructions\n"
             "  -p   use <pidfile> (defaults to " DEFAULT_APP_PID ")\n"
             "  -s   rest socket <socket> (defaults to " DEFAULT_REST_SOCK ")\n", app_name);
 }
@@ -76,7 +91,7 @@ main (int argc, char *argv[])
     int rc = EXIT_SUCCESS;
 
     /* Parse options */
-    while ((i = getopt (argc, argv, "bdvatm:l:r:s:p:e:h")) != -1)
+    while ((i = getopt (argc, argv, "bdvatTLm:l:r:s:p:e:c:j:w:i:C:h")) != -1)
     {
         switch (i)
         {
@@ -114,15 +129,42 @@ main (int argc, char *argv[])
         case 't':
             rest_use_types = true;
             break;
+        case 'T':
+            rest_server_timing = true;
+            break;
         case 'l':
             logging_arg = optarg;
             break;
         case 'm':
             path = optarg;
             break;
+        case 'c':
+            rest_snapshot = optarg;
+            break;
+        case 'L':
+            rest_lazy_models = true;
+            break;
         case 'r':
             rpc = optarg;
             break;
+        case 'j':
+            rest_rpc_states = atoi (optarg);
+            if (rest_rpc_states < 1)
+            {
+                printf ("ERROR: Expect a count of at least 1 Lua state\n");
+                help (argv[0]);
+                return 0;
+            }
+            break;
+        case 'C':
+            rest_rpc_cache = optarg;
+            break;
+        case 'w':
+            rest_rpc_time_budget = atoi (optarg);
+            break;
+        case 'i':
+            rest_rpc_instruction_budget = atoi (optarg);
+            break;
         case 's':
             socket = optarg;
             break;
@@ -202,14 +244,15 @@ main (int argc, char *argv[])
 
   exit:
 
-    /* Cleanup logging */
-    if (logging_arg)
-        logging_shutdown ();
-
     /* Cleanup FCGI */
     fcgi_stop ();
 
-    /* Cleanup rpc */
+    /* Cleanup logging (after the requests that may still be logging) */
+    if (logging_arg)
+        logging_shutdown ();
+
+    /* Cleanup rpc (after any async jobs) */
+    rest_jobs_shutdown ();
     if (rpc)
         rest_rpc_shutdown ();
 
@@ -219,6 +262,9 @@ main (int argc, char *argv[])
     /* Cleanup client library */
     apteryx_shutdown ();
 
+    /* Cleanup metrics */
+    metrics_shutdown ();
+
     /* GLib main loop is done */
     g_main_loop_unref (g_loop);
 
@@ -0,0 +1,487 @@
+/**
+ * @file metrics.c
+ * Runtime metrics for apteryx-rest
+ *
+ * Copyright 2024, Allied Telesis Labs New Zealand, Ltd
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program. If not, see <https://www.gnu.org/licenses/>.
+ */
+#include "internal.h"
+
+/* Every thread that records metrics owns a slot and is the only writer
+   of the counters in it. A scrape adds up all the slots, so recording
+   never takes a lock or shares a cache line with another thread. */
+
+/* Histogram bucket upper bounds in microseconds (the last bucket is +Inf) */
+static const gint64 bucket_bounds[METRICS_BUCKETS - 1] = {
+    1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000,
+    1000000, 2500000, 5000000, 10000000,
+};
+
+typedef enum
+{
+    METRICS_METHOD_GET,
+    METRICS_METHOD_HEAD,
+    METRICS_METHOD_POST,
+    METRICS_METHOD_PUT,
+    METRICS_METHOD_PATCH,
+    METRICS_METHOD_DELETE,
+    METRICS_METHOD_OPTIONS,
+    METRICS_METHOD_OTHER,
+    METRICS_METHOD_MAX,
+} metrics_method;
+
+static const char *method_names[METRICS_METHOD_MAX] = {
+    "GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "OTHER",
+};
+
+/* Status codes reported individually - anything else is reported as "other" */
+static const int status_codes[] = {
+    200, 201, 202, 204, 304, 400, 401, 403, 404, 405, 409, 412, 415, 424, 500, 501,
+};
+#define METRICS_STATUS_OTHER    (sizeof (status_codes) / sizeof (status_codes[0]))
+#define METRICS_STATUS_MAX      (METRICS_STATUS_OTHER + 1)
+
+/* Top level models are registered as they are first seen (successfully) */
+#define METRICS_MODELS_MAX      32
+#define METRICS_MODEL_OTHER     METRICS_MODELS_MAX
+#define METRICS_MODEL_NAME_MAX  64
+static char *g_models[METRICS_MODELS_MAX];
+static int g_models_count = 0;
+static GMutex g_models_lock;
+
+typedef struct _metrics_series
+{
+    guint64 count[METRICS_STATUS_MAX];
+    guint64 sum_us[METRICS_STATUS_MAX];
+    guint64 buckets[METRICS_STATUS_MAX][METRICS_BUCKETS];
+} metrics_series;
+
+typedef struct _metrics_slot
+{
+    struct _metrics_slot *next;
+    metrics_series *series[METRICS_METHOD_MAX][METRICS_MODELS_MAX + 1];
+    gint64 in_flight;
+    gint64 watches;
+    guint64 watch_events;
+    guint64 bytes_in;
+    guint64 bytes_out;
+} metrics_slot;
+
+/* All slots ever created, and the ones released by threads that have exited */
+static metrics_slot *g_slots = NULL;
+static GSList *g_slots_free = NULL;
+static GMutex g_slots_lock;
+static bool g_slots_shutdown = false;
+
+static void metrics_slot_release (gpointer data);
+static GPrivate metrics_slot_key = G_PRIVATE_INIT (metrics_slot_release);
+
+/* The request currently being handled by this thread */
+static __thread req_handle request_handle = NULL;
+static __thread gint64 request_start;
+static __thread int request_status;
+static __thread guint64 request_bytes;
+static __thread char request_model[METRICS_MODEL_NAME_MAX];
+
+/* Only the owning thread writes a slot counter, so no locked instruction is needed */
+#define SLOT_ADD(counter, value) \
+    __atomic_store_n (&(counter), (counter) + (value), __ATOMIC_RELAXED)
+
+static void
+metrics_slot_release (gpointer data)
+{
+    g_mutex_lock (&g_slots_lock);
+    if (!g_slots_shutdown)
+        g_slots_free = g_slist_prepend (g_slots_free, data);
+    g_mutex_unlock (&g_slots_lock);
+}
+
+static metrics_slot *
+metrics_slot_get (void)
+{
+    metrics_slot *slot = g_private_get (&metrics_slot_key);
+    if (!slot)
+    {
+        /* Reuse the counters of an exited thread so the totals carry on */
+        g_mutex_lock (&g_slots_lock);
+        if (g_slots_free)
+        {
+            slot = g_slots_free->data;
+            g_slots_free = g_slist_delete_link (g_slots_free, g_slots_free);
+        }
+        else
+        {
+            slot = g_malloc0 (sizeof (metrics_slot));
+            slot->next = g_slots;
+            g_slots = slot;
+        }
+        g_mutex_unlock (&g_slots_lock);
+        g_private_set (&metrics_slot_key, slot);
+    }
+    return slot;
+}
+
+static metrics_series *
+metrics_series_get (metrics_slot *slot, int method, int model)
+{
+    metrics_series *series = __atomic_load_n (&slot->series[method][model], __ATOMIC_ACQUIRE);
+    if (!series)
+    {
+        series = g_malloc0 (sizeof (metrics_series));
+        __atomic_store_n (&slot->series[method][model], series, __ATOMIC_RELEASE);
+    }
+    return series;
+}
+
+static int
+metrics_model_index (const char *name, bool add)
+{
+    int count = __atomic_load_n (&g_models_count, __ATOMIC_ACQUIRE);
+    int i;
+
+    for (i = 0; i < count; i++)
+    {
+        if (strcmp (g_models[i], name) == 0)
+            return i;
+    }
+    if (!add)
+        return METRICS_MODEL_OTHER;
+
+    g_mutex_lock (&g_models_lock);
+    count = g_models_count;
+    for (; i < count; i++)
+    {
+        if (strcmp (g_models[i], name) == 0)
+            break;
+    }
+    if (i == count)
+    {
+        if (count < METRICS_MODELS_MAX)
+        {
+            g_models[count] = g_strdup (name);
+            __atomic_store_n (&g_models_count, count + 1, __ATOMIC_RELEASE);
+        }
+        else
+            i = METRICS_MODEL_OTHER;
+    }
+    g_mutex_unlock (&g_models_lock);
+    return i;
+}
+
+static int
+metrics_status_index (int status)
+{
+    int i;
+
+    for (i = 0; i < METRICS_STATUS_OTHER; i++)
+    {
+        if (status_codes[i] == status)
+            return i;
+    }
+    return METRICS_STATUS_OTHER;
+}
+
+static int
+metrics_method_index (int flags)
+{
+    if (flags & FLAGS_METHOD_GET)
+        return METRICS_METHOD_GET;
+    if (flags & FLAGS_METHOD_HEAD)
+        return METRICS_METHOD_HEAD;
+    if (flags & FLAGS_METHOD_POST)
+        return METRICS_METHOD_POST;
+    if (flags & FLAGS_METHOD_PUT)
+        return METRICS_METHOD_PUT;
+    if (flags & FLAGS_METHOD_PATCH)
+        return METRICS_METHOD_PATCH;
+    if (flags & FLAGS_METHOD_DELETE)
+        return METRICS_METHOD_DELETE;
+    if (flags & FLAGS_METHOD_OPTIONS)
+        return METRICS_METHOD_OPTIONS;
+    return METRICS_METHOD_OTHER;
+}
+
+int
+metrics_bucket (gint64 usec)
+{
+    int i;
+
+    for (i = 0; i < METRICS_BUCKETS - 1; i++)
+    {
+        if (usec <= bucket_bounds[i])
+            break;
+    }
+    return i;
+}
+
+void
+metrics_histogram (GString *out, const char *name, const char *labels,
+                   const guint64 *buckets, guint64 sum_us)
+{
+    guint64 total = 0;
+    int i;
+
+    for (i = 0; i < METRICS_BUCKETS; i++)
+    {
+        total += buckets[i];
+        if (i < METRICS_BUCKETS - 1)
+            g_string_append_printf (out, "%s_bucket{%s,le=\"%g\"} %" PRIu64 "\n",
+                                    name, labels, bucket_bounds[i] / 1000000.0, total);
+        else
+            g_string_append_printf (out, "%s_bucket{%s,le=\"+Inf\"} %" PRIu64 "\n",
+                                    name, labels, total);
+    }
+    g_string_append_printf (out, "%s_sum{%s} %.6f\n", name, labels, sum_us / 1000000.0);
+    g_string_append_printf (out, "%s_count{%s} %" PRIu64 "\n", name, labels, total);
+}
+
+void
+metrics_request_start (req_handle handle, int length)
+{
+    metrics_slot *slot = metrics_slot_get ();
+
+    request_handle = handle;
+    request_start = g_get_monotonic_time ();
+    request_status = 0;
+    request_bytes = 0;
+    request_model[0] = '\0';
+    SLOT_ADD (slot->in_flight, 1);
+    if (length > 0)
+        SLOT_ADD (slot->bytes_in, length);
+}
+
+/* Label the request with a top-level model that was found in the schema */
+void
+metrics_request_model (const char *model)
+{
+    g_strlcpy (request_model, model, METRICS_MODEL_NAME_MAX);
+}
+
+void
+metrics_request_end (int flags)
+{
+    metrics_slot *slot = metrics_slot_get ();
+    gint64 duration = g_get_monotonic_time () - request_start;
+    int status = request_status ? : 200;
+    metrics_series *series;
+    int sindex;
+
+    /* Only register new models for requests that found something */
+    series = metrics_series_get (slot, metrics_method_index (flags),
+                                 metrics_model_index (request_model[0] ? request_model : "/",
+                                                      status < 400));
+    sindex = metrics_status_index (status);
+    SLOT_ADD (series->count[sindex], 1);
+
+    /* Streams stay open for as long as the client wants so are only counted */
+    if (!(flags & (FLAGS_EVENT_STREAM | FLAGS_APPLICATION_STREAM)))
+    {
+        SLOT_ADD (series->sum_us[sindex], duration);
+        SLOT_ADD (series->buckets[sindex][metrics_bucket (duration)], 1);
+    }
+    SLOT_ADD (slot->in_flight, -1);
+    request_handle = NULL;
+}
+
+void
+metrics_response (req_handle handle, const char *data, size_t length)
+{
+    metrics_slot *slot = metrics_slot_get ();
+
+    SLOT_ADD (slot->bytes_out, length);
+    if (handle != request_handle)
+        return;
+    request_bytes += length;
+    if (request_status == 0 && strncmp (data, "Status: ", strlen ("Status: ")) == 0)
+        request_status = strtol (data + strlen ("Status: "), NULL, 10);
+}
+
+/* Status, bytes sent and time taken so far for the request being handled by this thread */
+void
+metrics_request_summary (int *status, guint64 *bytes_out, gint64 *duration)
+{
+    *status = request_status ? : 200;
+    *bytes_out = request_bytes;
+    *duration = g_get_monotonic_time () - request_start;
+}
+
+void
+metrics_watch (bool active)
+{
+    metrics_slot *slot = metrics_slot_get ();
+    SLOT_ADD (slot->watches, active ? 1 : -1);
+}
+
+void
+metrics_watch_event (void)
+{
+    metrics_slot *slot = metrics_slot_get ();
+    SLOT_ADD (slot->watch_events, 1);
+}
+
+/* Return the metrics in the Prometheus text exposition format */
+char *
+metrics_dump (void)
+{
+    metrics_series *totals[METRICS_METHOD_MAX][METRICS_MODELS_MAX + 1] = { { NULL } };
+    GString *out = g_string_new (NULL);
+    gint64 in_flight = 0;
+    gint64 watches = 0;
+    guint64 watch_events = 0;
+    guint64 bytes_in = 0;
+    guint64 bytes_out = 0;
+    metrics_slot *slot;
+    int models;
+    int m, n, s, b;
+
+    /* Add up all the slots */
+    g_mutex_lock (&g_slots_lock);
+    for (slot = g_slots; slot; slot = slot->next)
+    {
+        in_flight += __atomic_load_n (&slot->in_flight, __ATOMIC_RELAXED);
+        watches += __atomic_load_n (&slot->watches, __ATOMIC_RELAXED);
+        watch_events += __atomic_load_n (&slot->watch_events, __ATOMIC_RELAXED);
+        bytes_in += __atomic_load_n (&slot->bytes_in, __ATOMIC_RELAXED);
+        bytes_out += __atomic_load_n (&slot->bytes_out, __ATOMIC_RELAXED);
+        for (m = 0; m < METRICS_METHOD_MAX; m++)
+        {
+            for (n = 0; n <= METRICS_MODELS_MAX; n++)
+            {
+                metrics_series *series = __atomic_load_n (&slot->series[m][n], __ATOMIC_ACQUIRE);
+                if (!series)
+                    continue;
+                if (!totals[m][n])
+                    totals[m][n] = g_malloc0 (sizeof (metrics_series));
+                for (s = 0; s < METRICS_STATUS_MAX; s++)
+                {
+                    totals[m][n]->count[s] += __atomic_load_n (&series->count[s], __ATOMIC_RELAXED);
+                    totals[m][n]->sum_us[s] += __atomic_load_n (&series->sum_us[s], __ATOMIC_RELAXED);
+                    for (b = 0; b < METRICS_BUCKETS; b++)
+                        totals[m][n]->buckets[s][b] +=
+                            __atomic_load_n (&series->buckets[s][b], __ATOMIC_RELAXED);
+                }
+            }
+        }
+    }
+    g_mutex_unlock (&g_slots_lock);
+    models = __atomic_load_n (&g_models_count, __ATOMIC_ACQUIRE);
+
+    g_string_append (out, "# HELP apteryx_rest_requests_total Requests handled.\n"
+                          "# TYPE apteryx_rest_requests_total counter\n");
+    for (m = 0; m < METRICS_METHOD_MAX; m++)
+    {
+        for (n = 0; n <= METRICS_MODELS_MAX; n++)
+        {
+            if (!totals[m][n])
+                continue;
+            for (s = 0; s < METRICS_STATUS_MAX; s++)
+            {
+                if (!totals[m][n]->count[s])
+                    continue;
+                g_string_append_printf (out, "apteryx_rest_requests_total{method=\"%s\",status=\"",
+                                        method_names[m]);
+                if (s < METRICS_STATUS_OTHER)
+                    g_string_append_printf (out, "%d", status_codes[s]);
+                else
+                    g_string_append (out, "other");
+                g_string_append_printf (out, "\",model=\"%s\"} %" PRIu64 "\n",
+                                        n < models ? g_models[n] : "other", totals[m][n]->count[s]);
+            }
+        }
+    }
+    g_string_append (out, "# HELP apteryx_rest_request_duration_seconds Time taken to handle requests.\n"
+                          "# TYPE apteryx_rest_request_duration_seconds histogram\n");
+    for (m = 0; m < METRICS_METHOD_MAX; m++)
+    {
+        for (n = 0; n <= METRICS_MODELS_MAX; n++)
+        {
+            if (!totals[m][n])
+                continue;
+            for (s = 0; s < METRICS_STATUS_MAX; s++)
+            {
+                char *labels;
+                guint64 timed = 0;
+
+                for (b = 0; b < METRICS_BUCKETS; b++)
+                    timed += totals[m][n]->buckets[s][b];
+                if (!timed)
+                    continue;
+                if (s < METRICS_STATUS_OTHER)
+                    labels = g_strdup_printf ("method=\"%s\",status=\"%d\",model=\"%s\"", method_names[m],
+                                              status_codes[s], n < models ? g_models[n] : "other");
+                else
+                    labels = g_strdup_printf ("method=\"%s\",status=\"other\",model=\"%s\"", method_names[m],
+                                              n < models ? g_models[n] : "other");
+                metrics_histogram (out, "apteryx_rest_request_duration_seconds", labels,
+                                   totals[m][n]->buckets[s], totals[m][n]->sum_us[s]);
+                g_free (labels);
+            }
+            g_free (totals[m][n]);
+        }
+    }
+
+    g_string_append_printf (out, "# HELP apteryx_rest_requests_in_flight Requests currently being handled.\n"
+                                 "# TYPE apteryx_rest_requests_in_flight gauge\n"
+                                 "apteryx_rest_requests_in_flight %" PRId64 "\n", in_flight);
+    g_string_append_printf (out, "# HELP apteryx_rest_queue_depth Requests waiting for a worker thread.\n"
+                                 "# TYPE apteryx_rest_queue_depth gauge\n"
+                                 "apteryx_rest_queue_depth %u\n", fcgi_queue_depth ());
+    g_string_append_printf (out, "# HELP apteryx_rest_watches_active Open watch (stream) subscriptions.\n"
+                                 "# TYPE apteryx_rest_watches_active gauge\n"
+                                 "apteryx_rest_watches_active %" PRId64 "\n", watches);
+    g_string_append_printf (out, "# HELP apteryx_rest_watch_events_total Events sent to watch subscriptions.\n"
+                                 "# TYPE apteryx_rest_watch_events_total counter\n"
+                                 "apteryx_rest_watch_events_total %" PRIu64 "\n", watch_events);
+    rest_rpc_metrics (out);
+    g_string_append_printf (out, "# HELP apteryx_rest_received_bytes_total Request body bytes received.\n"
+                                 "# TYPE apteryx_rest_received_bytes_total counter\n"
+                                 "apteryx_rest_received_bytes_total %" PRIu64 "\n", bytes_in);
+    g_string_append_printf (out, "# HELP apteryx_rest_sent_bytes_total Response bytes sent.\n"
+                                 "# TYPE apteryx_rest_sent_bytes_total counter\n"
+                                 "apteryx_rest_sent_bytes_total %" PRIu64 "\n", bytes_out);
+    g_string_append_printf (out, "# HELP apteryx_rest_audit_dropped_total Audit log records dropped because the queue was full.\n"
+                                 "# TYPE apteryx_rest_audit_dropped_total counter\n"
+                                 "apteryx_rest_audit_dropped_total %" PRIu64 "\n",
+                            __atomic_load_n (&logging_audit_dropped, __ATOMIC_RELAXED));
+    return g_string_free (out, false);
+}
+
+void
+metrics_shutdown (void)
+{
+    metrics_slot *slot;
+    int m, n;
+    int i;
+
+    g_mutex_lock (&g_slots_lock);
+    g_slots_shutdown = true;
+    while ((slot = g_slots) != NULL)
+    {
+        g_slots = slot->next;
+        for (m = 0; m < METRICS_METHOD_MAX; m++)
+            for (n = 0; n <= METRICS_MODELS_MAX; n++)
+                g_free (slot->series[m][n]);
+        g_free (slot);
+    }
+    g_slist_free (g_slots_free);
+    g_slots_free = NULL;
+    g_mutex_unlock (&g_slots_lock);
+
+    g_mutex_lock (&g_models_lock);
+    for (i = 0; i < g_models_count; i++)
+        g_free (g_models[i]);
+    g_models_count = 0;
+    g_mutex_unlock (&g_models_lock);
+}
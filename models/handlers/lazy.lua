@@ -0,0 +1,4 @@
+-- Loaded on the first call of /rpctest/lazy in each Lua state (see testing-rpc.lua)
+return function (input, path, method)
+    return { source = "handlers/lazy.lua" }
+end
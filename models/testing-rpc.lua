@@ -0,0 +1,67 @@
+-- RPC handlers for the testing-rpc model. run.sh starts two Lua states, so
+-- lookup reports its count along with a name that is unique to its state
+local state = tostring ({})
+local lookups = 0
+
+local function dump (input, path, method)
+    for index, text in ipairs ({ "one", "two", "three" }) do
+        coroutine.yield ({ line = { [index] = { index = index, text = text } } })
+        if input.fail then
+            return false, "dump failed"
+        end
+    end
+    return true
+end
+
+return {
+    -- The wildcard handler is registered first so the exact one has to win on its own
+    { path = "/rpctest/pick-*", methods = { "POST" }, handler = function (input, path, method)
+        return { handler = "wildcard" }
+    end },
+    { path = "/rpctest/pick-exact", methods = { "POST" }, handler = function (input, path, method)
+        return { handler = "exact" }
+    end },
+    { path = "/rpctest/deep/item/*/run", methods = { "POST" }, handler = function (input, path, method)
+        return true
+    end },
+    { path = "/rpctest/slow", methods = { "POST" }, async = true, handler = function (input, path, method)
+        local stop = os.time () + (tonumber (input.seconds) or 1)
+        while os.time () < stop do end
+        return { echo = input.value }
+    end },
+    { path = "/rpctest/lookup", methods = { "GET", "POST" }, cache = { ttl = 60, key = { "name" } }, handler = function (input, path, method)
+        lookups = lookups + 1
+        return { name = input.name, count = state .. " " .. lookups }
+    end },
+    { path = "/rpctest/lookup-reset", methods = { "POST" }, handler = function (input, path, method)
+        rpc_cache_invalidate ("/rpctest/lookup")
+        return true
+    end },
+    { path = "/rpctest/spin", methods = { "POST" }, budget = { instructions = 100000 }, handler = function (input, path, method)
+        while true do end
+    end },
+    { path = "/rpctest/view", methods = { "POST" }, views = true, handler = function (input, path, method, out)
+        if input.write then
+            local ok, err = pcall (function () input.write = "again" end)
+            return false, ok and "input was changed" or err
+        end
+        if input.empty then
+            out.empty = {}
+            return true
+        end
+        local names = {}
+        for name, value in pairs (input.fields) do
+            names[#names + 1] = name .. "=" .. value
+        end
+        table.sort (names)
+        out:set ("count", #input.fields)
+        out:set ("names", table.concat (names, ","))
+        out:node ("detail"):set ("level", "high")
+        out.extra = { note = "from a table" }
+        return true
+    end },
+    { path = "/rpctest/lazy", methods = { "POST" }, handler = "handlers/lazy.lua" },
+    { path = "/rpctest/dump", methods = { "POST" }, stream = true, handler = dump },
+    { path = "/rpctest/dump-job", methods = { "POST" }, stream = true, async = true, handler = dump },
+    { path = "/rpctest/dump-raw", methods = { "POST" }, stream = true, handler = dump },
+}
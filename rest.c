@@ -22,9 +22,16 @@ extern bool add_callback (const char *type, const char *path, void *fn, bool val
                           void *data, uint32_t flags, guint timeout_ms);
 extern bool delete_callback (const char *type, const char *path, void *fn, void *data);
 #include <jansson.h>
+#include <libxml/xmlreader.h>
+#include <zlib.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <sys/inotify.h>
+#include <fcntl.h>
 
 #define HTTP_CODE_OK                    200
 #define HTTP_CODE_CREATED               201
+#define HTTP_CODE_ACCEPTED              202
 #define HTTP_CODE_NO_CONTENT            204
 #define HTTP_CODE_NOT_MODIFIED          304
 #define HTTP_CODE_BAD_REQUEST           400
@@ -33,7 +40,9 @@ extern bool delete_callback (const char *type, const char *path, void *fn, void
 #define HTTP_CODE_NOT_SUPPORTED         405
 #define HTTP_CODE_CONFLICT              409
 #define HTTP_CODE_PRECONDITION_FAILED   412
+#define HTTP_CODE_FAILED_DEPENDENCY     424
 #define HTTP_CODE_INTERNAL_SERVER_ERROR 500
+#define HTTP_CODE_SERVICE_UNAVAILABLE   503
 
 typedef enum
 {
@@ -63,8 +72,8 @@ typedef enum
 
 typedef struct _log_params
 {
-    const char *remote_user;
-    const char *remote_addr;
+    char *remote_user;
+    char *remote_addr;
     char *key;
     int rc;
 } log_params;
@@ -93,9 +102,94 @@ const char *error_tags[REST_E_TAG_MAX] = {
     "malformed-message"
 };
 
-static sch_instance *g_schema = NULL;
+/* Loaded data models. Requests pin the current instance while they use it so
+   that a newer one can be published at any time */
+typedef struct _rest_schema
+{
+    sch_instance *instance;
+    guint generation;
+    int refs;
+} rest_schema;
+static rest_schema *g_schema_current = NULL;
+static guint g_schema_generation = 0;
+static GMutex g_schema_lock;
+static __thread rest_schema *g_schema_pinned = NULL;
+static __thread sch_instance *g_schema = NULL;
 static time_t g_boottime = 0;
 
+static void rest_defaults_cache_prune (guint generation);
+
+static void
+rest_schema_unpin (rest_schema *schema)
+{
+    bool last;
+
+    g_mutex_lock (&g_schema_lock);
+    last = --schema->refs == 0;
+    g_mutex_unlock (&g_schema_lock);
+    if (last)
+    {
+        rest_defaults_cache_prune (schema->generation);
+        sch_free (schema->instance);
+        g_free (schema);
+    }
+}
+
+static rest_schema *
+rest_schema_ref (rest_schema *schema)
+{
+    g_mutex_lock (&g_schema_lock);
+    schema->refs++;
+    g_mutex_unlock (&g_schema_lock);
+    return schema;
+}
+
+static rest_schema *
+rest_schema_pin (void)
+{
+    rest_schema *schema;
+
+    g_mutex_lock (&g_schema_lock);
+    schema = g_schema_current;
+    schema->refs++;
+    g_mutex_unlock (&g_schema_lock);
+    return schema;
+}
+
+/* Replace the current data models (the old instance is freed once unused) */
+static void
+rest_schema_publish (sch_instance *instance)
+{
+    rest_schema *schema = g_malloc0 (sizeof (rest_schema));
+    rest_schema *old;
+
+    schema->instance = instance;
+    schema->refs = 1;
+    g_mutex_lock (&g_schema_lock);
+    schema->generation = ++g_schema_generation;
+    old = g_schema_current;
+    g_schema_current = schema;
+    g_mutex_unlock (&g_schema_lock);
+    if (old)
+        rest_schema_unpin (old);
+}
+
+/* Use the current data models on this thread */
+static void
+rest_schema_enter (void)
+{
+    g_schema_pinned = rest_schema_pin ();
+    g_schema = g_schema_pinned->instance;
+}
+
+static void
+rest_schema_leave (void)
+{
+    rest_schema_unpin (g_schema_pinned);
+    g_schema_pinned = NULL;
+    g_schema = NULL;
+}
+
 static char *
 restconf_error (int status, rest_e_tag error_tag)
 {
@@ -150,17 +244,54 @@ restconf_error (int status, rest_e_tag error_tag)
     return output;
 }
 
+/* Write JSON text straight into a response buffer */
+static int
+rest_json_append (const char *buffer, size_t size, void *data)
+{
+    g_string_append_len ((GString *) data, buffer, size);
+    return 0;
+}
+
+/* Put the headers in front of the body. The body is moved along once to make room,
+   which replaces the copy made when formatting the headers and body together */
+static char *
+rest_response_prepend (char *headers, GString *body)
+{
+    g_string_prepend (body, headers);
+    g_free (headers);
+    return g_string_free (body, false);
+}
+
+static char *
+rest_error_response (int flags, int rc, rest_e_tag error_tag)
+{
+    char *error_string = NULL;
+    char *resp;
+
+    if (flags & FLAGS_RESTCONF)
+        error_string = restconf_error (rc, error_tag);
+    resp = g_strdup_printf ("Status: %d\r\n"
+                            "Content-Type: %s\r\n"
+                            "Content-Length: %ld\r\n"
+                            "\r\n" "%s", rc,
+                            flags & FLAGS_RESTCONF ? "application/yang-data+json" : "application/json",
+                            error_string ? strlen (error_string) : 0,
+                            error_string ? : "");
+    free (error_string);
+    return resp;
+}
+
 static void
 log_get_head (int flags, const char *path, const char *remote_user,
               const char *remote_addr, int rc)
 {
     if ((flags & FLAGS_METHOD_GET) && (logging & LOG_GET))
     {
-        NOTICE ("GET   [%3d] %s@%s %s\n", rc, remote_user, remote_addr, path);
+        AUDIT ("GET   [%3d] %s@%s %s\n", rc, remote_user, remote_addr, path);
     }
     else if ((flags & FLAGS_METHOD_HEAD) && (logging & LOG_HEAD))
     {
-        NOTICE ("HEAD  [%3d] %s@%s %s\n", rc, remote_user, remote_addr, path);
+        AUDIT ("HEAD  [%3d] %s@%s %s\n", rc, remote_user, remote_addr, path);
     }
 }
 
@@ -183,7 +314,7 @@ log_long_value (char *ptr, int len)
         }
         chunk_str = g_string_new (ptr);
         g_string_replace (chunk_str, "\n", "\\n", 0);
-        NOTICE ("%s\n", chunk_str->str);
+        AUDIT ("%s\n", chunk_str->str);
         g_string_free (chunk_str, TRUE);
         if (chunk)
         {
@@ -230,7 +361,7 @@ log_modified_leafs (GNode *node, gpointer arg)
 
     value_str = g_string_new (value);
     g_string_replace (value_str, "\n", "\\n", 0);
-    NOTICE ("%s[%3d] %s@%s %s=%s\n",
+    AUDIT ("%s[%3d] %s@%s %s=%s\n",
             params->key, params->rc, params->remote_user, params->remote_addr, path, value_str->str);
     g_string_free (value_str, TRUE);
 
@@ -259,15 +390,39 @@ log_deleted_leafs (GNode *node, gpointer arg)
     {
         path = apteryx_node_path (node);
         if (node->data)
-            NOTICE ("%s[%3d] %s@%s %s\n",
+            AUDIT ("%s[%3d] %s@%s %s\n",
                     params->key, params->rc, params->remote_user, params->remote_addr, path);
     }
     g_free (path);
     return FALSE;
 }
 
+static log_params *
+log_params_new (char *key, int rc, const char *remote_user, const char *remote_addr)
+{
+    log_params *params = g_new0 (log_params, 1);
+
+    params->remote_user = g_strdup (remote_user);
+    params->remote_addr = g_strdup (remote_addr);
+    params->key = key;
+    params->rc = rc;
+    return params;
+}
+
+static void
+log_params_free (gpointer data)
+{
+    log_params *params = (log_params *) data;
+
+    g_free (params->remote_user);
+    g_free (params->remote_addr);
+    g_free (params);
+}
+
+/* The tree is queued as a single record and expanded into leaves by the
+   audit logger, which takes the tree */
 static void
-log_post_put_patch (int flags, const char *path, GNode *root, const char *remote_user,
+log_post_put_patch (int flags, const char *path, GNode **root, const char *remote_user,
                     const char *remote_addr, int rc)
 {
     char *key = NULL;
@@ -281,74 +436,542 @@ log_post_put_patch (int flags, const char *path, GNode *root, const char *remote
 
     if (key)
     {
-        log_params params;
-        params.remote_user = remote_user;
-        params.remote_addr = remote_addr;
-        params.key = key;
-        params.rc = rc;
-        if (root)
-            g_node_traverse (root, G_IN_ORDER, G_TRAVERSE_LEAVES, -1, log_modified_leafs,
-                             (gpointer) &params);
+        if (*root)
+        {
+            logging_audit_tree (*root, log_modified_leafs,
+                                log_params_new (key, rc, remote_user, remote_addr), log_params_free);
+            *root = NULL;
+        }
         else
-            NOTICE ("%s[%3d] %s@%s %s\n",
+            AUDIT ("%s[%3d] %s@%s %s\n",
                     key, rc, remote_user, remote_addr, path);
     }
 }
 
 static void
-log_delete (int flags, const char *path, GNode *tree, const char *remote_user,
+log_delete (int flags, const char *path, GNode **tree, const char *remote_user,
             const char *remote_addr, int rc)
 {
     char *key = NULL;
 
     if ((flags & FLAGS_METHOD_DELETE) && (logging & LOG_DELETE))
     {
-        log_params params;
         key = "DELETE";
+        if (tree && *tree)
+        {
+            logging_audit_tree (*tree, log_deleted_leafs,
+                                log_params_new (key, rc, remote_user, remote_addr), log_params_free);
+            *tree = NULL;
+        }
+        else
+            AUDIT ("%s[%3d] %s@%s %s\n",
+                    key, rc, remote_user, remote_addr, path);
+    }
+}
 
-        params.remote_user = remote_user;
-        params.remote_addr = remote_addr;
-        params.key = key;
-        params.rc = rc;
+/* Per request stage timing (each request runs start to finish on one worker thread) */
+static const char *timing_names[TIMING_MAX] = {
+    "read",
+    "parse",
+    "query",
+    "defaults",
+    "trim",
+    "serialize",
+    "build",
+    "apply",
+    "rpc",
+};
+static __thread bool timing_enabled;
+static __thread gint64 timing_begin;
+static __thread gint64 timing_stages[TIMING_MAX];
+static __thread guint timing_touched;
 
-        if (tree)
-            g_node_traverse (tree, G_IN_ORDER, G_TRAVERSE_LEAVES, -1, log_deleted_leafs,
-                             (gpointer) &params);
+void
+rest_timing_start (bool enabled)
+{
+    timing_enabled = enabled;
+    if (!enabled)
+        return;
+    timing_begin = g_get_monotonic_time ();
+    memset (timing_stages, 0, sizeof (timing_stages));
+    timing_touched = 0;
+}
+
+void
+rest_timing_add (timing_stage stage, gint64 start)
+{
+    if (!timing_enabled || stage >= TIMING_MAX)
+        return;
+    timing_stages[stage] += g_get_monotonic_time () - start;
+    timing_touched |= (1 << stage);
+}
+
+/* Append the stages used so far and the total in Server-Timing syntax */
+static void
+rest_timing_append (GString *out, gint64 total)
+{
+    int i;
+
+    for (i = 0; i < TIMING_MAX; i++)
+    {
+        if (timing_touched & (1 << i))
+            g_string_append_printf (out, "%s;dur=%.3f, ", timing_names[i],
+                                    timing_stages[i] / 1000.0);
+    }
+    g_string_append_printf (out, "total;dur=%.3f", total / 1000.0);
+}
+
+/* Insert a Server-Timing header after the status line of the response (consumes resp) */
+char *
+rest_timing_header (char *resp)
+{
+    GString *header;
+    char *eol;
+    char *new_resp;
+
+    if (!timing_enabled || !resp || !(eol = strstr (resp, "\r\n")))
+        return resp;
+    header = g_string_new ("Server-Timing: ");
+    rest_timing_append (header, g_get_monotonic_time () - timing_begin);
+    g_string_append (header, "\r\n");
+    eol += 2;
+    new_resp = g_strdup_printf ("%.*s%s%s", (int) (eol - resp), resp, header->str, eol);
+    g_string_free (header, true);
+    g_free (resp);
+    return new_resp;
+}
+
+static void
+log_slow (int flags, const char *path, const char *resp, const char *remote_user,
+          const char *remote_addr)
+{
+    static guint count = 0;
+    gint64 total = g_get_monotonic_time () - timing_begin;
+    const char *body;
+    GString *timings;
+    int rc = 0;
+
+    if (!timing_enabled || total < logging_slow_usec)
+        return;
+    if (logging_slow_sample > 1 &&
+        __atomic_fetch_add (&count, 1, __ATOMIC_RELAXED) % logging_slow_sample != 0)
+        return;
+
+    if (strncmp (resp, "Status: ", strlen ("Status: ")) == 0)
+        rc = strtol (resp + strlen ("Status: "), NULL, 10);
+    body = strstr (resp, "\r\n\r\n");
+    timings = g_string_new (NULL);
+    rest_timing_append (timings, total);
+    AUDIT ("SLOW  [%3d] %s@%s %s %s %zu bytes (%s)\n", rc, remote_user, remote_addr,
+            logging_method (flags), path, body ? strlen (body + 4) : 0, timings->str);
+    g_string_free (timings, true);
+}
+
+/* Responses that only change with the schema, built once and kept ready to send */
+typedef struct _rest_static
+{
+    const char *type;
+    char *data;
+    size_t length;
+    bool owned;
+    char *gzip;
+    size_t gzip_length;
+    char *etag;
+    void *map;
+    size_t map_length;
+    int refs;
+} rest_static;
+static rest_static *g_api_xml = NULL;
+static rest_static *g_api_html = NULL;
+static GMutex g_static_lock;
+/* Serialises building /api.xml, which is dropped whenever the schema changes */
+static GMutex g_static_build_lock;
+static guint g_static_generation = 0;
+static char *g_model_path = NULL;
+
+static rest_static *
+rest_static_new (const char *type, char *data, bool owned)
+{
+    rest_static *content = g_malloc0 (sizeof (rest_static));
+    z_stream stream = { 0 };
+    char *checksum;
+
+    content->type = type;
+    content->data = data;
+    content->length = strlen (data);
+    content->owned = owned;
+    content->refs = 1;
+
+    /* Content hash as the ETag */
+    checksum = g_compute_checksum_for_data (G_CHECKSUM_SHA1, (const guchar *) data, content->length);
+    content->etag = g_strndup (checksum, 16);
+    g_free (checksum);
+
+    /* Keep a gzip copy for clients that accept it */
+    if (deflateInit2 (&stream, Z_DEFAULT_COMPRESSION, Z_DEFLATED, 15 + 16, 8, Z_DEFAULT_STRATEGY) == Z_OK)
+    {
+        size_t bound = deflateBound (&stream, content->length);
+        content->gzip = g_malloc (bound);
+        stream.next_in = (Bytef *) data;
+        stream.avail_in = content->length;
+        stream.next_out = (Bytef *) content->gzip;
+        stream.avail_out = bound;
+        if (deflate (&stream, Z_FINISH) == Z_STREAM_END)
+            content->gzip_length = stream.total_out;
         else
-            NOTICE ("%s[%3d] %s@%s %s\n",
-                    key, rc, remote_user, remote_addr, path);
+        {
+            g_free (content->gzip);
+            content->gzip = NULL;
+        }
+        deflateEnd (&stream);
     }
+    return content;
 }
 
 static void
-rest_api_xml (req_handle handle)
+rest_static_free (rest_static *content)
 {
-    char *xmlbuf = sch_dump_xml (g_schema);
-    char *resp = g_strdup_printf ("Status: 200\r\n"
-                                  "Content-Type: text/xml\r\n"
-                                  "Content-Length: %ld\r\n\r\n",
-                                  strlen (xmlbuf));
-    VERBOSE ("RESP:\n%s\n", resp);
-    send_response (handle, resp, false);
-    free (resp);
-    send_response (handle, xmlbuf, true);
-    free (xmlbuf);
-    return;
+    if (!content)
+        return;
+    if (content->map)
+    {
+        /* Data and gzip point into the snapshot */
+        munmap (content->map, content->map_length);
+    }
+    else
+    {
+        if (content->owned)
+            free (content->data);
+        g_free (content->gzip);
+    }
+    g_free (content->etag);
+    g_free (content);
+}
+
+/* Take a reference to a cached response so it can be sent while the schema changes */
+static rest_static *
+rest_static_get (rest_static **content)
+{
+    rest_static *ret;
+
+    g_mutex_lock (&g_static_lock);
+    ret = *content;
+    if (ret)
+        ret->refs++;
+    g_mutex_unlock (&g_static_lock);
+    return ret;
+}
+
+static void
+rest_static_unref (rest_static *content)
+{
+    bool last;
+
+    if (!content)
+        return;
+    g_mutex_lock (&g_static_lock);
+    last = --content->refs == 0;
+    g_mutex_unlock (&g_static_lock);
+    if (last)
+        rest_static_free (content);
+}
+
+/* Snapshot of the schema derived responses so a restart with unchanged
+   models does not need to dump and compress the schema again */
+#define REST_SNAPSHOT_MAGIC "ARSNAP01"
+
+typedef struct _rest_snapshot_header
+{
+    char magic[8];
+    char manifest[72];
+    char etag[24];
+    guint64 xml_offset;
+    guint64 xml_length;
+    guint64 gzip_offset;
+    guint64 gzip_length;
+} rest_snapshot_header;
+
+static gint
+rest_snapshot_file_cmp (gconstpointer a, gconstpointer b)
+{
+    return g_strcmp0 (*(char **) a, *(char **) b);
+}
+
+/* Hash of the name, size and modification time of every file in the model path
+   (and of this program, in case the format of the dump has changed) */
+static char *
+rest_snapshot_manifest (const char *path)
+{
+    GChecksum *checksum = g_checksum_new (G_CHECKSUM_SHA256);
+    gchar **dirs = g_strsplit (path, ":", 0);
+    char *manifest;
+    struct stat st;
+    int i;
+
+    if (stat ("/proc/self/exe", &st) == 0)
+    {
+        char *entry = g_strdup_printf ("%ld %ld\n", (long) st.st_size, (long) st.st_mtim.tv_sec);
+        g_checksum_update (checksum, (const guchar *) entry, strlen (entry));
+        g_free (entry);
+    }
+
+    for (i = 0; dirs[i]; i++)
+    {
+        GPtrArray *files = g_ptr_array_new_with_free_func (g_free);
+        GDir *dir = g_dir_open (dirs[i], 0, NULL);
+        const gchar *name;
+        guint f;
+
+        while (dir && (name = g_dir_read_name (dir)) != NULL)
+            g_ptr_array_add (files, g_build_filename (dirs[i], name, NULL));
+        if (dir)
+            g_dir_close (dir);
+        g_ptr_array_sort (files, rest_snapshot_file_cmp);
+        for (f = 0; f < files->len; f++)
+        {
+            char *entry;
+
+            if (stat (files->pdata[f], &st) != 0 || !S_ISREG (st.st_mode))
+                continue;
+            entry = g_strdup_printf ("%s %ld %ld.%09ld\n", (char *) files->pdata[f], (long) st.st_size,
+                                     (long) st.st_mtim.tv_sec, (long) st.st_mtim.tv_nsec);
+            g_checksum_update (checksum, (const guchar *) entry, strlen (entry));
+            g_free (entry);
+        }
+        g_ptr_array_free (files, true);
+    }
+    g_strfreev (dirs);
+    manifest = g_strdup (g_checksum_get_string (checksum));
+    g_checksum_free (checksum);
+    return manifest;
+}
+
+static rest_static *
+rest_snapshot_load (const char *manifest)
+{
+    rest_snapshot_header *header;
+    rest_static *content;
+    struct stat st;
+    void *map;
+    int fd;
+
+    fd = open (rest_snapshot, O_RDONLY);
+    if (fd < 0)
+        return NULL;
+    if (fstat (fd, &st) != 0 || st.st_size < (off_t) sizeof (rest_snapshot_header))
+    {
+        close (fd);
+        return NULL;
+    }
+    map = mmap (NULL, st.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+    close (fd);
+    if (map == MAP_FAILED)
+        return NULL;
+
+    header = (rest_snapshot_header *) map;
+    if (memcmp (header->magic, REST_SNAPSHOT_MAGIC, sizeof (header->magic)) != 0 ||
+        strncmp (header->manifest, manifest, sizeof (header->manifest)) != 0 ||
+        header->xml_offset + header->xml_length + 1 > (guint64) st.st_size ||
+        header->gzip_offset + header->gzip_length > (guint64) st.st_size ||
+        ((char *) map)[header->xml_offset + header->xml_length] != '\0')
+    {
+        DEBUG ("REST: Schema snapshot \"%s\" is stale\n", rest_snapshot);
+        munmap (map, st.st_size);
+        return NULL;
+    }
+
+    content = g_malloc0 (sizeof (rest_static));
+    content->refs = 1;
+    content->type = "text/xml";
+    content->data = (char *) map + header->xml_offset;
+    content->length = header->xml_length;
+    content->gzip = header->gzip_length ? (char *) map + header->gzip_offset : NULL;
+    content->gzip_length = header->gzip_length;
+    content->etag = g_strndup (header->etag, sizeof (header->etag));
+    content->map = map;
+    content->map_length = st.st_size;
+    DEBUG ("REST: Using schema snapshot \"%s\"\n", rest_snapshot);
+    return content;
+}
+
+static void
+rest_snapshot_save (rest_static *content, const char *manifest)
+{
+    rest_snapshot_header header = { 0 };
+    char *tmp = g_strdup_printf ("%s.XXXXXX", rest_snapshot);
+    FILE *fp = NULL;
+    bool written = false;
+    int fd;
+
+    memcpy (header.magic, REST_SNAPSHOT_MAGIC, sizeof (header.magic));
+    g_strlcpy (header.manifest, manifest, sizeof (header.manifest));
+    g_strlcpy (header.etag, content->etag, sizeof (header.etag));
+    header.xml_offset = sizeof (header);
+    header.xml_length = content->length;
+    header.gzip_offset = header.xml_offset + header.xml_length + 1;
+    header.gzip_length = content->gzip ? content->gzip_length : 0;
+
+    /* Write a new file and move it into place so readers never see part of one */
+    fd = mkstemp (tmp);
+    if (fd >= 0)
+        fp = fdopen (fd, "w");
+    if (fp)
+    {
+        written = fwrite (&header, sizeof (header), 1, fp) == 1 &&
+                  fwrite (content->data, content->length + 1, 1, fp) == 1 &&
+                  (!header.gzip_length || fwrite (content->gzip, header.gzip_length, 1, fp) == 1);
+        /* The stream (and its descriptor) is released by fclose even if it fails */
+        if (fclose (fp) != 0)
+            written = false;
+        fp = NULL;
+    }
+    else if (fd >= 0)
+        close (fd);
+    if (!written || rename (tmp, rest_snapshot) != 0)
+    {
+        ERROR ("REST: Failed to write schema snapshot \"%s\"\n", rest_snapshot);
+        unlink (tmp);
+    }
+    g_free (tmp);
 }
 
 extern char api_html[];
+
+/* Drop the cached /api.xml (call again whenever the schema changes). It is
+   taken from a valid snapshot, or built when it is first requested */
 static void
-rest_api_html (req_handle handle)
+rest_static_reset (void)
 {
-    char *resp = g_strdup_printf ("Status: 200\r\n"
-                                  "Content-Type: text/html\r\n"
-                                  "Content-Length: %ld\r\n\r\n",
-                                  strlen (api_html));
+    rest_static *api_xml = NULL;
+    rest_static *old;
+    char *manifest;
+
+    if (rest_snapshot && g_model_path)
+    {
+        manifest = rest_snapshot_manifest (g_model_path);
+        api_xml = rest_snapshot_load (manifest);
+        g_free (manifest);
+    }
+    g_mutex_lock (&g_static_lock);
+    old = g_api_xml;
+    g_api_xml = api_xml;
+    g_static_generation++;
+    g_mutex_unlock (&g_static_lock);
+    rest_static_unref (old);
+    if (!g_api_html)
+        g_api_html = rest_static_new ("text/html", api_html, false);
+}
+
+/* Take a reference to /api.xml, building it from the current schema if needed */
+static rest_static *
+rest_static_api_xml (void)
+{
+    rest_static *api_xml = rest_static_get (&g_api_xml);
+    rest_schema *schema;
+    char *manifest = NULL;
+    guint generation;
+
+    if (api_xml)
+        return api_xml;
+
+    g_mutex_lock (&g_static_build_lock);
+    api_xml = rest_static_get (&g_api_xml);
+    if (!api_xml)
+    {
+        /* A schema published from here on resets the cache again */
+        g_mutex_lock (&g_static_lock);
+        generation = g_static_generation;
+        g_mutex_unlock (&g_static_lock);
+        schema = rest_schema_pin ();
+        api_xml = rest_static_new ("text/xml", sch_dump_xml (schema->instance), true);
+        rest_schema_unpin (schema);
+        if (rest_snapshot && g_model_path)
+        {
+            manifest = rest_snapshot_manifest (g_model_path);
+            rest_snapshot_save (api_xml, manifest);
+            g_free (manifest);
+        }
+        g_mutex_lock (&g_static_lock);
+        if (generation == g_static_generation && !g_api_xml)
+        {
+            g_api_xml = api_xml;
+            api_xml->refs++;
+        }
+        g_mutex_unlock (&g_static_lock);
+    }
+    g_mutex_unlock (&g_static_build_lock);
+    return api_xml;
+}
+
+/* Check an If-None-Match header against one of our ETags */
+static bool
+rest_etag_match (const char *if_none_match, const char *etag)
+{
+    char *match;
+    bool ret;
+
+    if (!if_none_match || if_none_match[0] == '\0')
+        return false;
+    match = g_strdup (if_none_match);
+    g_strdelimit (match, "\"", ' ');
+    g_strstrip (match);
+    if (g_str_has_prefix (match, "W/"))
+        memmove (match, match + 2, strlen (match) - 1);
+    g_strstrip (match);
+    ret = g_strcmp0 (match, etag) == 0;
+    g_free (match);
+    return ret;
+}
+
+static void
+rest_api_static (req_handle handle, int flags, rest_static *content, const char *if_none_match)
+{
+    bool gzip = (flags & FLAGS_ACCEPT_GZIP) && content->gzip;
+    char *resp;
+
+    if (rest_etag_match (if_none_match, content->etag))
+    {
+        resp = g_strdup_printf ("Status: %d\r\n"
+                                "ETag: %s\r\n"
+                                "Content-Length: 0\r\n\r\n",
+                                HTTP_CODE_NOT_MODIFIED, content->etag);
+        VERBOSE ("RESP:\n%s\n", resp);
+        send_response (handle, resp, true);
+        g_free (resp);
+        return;
+    }
+
+    resp = g_strdup_printf ("Status: 200\r\n"
+                            "Content-Type: %s\r\n"
+                            "%s"
+                            "Content-Length: %ld\r\n"
+                            "ETag: %s\r\n"
+                            "Vary: Accept-Encoding\r\n\r\n",
+                            content->type, gzip ? "Content-Encoding: gzip\r\n" : "",
+                            gzip ? content->gzip_length : content->length, content->etag);
     VERBOSE ("RESP:\n%s\n", resp);
     send_response (handle, resp, false);
-    free (resp);
-    send_response (handle, api_html, true);
-    return;
+    g_free (resp);
+    if (flags & FLAGS_METHOD_HEAD)
+        send_response (handle, "", true);
+    else if (gzip)
+        send_response_data (handle, content->gzip, content->gzip_length, true);
+    else
+        send_response_data (handle, content->data, content->length, true);
+}
+
+static char *
+rest_api_metrics (int flags)
+{
+    char *metrics = metrics_dump ();
+    char *resp = g_strdup_printf ("Status: 200\r\n"
+                                  "Content-Type: text/plain; version=0.0.4\r\n"
+                                  "Content-Length: %ld\r\n"
+                                  "\r\n" "%s",
+                                  strlen (metrics),
+                                  flags & FLAGS_METHOD_HEAD ? "" : metrics);
+    g_free (metrics);
+    return resp;
 }
 
 sch_node *
@@ -370,35 +993,10 @@ rest_rpc_schema (sch_node *schema)
     return NULL;
 }
 
-static char *
-rest_rpc (int flags, GNode *node, sch_node *schema, json_t *json)
+static int
+rest_rpc_schflags (int flags)
 {
-    char *path = apteryx_node_path (node);
     int schflags = 0;
-    GNode *input = NULL;
-    GNode *output = NULL;
-    rest_e_tag error_tag = REST_E_TAG_NONE;
-    char *error_string = NULL;
-    char *data = NULL;
-    char *resp;
-    rest_rpc_error error;
-    int rc;
-
-    /* Special case: We consider /operations to be a root node and hence
-       support non-native namespaces at this node. This allows us to have
-       multiple data models with the same root rpc. */
-    if (g_ascii_strncasecmp (path, "/operations", strlen("/operations")) == 0)
-    {
-        sch_ns *ns = sch_node_ns (schema);
-        if (ns && !sch_ns_native (g_schema, ns))
-        {
-            const char *prefix = sch_ns_prefix (g_schema, ns);
-            const char *name = APTERYX_NAME (node);
-            char *_path = g_strdup_printf ("/operations/%s:%s", prefix, name);
-            free (path);
-            path = _path;
-        }
-    }
 
     /* Set formating flags for input/output */
     if (verbose)
@@ -411,84 +1009,67 @@ rest_rpc (int flags, GNode *node, sch_node *schema, json_t *json)
         schflags |= (SCH_F_NS_MODEL_NAME|SCH_F_NS_PREFIX);
     if (flags & FLAGS_CONDITIONS)
         schflags |= SCH_F_CONDITIONS;
+    return schflags;
+}
 
-    if (json)
+static int
+rest_rpc_status (rest_rpc_error error, GNode *output, rest_e_tag *error_tag)
+{
+    switch (error)
     {
-        /* RESTCONF mandates "input" (or nothing) be the primary data object
-        for rpc requests. In non-restconf mode we are more relaxed but to match
-        the data model we need to provide that top level "input" node */
-        if (!(flags & FLAGS_RESTCONF) && json_object_size (json))
+        case REST_RPC_E_NONE:
+            if (output)
+                return HTTP_CODE_OK;
+            return HTTP_CODE_NO_CONTENT;
+        case REST_RPC_E_FAIL:
+            *error_tag = REST_E_TAG_OPER_FAILED;
+            return HTTP_CODE_BAD_REQUEST;
+        case REST_RPC_E_NOT_FOUND:
+            *error_tag = REST_E_TAG_OPER_NOT_SUPPORTED;
+            return HTTP_CODE_NOT_SUPPORTED;
+        case REST_RPC_E_INTERNAL:
+            *error_tag = REST_E_TAG_OPER_FAILED;
+            return HTTP_CODE_INTERNAL_SERVER_ERROR;
+        default:
+            *error_tag = REST_E_TAG_INVALID_VALUE;
+            return HTTP_CODE_BAD_REQUEST;
+    }
+}
+
+/* Convert RPC output to json from the output node of the schema */
+static json_t *
+rest_rpc_output_json (int flags, sch_node *schema, GNode *output)
+{
+    json_t *json = sch_gnode_to_json (g_schema, schema, output, rest_rpc_schflags (flags));
+    if (json && !(flags & FLAGS_RESTCONF))
+    {
+        /* Chop off the output node */
+        json_t *json_new = json_object_iter_value (json_object_iter (json));
+        json_incref (json_new);
+        json_decref (json);
+        json = json_new;
+        /* If there is only one value in the output and we have been asked to
+        strip root elements then remove the key and return the value only */
+        if (!(flags & FLAGS_JSON_FORMAT_ROOT) && json_object_size (json) == 1)
         {
-            const char *key = NULL;
-            if (json_object_size (json) == 1)
-            {
-                key = json_object_iter_key (json_object_iter(json));
-                char *colon = key ? strchr (key, ':') : NULL;
-                if (colon) key = colon + 1;
-                if (g_strcmp0 (key, "input") != 0)
-                    key = NULL;
-            }
-            if (key == NULL)
-            {
-                json_t *obj = json_object ();
-                json_object_set_new (obj, "input", json);
-                json = obj;
-            }
-        }
-
-        /* Parse the input - always set types */
-        input = sch_json_to_gnode (g_schema, schema, json, schflags | SCH_F_JSON_TYPES);
-        json_decref (json);
-
-        /* Check parsing succeeded and we have input when required */
-        if (!input)
-        {
-            switch (sch_last_err ())
-            {
-            case SCH_E_NOSCHEMANODE:
-                rc = HTTP_CODE_NOT_FOUND;
-                error_tag = REST_E_TAG_INVALID_VALUE;
-                break;
-            case SCH_E_NOTREADABLE:
-            case SCH_E_NOTWRITABLE:
-                rc = HTTP_CODE_FORBIDDEN;
-                error_tag = REST_E_TAG_ACCESS_DENIED;
-                break;
-            default:
-                rc = HTTP_CODE_BAD_REQUEST;
-                error_tag = REST_E_TAG_INVALID_VALUE;
-                break;
-            }
-            goto exit;
+            /* Chop off the root node */
+            json_t *json_new = json_object_iter_value (json_object_iter (json));
+            json_incref (json_new);
+            json_decref (json);
+            json = json_new;
         }
     }
+    return json;
+}
 
-    error = rest_rpc_execute (flags, path, input, &output, &error_string);
-    switch (error)
-    {
-        case REST_RPC_E_NONE:
-            if (output)
-                rc = HTTP_CODE_OK;
-            else
-                rc = HTTP_CODE_NO_CONTENT;
-            break;
-        case REST_RPC_E_FAIL:
-            rc = HTTP_CODE_BAD_REQUEST;
-            error_tag = REST_E_TAG_OPER_FAILED;
-            break;
-        case REST_RPC_E_NOT_FOUND:
-            rc = HTTP_CODE_NOT_SUPPORTED;
-            error_tag = REST_E_TAG_OPER_NOT_SUPPORTED;
-            break;
-        case REST_RPC_E_INTERNAL:
-            rc = HTTP_CODE_INTERNAL_SERVER_ERROR;
-            error_tag = REST_E_TAG_OPER_FAILED;
-            break;
-        default:
-            rc = HTTP_CODE_BAD_REQUEST;
-            error_tag = REST_E_TAG_INVALID_VALUE;
-            break;
-    }
+/* Build the response to an RPC (consumes output and error_string) */
+static char *
+rest_rpc_response (int flags, sch_node *schema, int rc, rest_e_tag error_tag,
+                   GNode *output, char *error_string)
+{
+    char *data = NULL;
+    GString *body = NULL;
+    char *resp;
 
     if (output)
     {
@@ -497,31 +1078,15 @@ rest_rpc (int flags, GNode *node, sch_node *schema, json_t *json)
         if (schema)
         {
             /* Convert the data to json from the expected path offset */
-            json_t *json = sch_gnode_to_json (g_schema, schema, output, schflags);
-            if (json && !(flags & FLAGS_RESTCONF))
-            {
-                /* Chop off the output node */
-                json_t *json_new = json_object_iter_value (json_object_iter (json));
-                json_incref (json_new);
-                json_decref (json);
-                json = json_new;
-                /* If there is only one value in the output and we have been asked to
-                strip root elements then remove the key and return the value only */
-                if (!(flags & FLAGS_JSON_FORMAT_ROOT) && json_object_size (json) == 1)
-                {
-                    /* Chop off the root node */
-                    json_t *json_new = json_object_iter_value (json_object_iter (json));
-                    json_incref (json_new);
-                    json_decref (json);
-                    json = json_new;
-                }
-            }
-            if (!json || (data = json_dumps (json, JSON_ENCODE_ANY)) == NULL)
+            json_t *json = rest_rpc_output_json (flags, schema, output);
+            body = g_string_new (NULL);
+            if (!json || json_dump_callback (json, rest_json_append, body, JSON_ENCODE_ANY) != 0)
             {
                 ERROR ("REST: Failed to convert rpc output to json\n");
                 rc = HTTP_CODE_INTERNAL_SERVER_ERROR;
+                g_string_free (body, true);
+                body = NULL;
             }
-            apteryx_free_tree (output);
             if (json)
                 json_decref (json);
         }
@@ -530,10 +1095,10 @@ rest_rpc (int flags, GNode *node, sch_node *schema, json_t *json)
             ERROR ("REST: no output node in schema\n");
             rc = HTTP_CODE_INTERNAL_SERVER_ERROR;
         }
+        apteryx_free_tree (output);
     }
 
-exit:
-    if (!data && rc >= 400 && rc <= 500)
+    if (!body && rc >= 400 && rc <= 599)
     {
         if (flags & FLAGS_RESTCONF)
         {
@@ -561,1298 +1126,3935 @@ exit:
         }
     }
 
+    if (!body)
+        body = g_string_new (data);
     resp = g_strdup_printf ("Status: %d\r\n"
                             "Content-Type: %s\r\n"
                             "Content-Length: %ld\r\n"
-                            "\r\n" "%s", rc,
+                            "\r\n", rc,
                             flags & FLAGS_RESTCONF ? "application/yang-data+json" : "application/json",
-                            data ? strlen (data) : 0,
-                            data ? : "");
+                            body->len);
+    resp = rest_response_prepend (resp, body);
     free (data);
     free (error_string);
-    apteryx_free_tree (input);
-    free (path);
     return resp;
 }
 
-static int
-apteryx_json_search (const char *path, char **data)
+/* RPCs whose handlers are registered as async run as jobs. The request returns
+   straight away with the URL of the job, which reports the result when done */
+#define REST_JOBS_MAX 64
+#define REST_JOBS_TTL (5 * 60 * G_USEC_PER_SEC)
+#define REST_JOBS_PATH "/.jobs/"
+
+typedef struct _rest_job
 {
-    sch_node *root, *node;
-    char *_path;
-    int len;
-    GList *children, *iter;
-    bool first = true;
-    char *buffer;
+    char *id;
+    char *path;
+    int flags;
+    rest_schema *schema;
+    sch_node *rpc;
+    GNode *input;
+    char *resp;
+    gint64 finished;
+} rest_job;
+static GHashTable *g_jobs = NULL;
+static GThreadPool *g_jobs_pool = NULL;
+static GMutex g_jobs_lock;
+static GCond g_jobs_cond;
+static __thread const char *g_rpath = NULL;
+static __thread req_handle g_handle = NULL;
 
-    /* Create a version of the path without the trailing '/' */
-    _path = strdup (path);
-    len = strlen (path);
-    _path[len - 1] = '\0';
+static void
+rest_job_free (rest_job *job)
+{
+    if (job->schema)
+        rest_schema_unpin (job->schema);
+    apteryx_free_tree (job->input);
+    g_free (job->resp);
+    g_free (job->path);
+    g_free (job->id);
+    g_free (job);
+}
 
-    /* Validate starting path */
-    if ((root = sch_lookup (g_schema, _path)) == NULL)
+static void
+rest_job_run (gpointer data, gpointer user_data)
+{
+    rest_job *job = (rest_job *) data;
+    rest_e_tag error_tag = REST_E_TAG_NONE;
+    char *error_string = NULL;
+    GNode *output = NULL;
+    rest_rpc_error error;
+    char *resp;
+    int rc;
+
+    g_schema = job->schema->instance;
+    error = rest_rpc_execute (job->flags, job->path, job->input, &output, &error_string);
+    rc = rest_rpc_status (error, output, &error_tag);
+    resp = rest_rpc_response (job->flags, job->rpc, rc, error_tag, output, error_string);
+    g_schema = NULL;
+
+    g_mutex_lock (&g_jobs_lock);
+    job->resp = resp;
+    job->finished = g_get_monotonic_time ();
+    rest_schema_unpin (job->schema);
+    job->schema = NULL;
+    apteryx_free_tree (job->input);
+    job->input = NULL;
+    g_cond_broadcast (&g_jobs_cond);
+    g_mutex_unlock (&g_jobs_lock);
+}
+
+/* Forget jobs that finished too long ago (call with the jobs lock held) */
+static void
+rest_jobs_expire (void)
+{
+    gint64 now = g_get_monotonic_time ();
+    GHashTableIter iter;
+    rest_job *job;
+
+    g_hash_table_iter_init (&iter, g_jobs);
+    while (g_hash_table_iter_next (&iter, NULL, (gpointer *) &job))
     {
-        free (_path);
-        return HTTP_CODE_NOT_FOUND;
+        if (job->resp && now - job->finished > REST_JOBS_TTL)
+            g_hash_table_iter_remove (&iter);
     }
-    if (!sch_is_readable (root))
+}
+
+/* Describe a job (call with the jobs lock held) */
+static char *
+rest_job_json (rest_job *job)
+{
+    json_t *json = json_object ();
+    json_t *obj = json_object ();
+    char *data;
+
+    json_object_set_new (obj, "id", json_string (job->id));
+    json_object_set_new (obj, "rpc", json_string (job->path));
+    json_object_set_new (obj, "status", json_string (job->resp ? "completed" : "running"));
+    if (job->resp)
     {
-        free (_path);
-        return HTTP_CODE_FORBIDDEN;
+        const char *body = strstr (job->resp, "\r\n\r\n");
+        json_t *result = body && body[4] ? json_loads (body + 4, JSON_DECODE_ANY, NULL) : NULL;
+        json_object_set_new (obj, "status-code", json_integer (strtol (job->resp + strlen ("Status: "), NULL, 10)));
+        if (result)
+            json_object_set_new (obj, "result", result);
     }
+    json_object_set_new (json, "job", obj);
+    data = json_dumps (json, 0);
+    json_decref (json);
+    return data;
+}
 
-    /* Do the Apteryx search */
-    *data = g_strdup_printf ("{\"%s\": [", len > 2 ? strrchr (_path, '/') + 1 : "");
-    children = apteryx_search (path);
-    children = g_list_sort (children, (GCompareFunc) strcasecmp);
-    for (iter = children; iter; iter = g_list_next (iter))
+/* Start an async RPC (takes the input) */
+static char *
+rest_job_start (int flags, const char *path, sch_node *schema, GNode *input)
+{
+    rest_job *job;
+    char *data;
+    char *resp;
+
+    g_mutex_lock (&g_jobs_lock);
+    if (!g_jobs)
+        g_jobs = g_hash_table_new_full (g_str_hash, g_str_equal, NULL, (GDestroyNotify) rest_job_free);
+    rest_jobs_expire ();
+    if (!g_jobs_pool || g_hash_table_size (g_jobs) >= REST_JOBS_MAX)
     {
-        path = strrchr ((const char *) iter->data, '/') + 1;
-        if ((node = sch_node_child (root, path)) != NULL && sch_is_readable (node))
-        {
-            buffer = *data;
-            *data = g_strdup_printf ("%s%s\"%s\"", buffer, first ? "" : ",", path);
-            free (buffer);
-            first = false;
-        }
+        g_mutex_unlock (&g_jobs_lock);
+        ERROR ("REST: Too many RPC jobs to start \"%s\"\n", path);
+        apteryx_free_tree (input);
+        return rest_rpc_response (flags, schema, HTTP_CODE_SERVICE_UNAVAILABLE, REST_E_TAG_RESOURCE_DENIED,
+                                  NULL, g_strdup ("too many rpc jobs"));
     }
-    buffer = *data;
-    *data = g_strdup_printf ("%s]}", buffer);
-    free (buffer);
-
-    g_list_free_full (children, free);
-    free (_path);
-    return HTTP_CODE_OK;
+    job = g_malloc0 (sizeof (rest_job));
+    job->id = g_uuid_string_random ();
+    job->path = g_strdup (path);
+    job->flags = flags;
+    job->schema = rest_schema_ref (g_schema_pinned);
+    job->rpc = schema;
+    job->input = input;
+    g_hash_table_insert (g_jobs, job->id, job);
+    data = rest_job_json (job);
+    resp = g_strdup_printf ("Status: %d\r\n"
+                            "Location: %s%s%s\r\n"
+                            "Content-Type: application/json\r\n"
+                            "Content-Length: %ld\r\n"
+                            "\r\n" "%s",
+                            HTTP_CODE_ACCEPTED, g_rpath ? : "", REST_JOBS_PATH, job->id,
+                            strlen (data), data);
+    g_thread_pool_push (g_jobs_pool, job, NULL);
+    g_mutex_unlock (&g_jobs_lock);
+    DEBUG ("REST: Started job %s for \"%s\"\n", job->id, path);
+    free (data);
+    return resp;
 }
 
 static char *
-rest_api_search (int flags, const char *path, const char *if_none_match, const char *if_modified_since,
-                 const char *remote_user, const char *remote_addr)
+rest_api_job (int flags, const char *id)
 {
-    char *_path;
+    rest_job *job;
     char *data = NULL;
-    uint64_t ts = 0;
     char *resp;
-    int rc;
 
-    _path = strdup (path);
-    _path[strlen (path) - 1] = '\0';
-    ts = apteryx_timestamp (_path);
-    g_free (_path);
-    if (if_none_match && if_none_match[0] != '\0' &&
-        ts == strtoull (if_none_match, NULL, 16))
+    g_mutex_lock (&g_jobs_lock);
+    if (g_jobs)
     {
-        rc = HTTP_CODE_NOT_MODIFIED;
-        goto exit;
+        rest_jobs_expire ();
+        job = g_hash_table_lookup (g_jobs, id);
+        if (job)
+            data = rest_job_json (job);
+    }
+    g_mutex_unlock (&g_jobs_lock);
+    if (!data)
+    {
+        return g_strdup_printf ("Status: %d\r\n"
+                                "Content-Type: text/html\r\n\r\n"
+                                "Job %s not found.\n",
+                                HTTP_CODE_NOT_FOUND, id);
     }
-
-    rc = apteryx_json_search (path, &data);
-
-  exit:
-    if (logging)
-        log_get_head (FLAGS_METHOD_GET, path, remote_user, remote_addr, rc);
-
     resp = g_strdup_printf ("Status: %d\r\n"
-                            "Etag: %" PRIX64 "\r\n"
                             "Content-Type: application/json\r\n"
                             "Content-Length: %ld\r\n"
-                            "\r\n" "%s", rc, ts,
-                            data ? strlen (data) : 0,
-                            data ? : "");
+                            "\r\n" "%s",
+                            HTTP_CODE_OK, strlen (data), data);
     free (data);
     return resp;
 }
 
-static GNode*
-get_response_node (GNode *tree, int rdepth)
+/* Stream a single event once the job completes */
+static void
+rest_api_job_watch (req_handle handle, int flags, const char *id)
 {
-    GNode *rnode = tree;
-    while (--rdepth && rnode)
-        rnode = rnode->children;
-    return rnode;
+    char *data = NULL;
+    bool found = true;
+
+    while (found && !data && is_connected (handle, false))
+    {
+        rest_job *job;
+
+        g_mutex_lock (&g_jobs_lock);
+        job = g_jobs ? g_hash_table_lookup (g_jobs, id) : NULL;
+        if (job && !job->resp)
+            g_cond_wait_until (&g_jobs_cond, &g_jobs_lock, g_get_monotonic_time () + G_USEC_PER_SEC);
+        job = g_jobs ? g_hash_table_lookup (g_jobs, id) : NULL;
+        if (!job)
+            found = false;
+        else if (job->resp)
+            data = rest_job_json (job);
+        g_mutex_unlock (&g_jobs_lock);
+    }
+    if (!found)
+    {
+        char *resp = g_strdup_printf ("Status: %d\r\n"
+                                      "Content-Type: text/html\r\n\r\n"
+                                      "Job %s not found.\n",
+                                      HTTP_CODE_NOT_FOUND, id);
+        send_response (handle, resp, false);
+        g_free (resp);
+        return;
+    }
+    if (!data)
+        return;
+
+    send_response (handle, "Status: 200\r\n", false);
+    if (flags & FLAGS_APPLICATION_STREAM)
+        send_response (handle, "Content-type: application/stream+json\r\n", false);
+    else
+        send_response (handle, "Content-type: text/event-stream\r\n", false);
+    send_response (handle, "Cache-Control: 'no-cache'\r\n", false);
+    send_response (handle, "\r\n", true);
+    if (flags & FLAGS_EVENT_STREAM)
+        send_response (handle, "data: ", false);
+    send_response (handle, data, false);
+    if (flags & FLAGS_EVENT_STREAM)
+        send_response (handle, "\r\n\r\n", true);
+    else
+        send_response (handle, "\r\n", true);
+    free (data);
 }
 
-static char *
-rest_api_get (int flags, const char *path, const char *if_none_match, const char *if_modified_since,
-              const char *remote_user, const char *remote_addr)
+/* RPCs whose handlers are registered with stream=true send each chunk of output
+   as soon as it is yielded - as events for text/event-stream, as lines of json
+   for application/stream+json and otherwise as the elements of a json array */
+typedef struct _rest_stream
 {
-    const char *qmark;
-    char *rpath = NULL;
-    sch_node *qschema = NULL;
-    char *apath = NULL;
-    json_t *json = NULL;
-    uint64_t ts = 0;
-    int rc = HTTP_CODE_OK;
-    rest_e_tag error_tag = REST_E_TAG_NONE;
-    GNode *query, *tree;
-    char *json_string = NULL;
-    char *resp = NULL;
-    int schflags = 0;
-    int qdepth, rdepth;
-    int param_depth = 0;
-    int diff;
+    req_handle handle;
+    int flags;
+    sch_node *schema;
+    int chunks;
+} rest_stream;
 
-    /* If a request is made to /restconf/data (in which case the path is now empty) it is analogous to a
-       request to /restconf/data/ietf-yang-library:yang-library */
-    if (!strlen (path) && (flags & FLAGS_RESTCONF))
-        path = "/ietf-yang-library:yang-library";
+static void
+rest_rpc_stream_send (rest_stream *stream, const char *data)
+{
+    if (!stream->chunks)
+    {
+        const char *type;
+        char *header;
 
-    /* Separate the path from any query string */
-    qmark = strchr (path, '?');
-    if (qmark)
+        if (stream->flags & FLAGS_EVENT_STREAM)
+            type = "text/event-stream";
+        else if (stream->flags & FLAGS_APPLICATION_STREAM)
+            type = "application/stream+json";
+        else
+            type = stream->flags & FLAGS_RESTCONF ? "application/yang-data+json" : "application/json";
+        header = g_strdup_printf ("Status: 200\r\n"
+                                  "Content-Type: %s\r\n"
+                                  "Cache-Control: no-cache\r\n"
+                                  "\r\n%s", type,
+                                  stream->flags & (FLAGS_EVENT_STREAM | FLAGS_APPLICATION_STREAM) ? "" : "[");
+        send_response (stream->handle, header, false);
+        g_free (header);
+    }
+    if (stream->flags & FLAGS_EVENT_STREAM)
     {
-        path = (const char *) (rpath = strndup (path, rpath - path));
-        qmark += 1;
+        send_response (stream->handle, "data: ", false);
+        send_response (stream->handle, data, false);
+        send_response (stream->handle, "\r\n\r\n", true);
     }
-
-    /* Parsing options */
-    if (verbose)
-        schflags |= SCH_F_DEBUG;
-    if (flags & FLAGS_JSON_FORMAT_ARRAYS)
-        schflags |= SCH_F_JSON_ARRAYS;
-    if (flags & FLAGS_JSON_FORMAT_TYPES)
-        schflags |= SCH_F_JSON_TYPES;
-    if (flags & FLAGS_CONDITIONS)
-        schflags |= SCH_F_CONDITIONS;
-    if (flags & FLAGS_IDREF_VALUES)
-        schflags |= SCH_F_IDREF_VALUES;
-    if (flags & FLAGS_JSON_FORMAT_NS)
+    else if (stream->flags & FLAGS_APPLICATION_STREAM)
     {
-        schflags |= SCH_F_NS_MODEL_NAME;
-        if (flags & FLAGS_FORCE_NS_PREFIX)
-        {
-            schflags |= SCH_F_NS_PREFIX;
-        }
-        else
-        {
-            /* If the prefix/model name is not specified in the request
-               then dont include it in the reply */
-            char *colon = strchr (path, ':');
-            char *slash = strchr (path, '/');
-            if (slash)
-                slash = strchr (slash + 1, '/');
-            if (colon && (!slash || colon < slash))
-                schflags |= SCH_F_NS_PREFIX;
-        }
-    }
-
-    /* Convert the path to a GNode tree to use as the base of the apteryx query */
-    query = sch_path_to_gnode (g_schema, NULL, path, schflags, &qschema);
-    if (!query || !qschema)
-    {
-        VERBOSE ("REST: Path \"%s\" invalid\n", path);
-        switch (sch_last_err ())
-        {
-        case SCH_E_NOTREADABLE:
-        case SCH_E_NOTWRITABLE:
-            rc = HTTP_CODE_FORBIDDEN;
-            error_tag = REST_E_TAG_ACCESS_DENIED;
-            break;
-        case SCH_E_NOSCHEMANODE:
-        default:
-            rc = HTTP_CODE_NOT_FOUND;
-            error_tag = REST_E_TAG_INVALID_VALUE;
-        }
-        goto exit;
+        send_response (stream->handle, data, false);
+        send_response (stream->handle, "\r\n", true);
     }
-    if (sch_is_leaf (qschema) && !sch_is_readable (qschema))
+    else
     {
-        VERBOSE ("REST: Path \"%s\" not readable\n", path);
-        rc = HTTP_CODE_FORBIDDEN;
-        error_tag = REST_E_TAG_ACCESS_DENIED;
-        goto exit;
+        if (stream->chunks)
+            send_response (stream->handle, ",", false);
+        send_response (stream->handle, data, true);
     }
+    stream->chunks++;
+}
 
-    /* Get the depth of the response which is the depth of the query
-       OR the up until the first path wildcard */
-    qdepth = g_node_max_height (query);
-    rdepth = 1;
-    GNode *rnode = query;
-    while (rnode &&
-           g_node_n_children (rnode) == 1 &&
-           g_strcmp0 (APTERYX_NAME (g_node_first_child (rnode)), "*") != 0)
-    {
-        rnode = g_node_first_child (rnode);
-        rdepth++;
-    }
-    sch_node *rschema = qschema;
-    diff = qdepth - rdepth;
-    while (diff--)
-        rschema = sch_node_parent (rschema);
-    if (!(flags & FLAGS_LEGACY_KEY_AS_OBJECT) &&
-        sch_node_parent (rschema) && sch_is_list (sch_node_parent (rschema)))
-    {
-        /* We need to present the list rather than the key */
-        rschema = sch_node_parent (rschema);
-        rdepth--;
-    }
-    GNode *qnode = rnode;
-    while (qnode->children)
-        qnode = qnode->children;
+static bool
+rest_rpc_stream_chunk (GNode *chunk, void *data)
+{
+    rest_stream *stream = (rest_stream *) data;
+    json_t *json = rest_rpc_output_json (stream->flags, stream->schema, chunk);
+    char *text = json ? json_dumps (json, JSON_ENCODE_ANY) : NULL;
 
-    /* Handle GET RPC's */
-    sch_node *rpcschema = rest_rpc_schema (qschema);
-    if (rpcschema)
+    if (json)
+        json_decref (json);
+    if (!text)
     {
-        /* Check RPC supports GET */
-        if (flags & FLAGS_RESTCONF || !sch_is_readable (rpcschema))
-        {
-            VERBOSE ("REST: GET RPC not supported for %s\n", path);
-            error_tag = REST_E_TAG_OPER_NOT_SUPPORTED;
-            rc = HTTP_CODE_NOT_SUPPORTED;
-        }
-        else
-        {
-            resp = rest_rpc (flags, qnode, rpcschema, NULL);
-        }
-        goto exit;
+        /* Stop rather than send a stream with a chunk missing */
+        ERROR ("REST: Failed to convert rpc output to json\n");
+        return false;
     }
+    rest_rpc_stream_send (stream, text);
+    free (text);
+    return is_sending (stream->handle);
+}
 
-    /* Get a timestamp for the root of the query path */
-    apath = apteryx_node_path (rnode);
-    ts = apteryx_timestamp (apath);
-    free (apath);
-    if (if_none_match && if_none_match[0] != '\0' &&
-        ts == strtoull (if_none_match, NULL, 16))
+static char *
+rest_rpc_stream_start (int flags, const char *path, sch_node *schema, GNode *input)
+{
+    rest_stream stream = { g_handle, flags, sch_node_child (schema, "output"), 0 };
+    rest_e_tag error_tag = REST_E_TAG_NONE;
+    char *error_string = NULL;
+    GNode *output = NULL;
+    rest_rpc_error error;
+    char *resp;
+    char *body;
+    int rc;
+    gint64 start;
+
+    /* Without an output node in the schema nothing can be streamed. The chunks are
+       gathered into one output, which is then refused like any other output */
+    start = g_get_monotonic_time ();
+    error = rest_rpc_execute_stream (flags, path, input, stream.schema ? rest_rpc_stream_chunk : NULL,
+                                     &stream, &output, &error_string);
+    rest_timing_add (TIMING_RPC, start);
+    rc = rest_rpc_status (error, output, &error_tag);
+    if (error == REST_RPC_E_NONE && !(flags & FLAGS_METHOD_GET))
+        rest_rpc_cache_invalidate (path);
+    resp = rest_rpc_response (flags, schema, rc, error_tag, output, error_string);
+    if (!stream.chunks)
+        return resp;
+
+    /* Returned output or an error after the stream has started is the last chunk */
+    body = strstr (resp, "\r\n\r\n");
+    if (body && body[4])
+        rest_rpc_stream_send (&stream, body + 4);
+    g_free (resp);
+    return g_strdup (flags & (FLAGS_EVENT_STREAM | FLAGS_APPLICATION_STREAM) ? "" : "]\n");
+}
+
+/* The input for a GET RPC from its query string (name=value&...) */
+static json_t *
+rest_rpc_query_input (const char *query)
+{
+    json_t *json;
+    gchar **params;
+
+    if (!query || !query[0])
+        return NULL;
+    json = json_object ();
+    params = g_strsplit (query, "&", -1);
+    for (int i = 0; params[i]; i++)
     {
-        VERBOSE ("REST: Path \"%s\" not modified since ETag:%s\n", rpath, if_none_match);
-        resp = g_strdup_printf ("Status: %d\r\n"
-                                "Content-Type: application/json\r\n"
-                                "Content-Length: 0\r\n\r\n",
-                                HTTP_CODE_NOT_MODIFIED);
-        goto exit;
+        gchar **param = g_strsplit (params[i], "=", 2);
+        char *name = param[0] && param[0][0] ? g_uri_unescape_string (param[0], NULL) : NULL;
+        char *value = name && param[1] ? g_uri_unescape_string (param[1], NULL) : NULL;
+        if (name && value)
+            json_object_set_new (json, name, json_string (value));
+        g_free (name);
+        g_free (value);
+        g_strfreev (param);
     }
-    if (if_modified_since && if_modified_since[0] != '\0')
+    g_strfreev (params);
+    if (!json_object_size (json))
     {
-        struct tm last_modified;
-        time_t realtime;
-        strptime (if_modified_since, "%a, %d %b %Y %H:%M:%S GMT", &last_modified);
-        realtime = timegm (&last_modified);
-        if ((ts / 1000000) <= (realtime - g_boottime))
-        {
-            VERBOSE ("REST: Path \"%s\" not modified since Time:%s\n", rpath, if_modified_since);
-            rc = HTTP_CODE_NOT_MODIFIED;
-            resp = g_strdup_printf ("Status: %d\r\n"
-                                    "Content-Type: application/json\r\n"
-                                    "Content-Length: 0\r\n\r\n",
-                                    HTTP_CODE_NOT_MODIFIED);
-            goto exit;
-        }
+        json_decref (json);
+        json = NULL;
     }
+    return json;
+}
 
-    /* Parse the query if provided */
-    if (qmark)
+static char *
+rest_rpc (int flags, GNode *node, sch_node *schema, json_t *json)
+{
+    char *path = apteryx_node_path (node);
+    int schflags = rest_rpc_schflags (flags);
+    GNode *input = NULL;
+    GNode *output = NULL;
+    rest_e_tag error_tag = REST_E_TAG_NONE;
+    char *error_string = NULL;
+    char *resp;
+    rest_rpc_error error;
+    int rc;
+    gint64 start;
+
+    /* Special case: We consider /operations to be a root node and hence
+       support non-native namespaces at this node. This allows us to have
+       multiple data models with the same root rpc. */
+    if (g_ascii_strncasecmp (path, "/operations", strlen("/operations")) == 0)
     {
-        /* Parse the query and attach to the tree */
-        if (!sch_query_to_gnode (g_schema, qschema, qnode, qmark, schflags, &schflags, &param_depth))
+        sch_ns *ns = sch_node_ns (schema);
+        if (ns && !sch_ns_native (g_schema, ns))
         {
-            rc = HTTP_CODE_BAD_REQUEST;
-            error_tag = REST_E_TAG_INVALID_VALUE;
-            goto exit;
+            const char *prefix = sch_ns_prefix (g_schema, ns);
+            const char *name = APTERYX_NAME (node);
+            char *_path = g_strdup_printf ("/operations/%s:%s", prefix, name);
+            free (path);
+            path = _path;
         }
     }
-    /* Without a query we may need to add a wildcard to get everything from here down */
-    if (!query || (qdepth == g_node_max_height (query) && !(schflags & SCH_F_DEPTH_ONE)))
+
+    if (json)
     {
-        if (qschema && sch_node_child_first (qschema) && !(schflags & SCH_F_STRIP_DATA))
+        /* RESTCONF mandates "input" (or nothing) be the primary data object
+        for rpc requests. In non-restconf mode we are more relaxed but to match
+        the data model we need to provide that top level "input" node */
+        if (!(flags & FLAGS_RESTCONF) && json_object_size (json))
         {
-            /* Get everything from here down if we do not already have a star */
-            if (!g_node_first_child (qnode) && g_strcmp0 (APTERYX_NAME (qnode), "*") != 0)
+            const char *key = NULL;
+            if (json_object_size (json) == 1)
+            {
+                key = json_object_iter_key (json_object_iter(json));
+                char *colon = key ? strchr (key, ':') : NULL;
+                if (colon) key = colon + 1;
+                if (g_strcmp0 (key, "input") != 0)
+                    key = NULL;
+            }
+            if (key == NULL)
             {
-                APTERYX_NODE (qnode, g_strdup ("*"));
-                DEBUG ("%*s%s\n", qdepth * 2, " ", "*");
+                json_t *obj = json_object ();
+                json_object_set_new (obj, "input", json);
+                json = obj;
             }
         }
-    }
-
-    /* Query the database */
-    tree = apteryx_query (query);
-    if (query && (schflags & SCH_F_ADD_DEFAULTS) && rschema)
-    {
-        GNode *rnode = get_response_node (tree, rdepth);
-        sch_add_defaults (g_schema, rschema, &tree, &query, rnode, qnode, rdepth,
-                          qdepth, schflags);
-    }
-
-    if (tree)
-    {
-        /* Get rid of any unwanted nodes */
-        if (schflags & SCH_F_TRIM_DEFAULTS)
-        {
-            rnode = get_response_node (tree, rdepth);
-            sch_traverse_tree (g_schema, rschema, rnode, schflags);
-        }
 
-        if ((schflags & SCH_F_DEPTH) && param_depth)
-        {
-            rnode = get_response_node (tree, rdepth);
-            sch_trim_tree_by_depth (g_schema, rschema, rnode, schflags, param_depth);
-        }
+        /* Parse the input - always set types */
+        input = sch_json_to_gnode (g_schema, schema, json, schflags | SCH_F_JSON_TYPES);
+        json_decref (json);
 
-        /* Convert the result to JSON */
-        rnode = get_response_node (tree, rdepth);
-        if (rnode)
-        {
-            VERBOSE ("JSON:\n");
-            json = sch_gnode_to_json (g_schema, rschema, rnode, schflags);
-        }
-        if (json)
+        /* Check parsing succeeded and we have input when required */
+        if (!input)
         {
-            if ((!(flags & FLAGS_JSON_FORMAT_ROOT) ||
-                 (!(flags & FLAGS_RESTCONF) && qschema != rschema && sch_is_list (rschema)))
-                && !json_is_string (json))
-            {
-                /* Chop off the root node */
-                json_t *json_new = json_object_iter_value (json_object_iter (json));
-                json_incref (json_new);
-                json_decref (json);
-                json = json_new;
-            }
-            if (flags & FLAGS_JSON_FORMAT_MULTI)
+            switch (sch_last_err ())
             {
-                /* Top level array */
-                json_t *json_new = json_array ();
-                json_array_append_new (json_new, json);
-                json = json_new;
+            case SCH_E_NOSCHEMANODE:
+                rc = HTTP_CODE_NOT_FOUND;
+                error_tag = REST_E_TAG_INVALID_VALUE;
+                break;
+            case SCH_E_NOTREADABLE:
+            case SCH_E_NOTWRITABLE:
+                rc = HTTP_CODE_FORBIDDEN;
+                error_tag = REST_E_TAG_ACCESS_DENIED;
+                break;
+            default:
+                rc = HTTP_CODE_BAD_REQUEST;
+                error_tag = REST_E_TAG_INVALID_VALUE;
+                break;
             }
+            goto exit;
         }
-        else
-        {
-            json = json_object();
-        }
-        apteryx_free_tree (tree);
     }
-    else
+
+    if (rest_rpc_async (path))
     {
-        if ((schflags & SCH_F_DEPTH) && qschema && qnode)
-            json = sch_gnode_to_json (g_schema, qschema, qnode, schflags);
-        else
-            json = json_object();
+        resp = rest_job_start (flags, path, schema, input);
+        free (path);
+        return resp;
     }
-
-    json_string = json_dumps (json, JSON_ENCODE_ANY);
-exit:
-    if (logging)
-        log_get_head (flags, path, remote_user, remote_addr, rc);
-
-    if (!resp)
+    if (g_handle && rest_rpc_stream (path))
     {
-        if (flags & FLAGS_RESTCONF && rc >= 400 && rc <= 499 && !json_string)
-        {
-            json_string = restconf_error (rc, error_tag);
-        }
-        char last_modified[128];
-        time_t realtime = (time_t) (g_boottime + (ts / 1000000));
-        struct tm *my_tm = gmtime (&realtime);
-        strftime (last_modified, 128, "%a, %d %b %Y %H:%M:%S GMT", my_tm);
-        resp = g_strdup_printf ("Status: %d\r\n"
-                                "Last-Modified: %s\r\n"
-                                "ETag: %" PRIX64 "\r\n"
-                                "Content-Type: %s\r\n"
-                                "Content-Length: %ld\r\n"
-                                "\r\n" "%s", rc, last_modified, ts,
-                                flags & FLAGS_RESTCONF ? "application/yang-data+json" : "application/json",
-                                json_string ? strlen (json_string) : 0,
-                                json_string && (flags & FLAGS_METHOD_HEAD) == 0 ? json_string : "");
+        resp = rest_rpc_stream_start (flags, path, schema, input);
+        goto done;
     }
-    free (json_string);
-    if (json)
-        json_decref (json);
-    apteryx_free_tree (query);
-    free (rpath);
+
+    /* Repeat GETs may be answered without running the handler */
+    resp = rest_rpc_cache_get (flags, path, input);
+    if (resp)
+        goto done;
+
+    start = g_get_monotonic_time ();
+    error = rest_rpc_execute (flags, path, input, &output, &error_string);
+    rest_timing_add (TIMING_RPC, start);
+    rc = rest_rpc_status (error, output, &error_tag);
+    if (error == REST_RPC_E_NONE && !(flags & FLAGS_METHOD_GET))
+        rest_rpc_cache_invalidate (path);
+
+exit:
+    resp = rest_rpc_response (flags, schema, rc, error_tag, output, error_string);
+    if (g_str_has_prefix (resp, "Status: 200\r\n"))
+        rest_rpc_cache_put (flags, path, input, resp);
+done:
+    apteryx_free_tree (input);
+    free (path);
     return resp;
 }
 
-static bool
-restconf_is_list_key_leaf_update (sch_node *api_subtree, GNode *child, GNode *tnode)
+static int
+apteryx_json_search (const char *path, char **data)
 {
-    sch_node *parent1 = sch_node_parent (api_subtree);
-    sch_node *parent2 = sch_node_parent (parent1);   /* Might need to go up another level */
-    sch_node *list_parent = NULL;
-    bool key_update = false;
-    bool case1 = true;
+    sch_node *root, *node;
+    char *_path;
+    int len;
+    GList *children, *iter;
+    bool first = true;
+    char *buffer;
 
-    if (parent1 && sch_is_list (parent1))
+    /* Create a version of the path without the trailing '/' */
+    _path = strdup (path);
+    len = strlen (path);
+    _path[len - 1] = '\0';
+
+    /* Validate starting path */
+    if ((root = sch_lookup (g_schema, _path)) == NULL)
     {
-        list_parent = parent1;
+        free (_path);
+        return HTTP_CODE_NOT_FOUND;
     }
-    else if (parent2 && sch_is_list (parent2))
+    if (!sch_is_readable (root))
     {
-        list_parent = parent2;
-        case1 = false;
+        free (_path);
+        return HTTP_CODE_FORBIDDEN;
     }
-    if (list_parent)
+
+    /* Do the Apteryx search */
+    *data = g_strdup_printf ("{\"%s\": [", len > 2 ? strrchr (_path, '/') + 1 : "");
+    children = apteryx_search (path);
+    children = g_list_sort (children, (GCompareFunc) strcasecmp);
+    for (iter = children; iter; iter = g_list_next (iter))
     {
-        GList *keys = sch_list_keys (list_parent);
-        char *list_name = sch_name (list_parent);
-        if (g_strcmp0 (list_name, APTERYX_NAME (tnode)) == 0)
-        {
-            tnode = tnode->children;
-        }
-        for (GNode *node = g_node_first_sibling (tnode); !key_update && node; node = g_node_next_sibling (node))
+        path = strrchr ((const char *) iter->data, '/') + 1;
+        if ((node = sch_node_child (root, path)) != NULL && sch_is_readable (node))
         {
-            for (GList *key = keys; !key_update && key != NULL; key = key->next)
-            {
-                if (g_strcmp0 ((char *)key->data, APTERYX_NAME (node)) == 0 && node->children)
-                {
-                    char *value = APTERYX_NAME (node->children);
-                    char *path = apteryx_node_path (child);
-                    char *query = case1 ? g_strdup_printf ("%s/%s", path, (char *)key->data) : g_strdup (path);
-                    char *res = apteryx_get (query);
-                    if (res && g_strcmp0 (res, value))
-                        key_update = true;
-
-                    g_free (res);
-                    g_free (path);
-                    g_free (query);
-                    break;
-                }
-            }
+            buffer = *data;
+            *data = g_strdup_printf ("%s%s\"%s\"", buffer, first ? "" : ",", path);
+            free (buffer);
+            first = false;
         }
-        g_free (list_name);
-        g_list_free_full (keys, g_free);
     }
-    return key_update;
+    buffer = *data;
+    *data = g_strdup_printf ("%s]}", buffer);
+    free (buffer);
+
+    g_list_free_full (children, free);
+    free (_path);
+    return HTTP_CODE_OK;
 }
 
-/*
- * Adjust a data tree for the PUT case where the data is a key/value pair. The top node has to be
- * removed, and if the path includes a key value, there should be only one node under the
- * top node and this can also be removed.
- * child - either points to a node matching the first child of tree or a key under a list node
- *         that matches the first child of tree.
- * tree - points to a root node ('/'), under which is the data being PUT, which if it is a
- *        list, could have multiple children for multiple list elements in the tree.
- */
-static void
-_rest_adjust_tree_for_key_value (GNode *tree, GNode **child, sch_node *api_subtree)
+static char *
+rest_api_search (int flags, const char *path, const char *if_none_match, const char *if_modified_since,
+                 const char *remote_user, const char *remote_addr)
 {
-    GNode *parent = (*child)->parent;
-    GNode *node;
-    bool child_is_key = false;
-    bool is_list = sch_is_list (api_subtree);
-    bool tree_parent_match = parent == NULL ? false : g_strcmp0 (APTERYX_NAME (parent), APTERYX_NAME (tree->children)) == 0;
+    char *_path;
+    char *data = NULL;
+    uint64_t ts = 0;
+    char *resp;
+    int rc;
 
-    /* Look for parent of child that matches top of tree - this means child is a key */
-    if (is_list && tree_parent_match)
+    _path = strdup (path);
+    _path[strlen (path) - 1] = '\0';
+    ts = apteryx_timestamp (_path);
+    g_free (_path);
+    if (if_none_match && if_none_match[0] != '\0' &&
+        ts == strtoull (if_none_match, NULL, 16))
     {
-        child_is_key = true;
+        rc = HTTP_CODE_NOT_MODIFIED;
+        goto exit;
     }
 
-    /* Adjust the tree by ditching the first node under the root node. */
-    node = tree->children;
-    tree->children = node->children;
-    g_free (node->data);
-    node->children = NULL;
-    node->parent = NULL;
-    g_node_destroy (node);
-    for (node = tree->children; node; node = node->next)
-    {
-        node->parent = tree;
-    }
+    rc = apteryx_json_search (path, &data);
 
+  exit:
+    if (logging)
+        log_get_head (FLAGS_METHOD_GET, path, remote_user, remote_addr, rc);
 
-    /* If child is key, remove it, it will be one of tree's children. */
-    if (child_is_key)
+    resp = g_strdup_printf ("Status: %d\r\n"
+                            "Etag: %" PRIX64 "\r\n"
+                            "Content-Type: application/json\r\n"
+                            "Content-Length: %ld\r\n"
+                            "\r\n" "%s", rc, ts,
+                            data ? strlen (data) : 0,
+                            data ? : "");
+    free (data);
+    return resp;
+}
+
+static GNode*
+get_response_node (GNode *tree, int rdepth)
+{
+    GNode *rnode = tree;
+    while (--rdepth && rnode)
+        rnode = rnode->children;
+    return rnode;
+}
+
+/* Copy the branch of a tree from the root down to node */
+static GNode *
+rest_query_copy_branch (GNode *node, GNode **leaf)
+{
+    GNode *copy = NULL;
+
+    *leaf = NULL;
+    for (; node; node = node->parent)
     {
-        /* parent must be valid, otherwise child_is_key could not be true */
-        parent->children = NULL;
-        (*child)->parent = NULL;
-        g_free ((*child)->data);
-        g_node_destroy (*child);
-        *child = parent;
+        GNode *parent = APTERYX_NODE (NULL, g_strdup (APTERYX_NAME (node)));
+        if (copy)
+            g_node_prepend (parent, copy);
+        else
+            *leaf = parent;
+        copy = parent;
     }
+    return copy;
 }
 
-static char *
-rest_api_post (int flags, const char *path, const char *data, int length, const char *if_match,
-               const char *if_unmodified_since, const char *if_none_match, const char *server_name,
-               const char *server_port, const char *remote_user, const char *remote_addr)
+/* State carried between the stages of a GET request */
+typedef struct _rest_get_ctx
 {
-    GNode *root = NULL;
-    GNode *tree = NULL;
-    char *apath = NULL;
-    sch_node *api_subtree = NULL;
-    GNode *child = NULL;
-    GNode *node;
-    GNode *children = NULL;
-    json_t *json = NULL;
-    json_error_t error;
-    char *resp = NULL;
-    char *error_string = NULL;
-    char *location = NULL;
-    int schflags = 0;
-    uint64_t ts = 0;
-    bool res;
+    int flags;
+    int schflags;
+    const char *path;
+    const char *qmark;
+    char *rpath;
+    GNode *query;
+    GNode *fetch;
+    GList *boundary;
+    GNode *rnode;
+    GNode *qnode;
+    sch_node *qschema;
+    sch_node *rschema;
+    sch_node *rpcschema;
+    int qdepth;
+    int rdepth;
+    int param_depth;
+    uint64_t ts;
     int rc;
-    rest_e_tag error_tag = REST_E_TAG_NONE;
+    rest_e_tag error_tag;
+} rest_get_ctx;
 
-    /* Parsing options - always set arrays and types */
-    schflags = SCH_F_JSON_ARRAYS | SCH_F_JSON_TYPES | SCH_F_MODIFY_DATA;
-    if (verbose)
-        schflags |= SCH_F_DEBUG;
-    if (flags & FLAGS_JSON_FORMAT_NS)
-        schflags |= SCH_F_NS_MODEL_NAME;
-    schflags |= SCH_F_STRIP_DATA;
+static void
+rest_get_ctx_free (rest_get_ctx *ctx)
+{
+    apteryx_free_tree (ctx->query);
+    ctx->query = NULL;
+    if (ctx->fetch)
+        apteryx_free_tree (ctx->fetch);
+    ctx->fetch = NULL;
+    g_list_free_full (ctx->boundary, free);
+    ctx->boundary = NULL;
+    free (ctx->rpath);
+    ctx->rpath = NULL;
+}
 
-    /* Generate an aperyx tree from the path */
-    root = sch_path_to_gnode (g_schema, NULL, path, schflags, &api_subtree);
-    if (!root || !api_subtree)
-    {
-        VERBOSE ("REST: Path \"%s\" not found\n", path);
-        rc = HTTP_CODE_NOT_FOUND;
-        error_tag = REST_E_TAG_INVALID_VALUE;
-        goto exit;
-    }
+/* Validate the path and build the base of the apteryx query */
+static bool
+rest_get_parse (rest_get_ctx *ctx, int flags, const char *path)
+{
+    const char *qmark;
+    int schflags = 0;
+    int diff;
 
-    /* Check if this is an RPC */
-    sch_node *rpcschema = rest_rpc_schema (api_subtree);
-    if (rpcschema)
-        api_subtree = rpcschema;
+    ctx->flags = flags;
+    ctx->rc = HTTP_CODE_OK;
+    ctx->error_tag = REST_E_TAG_NONE;
 
-    /* Make sure any leaf nodes are writable */
-    if ((sch_is_leaf (api_subtree) && !sch_is_writable (api_subtree)))
+    /* If a request is made to /restconf/data (in which case the path is now empty) it is analogous to a
+       request to /restconf/data/ietf-yang-library:yang-library */
+    if (!strlen (path) && (flags & FLAGS_RESTCONF))
+        path = "/ietf-yang-library:yang-library";
+
+    /* Separate the path from any query string */
+    qmark = strchr (path, '?');
+    if (qmark)
     {
-        VERBOSE ("REST: Path \"%s\" not writable\n", path);
-        rc = HTTP_CODE_FORBIDDEN;
-        error_tag = REST_E_TAG_ACCESS_DENIED;
-        goto exit;
+        path = (const char *) (ctx->rpath = strndup (path, ctx->rpath - path));
+        qmark += 1;
     }
+    ctx->path = path;
+    ctx->qmark = qmark;
 
-    /* Find the end of the path node */
-    child = root;
-    while (child && g_node_first_child (child))
-        child = g_node_first_child (child);
-
-    if (!rpcschema)
+    /* Parsing options */
+    if (verbose)
+        schflags |= SCH_F_DEBUG;
+    if (flags & FLAGS_JSON_FORMAT_ARRAYS)
+        schflags |= SCH_F_JSON_ARRAYS;
+    if (flags & FLAGS_JSON_FORMAT_TYPES)
+        schflags |= SCH_F_JSON_TYPES;
+    if (flags & FLAGS_CONDITIONS)
+        schflags |= SCH_F_CONDITIONS;
+    if (flags & FLAGS_IDREF_VALUES)
+        schflags |= SCH_F_IDREF_VALUES;
+    if (flags & FLAGS_JSON_FORMAT_NS)
     {
-        /* Get a timestamp for the apteryx path */
-        apath = apteryx_node_path (child);
-        ts = apteryx_timestamp (apath);
-        free (apath);
-        if (if_match && if_match[0] != '\0' &&
-            ts != strtoull (if_match, NULL, 16))
-        {
-            VERBOSE ("REST: Path \"%s\" modified since ETag:%s\n", path, if_match);
-            rc = HTTP_CODE_PRECONDITION_FAILED;
-            error_tag = REST_E_TAG_OPER_FAILED;
-            goto exit;
-        }
-        if (if_none_match && if_none_match[0] != '\0' &&
-            ts == strtoull (if_none_match, NULL, 16))
+        schflags |= SCH_F_NS_MODEL_NAME;
+        if (flags & FLAGS_FORCE_NS_PREFIX)
         {
-            VERBOSE ("REST: Path \"%s\" unmodified since ETag:%s\n", path, if_none_match);
-            rc = HTTP_CODE_PRECONDITION_FAILED;
-            error_tag = REST_E_TAG_OPER_FAILED;
-            goto exit;
+            schflags |= SCH_F_NS_PREFIX;
         }
-        if (if_unmodified_since && if_unmodified_since[0] != '\0')
+        else
         {
-            struct tm last_modified;
-            time_t realtime;
-            strptime (if_unmodified_since, "%a, %d %b %Y %H:%M:%S GMT", &last_modified);
-            realtime = timegm (&last_modified);
-            if ((ts / 1000000) > (realtime - g_boottime))
-            {
-                VERBOSE ("REST: Path \"%s\" modified since Time:%s\n", path, if_unmodified_since);
-                rc =  HTTP_CODE_PRECONDITION_FAILED;
-                error_tag = REST_E_TAG_OPER_FAILED;
-                goto exit;
-            }
+            /* If the prefix/model name is not specified in the request
+               then dont include it in the reply */
+            char *colon = strchr (path, ':');
+            char *slash = strchr (path, '/');
+            if (slash)
+                slash = strchr (slash + 1, '/');
+            if (colon && (!slash || colon < slash))
+                schflags |= SCH_F_NS_PREFIX;
         }
     }
+    ctx->schflags = schflags;
 
-    /* Run check For PUT requiring data to be a key/value object. */
-    if (flags & FLAGS_PUT_KEY_VALUE_DATA && flags & FLAGS_METHOD_PUT)
+    /* Convert the path to a GNode tree to use as the base of the apteryx query */
+    ctx->query = sch_path_to_gnode (g_schema, NULL, path, schflags, &ctx->qschema);
+    if (!ctx->query || !ctx->qschema)
     {
-        char *data_resource_name;
-        sch_node *parent = sch_node_parent (api_subtree);
-        json_t *put_value = json_loadb (data, strlen (data), JSON_DECODE_ANY, &error);
-
-        /* Find the data resource node name - go up one if we are at a list key node */
-        if (sch_is_list (parent))
+        VERBOSE ("REST: Path \"%s\" invalid\n", path);
+        switch (sch_last_err ())
         {
-            data_resource_name = sch_name (parent);
-            api_subtree = parent;
+        case SCH_E_NOTREADABLE:
+        case SCH_E_NOTWRITABLE:
+            ctx->rc = HTTP_CODE_FORBIDDEN;
+            ctx->error_tag = REST_E_TAG_ACCESS_DENIED;
+            break;
+        case SCH_E_NOSCHEMANODE:
+        default:
+            ctx->rc = HTTP_CODE_NOT_FOUND;
+            ctx->error_tag = REST_E_TAG_INVALID_VALUE;
         }
-        else
-        {
-            data_resource_name = sch_name (api_subtree);
-        }
-        if (json_object_size (put_value) != 1 || json_object_get (put_value, data_resource_name) == NULL)
-        {
-            VERBOSE ("RESTCONF: Data \"%s\" is not a single key:value (child=%s, schema=%s)\n", data, data_resource_name,
-                     sch_name (api_subtree));
-            rc = HTTP_CODE_BAD_REQUEST;
-            error_tag = REST_E_TAG_INVALID_VALUE;
-            g_free (data_resource_name);
-            goto exit;
-        }
-        json = put_value;
-        g_free (data_resource_name);
+        return false;
     }
-    /* Parse the JSON data (support full path to leaf value) */
-    else if (length && sch_is_leaf (api_subtree))
+    if (sch_is_leaf (ctx->qschema) && !sch_is_readable (ctx->qschema))
     {
-        char *name;
-        sch_node *pschema = sch_node_parent (api_subtree);
-        json_t *value = json_loadb (data, strlen (data), JSON_DECODE_ANY, &error);
-        if (!value && data && data[0] != '{' && data[0] != '[')
+        VERBOSE ("REST: Path \"%s\" not readable\n", path);
+        ctx->rc = HTTP_CODE_FORBIDDEN;
+        ctx->error_tag = REST_E_TAG_ACCESS_DENIED;
+        return false;
+    }
+
+    /* Get the depth of the response which is the depth of the query
+       OR the up until the first path wildcard */
+    ctx->qdepth = g_node_max_height (ctx->query);
+    ctx->rdepth = 1;
+    ctx->rnode = ctx->query;
+    while (ctx->rnode &&
+           g_node_n_children (ctx->rnode) == 1 &&
+           g_strcmp0 (APTERYX_NAME (g_node_first_child (ctx->rnode)), "*") != 0)
+    {
+        ctx->rnode = g_node_first_child (ctx->rnode);
+        ctx->rdepth++;
+    }
+    ctx->rschema = ctx->qschema;
+    diff = ctx->qdepth - ctx->rdepth;
+    while (diff--)
+        ctx->rschema = sch_node_parent (ctx->rschema);
+    if (!(flags & FLAGS_LEGACY_KEY_AS_OBJECT) &&
+        sch_node_parent (ctx->rschema) && sch_is_list (sch_node_parent (ctx->rschema)))
+    {
+        /* We need to present the list rather than the key */
+        ctx->rschema = sch_node_parent (ctx->rschema);
+        ctx->rdepth--;
+    }
+    ctx->qnode = ctx->rnode;
+    while (ctx->qnode->children)
+        ctx->qnode = ctx->qnode->children;
+
+    /* GET RPC's are handled by the caller */
+    ctx->rpcschema = rest_rpc_schema (ctx->qschema);
+    return true;
+}
+
+/* Get a timestamp for the root of the query path */
+static uint64_t
+rest_get_timestamp (rest_get_ctx *ctx)
+{
+    char *apath = apteryx_node_path (ctx->rnode);
+    ctx->ts = apteryx_timestamp (apath);
+    free (apath);
+    return ctx->ts;
+}
+
+/* Add the schema nodes that will be rendered to the query. Leaves that do not match
+   the content filter are skipped, except for list keys. Non-leaf nodes at the depth
+   limit are only checked for existence unless they are under a list wildcard.
+   Returns true if anything was added */
+static bool
+rest_get_compile (rest_get_ctx *ctx, sch_node *schema, GNode *node, int level, bool wildcard,
+                  GList *keys)
+{
+    int depth = (ctx->schflags & SCH_F_DEPTH) ? ctx->param_depth : 0;
+
+    for (sch_node *s = sch_node_child_first (schema); s; s = sch_node_next_sibling (s))
+    {
+        GNode *child;
+
+        if (sch_is_leaf (s))
         {
-            value = json_stringn (data, strlen (data));
+            if ((((ctx->schflags & SCH_F_CONFIG) && !sch_is_writable (s)) ||
+                 ((ctx->schflags & SCH_F_NONCONFIG) && sch_is_writable (s))) &&
+                !g_list_find_custom (keys, sch_name (s), (GCompareFunc) g_strcmp0))
+                continue;
+            APTERYX_NODE (node, sch_name (s));
+            continue;
         }
-        if (sch_is_leaf_list (pschema))
+        child = APTERYX_NODE (node, sch_name (s));
+        if (depth && level >= depth)
         {
-            if (json_is_integer (value))
-                name = g_strdup_printf ("%" JSON_INTEGER_FORMAT, json_integer_value (value));
-            else if (json_is_boolean (value))
-                name = g_strdup_printf ("%s", json_is_true (value) ? "true" : "false");
+            if (wildcard)
+            {
+                APTERYX_NODE (child, g_strdup ("*"));
+            }
             else
-                name = g_strdup_printf ("%s", json_string_value (value));
-        }
-        else
-            name = sch_name (api_subtree);
-        json = json_object ();
-        json_object_set_new (json, name, value);
-        free (name);
-        /* Jump back node */
-        api_subtree = pschema;
-        node = child;
-        child = child->parent;
-        g_node_unlink (node);
-        free (node->data);
-        g_node_destroy (node);
-    }
-    else if (length)
-    {
-        json = json_loads (data, 0, &error);
-        if (!json && rpcschema && !(flags & FLAGS_RESTCONF))
-        {
-            /* In non RESTCONF mode we support single input parameters without keys in RPC's */
-            sch_node *ischema = sch_node_child (api_subtree, "input");
-            sch_node *ichild = ischema ? sch_node_child_first (ischema) : NULL;
-            if (ischema && ichild && !sch_node_next_sibling (ichild))
             {
-                json_t *value = json_loads (data, JSON_DECODE_ANY, &error);
-                if (!value && data && data[0] != '{' && data[0] != '[')
-                    value = json_stringn (data, strlen (data));
-                if (value)
-                {
-                    char *name = sch_name (ichild);
-                    json = json_object ();
-                    json_object_set_new (json, name, value);
-                    free (name);
-                }
+                ctx->boundary = g_list_append (ctx->boundary, apteryx_node_path (child));
+                g_node_unlink (child);
+                apteryx_free_tree (child);
             }
+            continue;
         }
-        if (!json)
+        if (sch_is_leaf_list (s))
         {
-            ERROR ("error: on line %d: %s\n", error.line, error.text);
-            rc = HTTP_CODE_BAD_REQUEST;
-            error_tag = REST_E_TAG_MALFORMED;
-            goto exit;
+            APTERYX_NODE (child, g_strdup ("*"));
+            continue;
         }
+        if (sch_is_list (s))
+        {
+            GNode *entry = APTERYX_NODE (child, g_strdup ("*"));
+            GList *lkeys = sch_list_keys (s);
+            bool added = rest_get_compile (ctx, sch_node_child_first (s), entry, level + 1, true, lkeys);
+
+            g_list_free_full (lkeys, g_free);
+            if (added)
+                continue;
+        }
+        else if (rest_get_compile (ctx, s, child, level + 1, wildcard, NULL))
+            continue;
+        g_node_unlink (child);
+        apteryx_free_tree (child);
     }
+    return node->children != NULL;
+}
 
-    /* Handle rpc's */
-    if (rpcschema)
+/* Replace a trailing wildcard with a query for only what depth= and content= will keep */
+static void
+rest_get_compile_query (rest_get_ctx *ctx)
+{
+    GNode *wildcard = g_node_first_child (ctx->qnode);
+    GList *indexes = NULL;
+    GNode *qnode;
+
+    if (!(ctx->schflags & (SCH_F_CONFIG | SCH_F_NONCONFIG)) &&
+        !((ctx->schflags & SCH_F_DEPTH) && ctx->param_depth > 1))
+        return;
+    if ((ctx->schflags & SCH_F_CONDITIONS) || !ctx->qschema || sch_is_leaf (ctx->qschema) ||
+        sch_is_leaf_list (ctx->qschema))
+        return;
+    if (!wildcard || wildcard->next || wildcard->children || g_strcmp0 (APTERYX_NAME (wildcard), "*") != 0)
+        return;
+
+    /* Find the same node in a copy of the query */
+    for (GNode *node = ctx->qnode; node->parent; node = node->parent)
+        indexes = g_list_prepend (indexes, GINT_TO_POINTER (g_node_child_position (node->parent, node)));
+    ctx->fetch = g_node_copy_deep (ctx->query, (GCopyFunc) g_strdup, NULL);
+    qnode = ctx->fetch;
+    for (GList *i = indexes; i; i = i->next)
+        qnode = g_node_nth_child (qnode, GPOINTER_TO_INT (i->data));
+    g_list_free (indexes);
+    wildcard = g_node_first_child (qnode);
+    g_node_unlink (wildcard);
+    apteryx_free_tree (wildcard);
+
+    if (sch_is_list (ctx->qschema))
     {
-        resp = rest_rpc (flags, child, rpcschema, json);
-        goto exit;
+        GNode *entry = APTERYX_NODE (qnode, g_strdup ("*"));
+        GList *keys = sch_list_keys (ctx->qschema);
+
+        rest_get_compile (ctx, sch_node_child_first (ctx->qschema), entry, 2, true, keys);
+        g_list_free_full (keys, g_free);
     }
+    else
+        rest_get_compile (ctx, ctx->qschema, qnode, 2, false, NULL);
+}
 
-    /* Convert to GNode and validate the data */
-    if (json)
+/* Add a node at the depth limit that was only checked for existence. The node is
+   added without children, in the same shape the depth trim leaves a container or
+   list in, so the schema rather than a placeholder child decides how it renders */
+static GNode *
+rest_get_add_boundary (GNode *tree, const char *path)
+{
+    char **parts = g_strsplit (path + 1, "/", -1);
+    GNode *node;
+
+    if (!tree)
+        tree = APTERYX_NODE (NULL, g_strdup_printf ("/%s", parts[0]));
+    node = tree;
+    for (int i = 1; parts[i]; i++)
     {
-        if (flags & FLAGS_PUT_KEY_VALUE_DATA && flags & FLAGS_METHOD_PUT)
+        GNode *child;
+        for (child = node->children; child; child = child->next)
         {
-            tree = sch_json_to_gnode (g_schema, sch_node_parent (api_subtree), json, schflags);
+            if (g_strcmp0 (APTERYX_NAME (child), parts[i]) == 0)
+                break;
         }
-        else
+        node = child ? : APTERYX_NODE (node, g_strdup (parts[i]));
+    }
+    g_strfreev (parts);
+    return tree;
+}
+
+/* Attach any query parameters and wildcards to the apteryx query */
+static bool
+rest_get_build_query (rest_get_ctx *ctx)
+{
+    /* Parse the query if provided */
+    if (ctx->qmark)
+    {
+        /* Parse the query and attach to the tree */
+        if (!sch_query_to_gnode (g_schema, ctx->qschema, ctx->qnode, ctx->qmark, ctx->schflags,
+                                 &ctx->schflags, &ctx->param_depth))
         {
-            tree = sch_json_to_gnode (g_schema, api_subtree, json, schflags);
+            ctx->rc = HTTP_CODE_BAD_REQUEST;
+            ctx->error_tag = REST_E_TAG_INVALID_VALUE;
+            return false;
         }
-        json_decref (json);
     }
-
-    if (tree && (flags & FLAGS_RESTCONF))
+    /* Without a query we may need to add a wildcard to get everything from here down */
+    if (!ctx->query ||
+        (ctx->qdepth == g_node_max_height (ctx->query) && !(ctx->schflags & SCH_F_DEPTH_ONE)))
     {
-        bool not_supported = false;
-        if (flags & (FLAGS_METHOD_PUT | FLAGS_METHOD_PATCH))
+        if (ctx->qschema && sch_node_child_first (ctx->qschema) && !(ctx->schflags & SCH_F_STRIP_DATA))
         {
-            /* For a restconf PUT or PATCH do not allow the change of an existing list key field */
-            if (restconf_is_list_key_leaf_update (api_subtree, child, tree->children))
+            /* Get everything from here down if we do not already have a star */
+            if (!g_node_first_child (ctx->qnode) && g_strcmp0 (APTERYX_NAME (ctx->qnode), "*") != 0)
             {
-                not_supported = true;
+                APTERYX_NODE (ctx->qnode, g_strdup ("*"));
+                DEBUG ("%*s%s\n", ctx->qdepth * 2, " ", "*");
             }
         }
+    }
 
-        if (flags & (FLAGS_METHOD_PATCH | FLAGS_METHOD_POST) &&
-            sch_is_leaf_list (api_subtree))
+    /* Only ask the database for what will be rendered */
+    rest_get_compile_query (ctx);
+    return true;
+}
+
+/* Default values for the entries of a list, cached per data model instance, list and output flags */
+#define REST_DEFAULTS_ENTRY "-"
+static GHashTable *g_defaults = NULL;
+static GMutex g_defaults_lock;
+
+static void
+rest_defaults_cache_clear (void)
+{
+    g_mutex_lock (&g_defaults_lock);
+    if (g_defaults)
+        g_hash_table_destroy (g_defaults);
+    g_defaults = NULL;
+    g_mutex_unlock (&g_defaults_lock);
+}
+
+/* Drop the defaults of a data model instance that is no longer used */
+static void
+rest_defaults_cache_prune (guint generation)
+{
+    char *prefix = g_strdup_printf ("%u:", generation);
+    GHashTableIter iter;
+    const char *key;
+
+    g_mutex_lock (&g_defaults_lock);
+    if (g_defaults)
+    {
+        g_hash_table_iter_init (&iter, g_defaults);
+        while (g_hash_table_iter_next (&iter, (gpointer *) &key, NULL))
         {
-            /* A leaf list entry should be fully defined in the data portion of the set */
-            not_supported = true;
+            if (g_str_has_prefix (key, prefix))
+                g_hash_table_iter_remove (&iter);
         }
+    }
+    g_mutex_unlock (&g_defaults_lock);
+    g_free (prefix);
+}
 
-        if (not_supported)
+static bool
+rest_schema_has_list (sch_node *schema)
+{
+    for (sch_node *s = sch_node_child_first (schema); s; s = sch_node_next_sibling (s))
+    {
+        if (sch_is_leaf_list (s))
+            continue;
+        if (sch_is_list (s))
+            return true;
+        if (!sch_is_leaf (s) && rest_schema_has_list (s))
+            return true;
+    }
+    return false;
+}
+
+/* Get the defaults for every entry of the requested list by letting the schema
+   add them to an entry that only has its keys */
+static GNode *
+rest_defaults_template (rest_get_ctx *ctx, GNode *rnode)
+{
+    char *key = g_strdup_printf ("%u:%p:%x", g_schema_pinned->generation, ctx->rschema,
+                                 ctx->schflags & ~SCH_F_TRIM_DEFAULTS);
+    GNode *template;
+    GNode *tree;
+    GNode *query;
+    GNode *qnode;
+    GNode *entry = NULL;
+    GNode *leaf;
+    GList *keys;
+
+    g_mutex_lock (&g_defaults_lock);
+    template = g_defaults ? g_hash_table_lookup (g_defaults, key) : NULL;
+    g_mutex_unlock (&g_defaults_lock);
+    logging_access_cache (template != NULL);
+    if (template)
+    {
+        g_free (key);
+        return template;
+    }
+
+    tree = rest_query_copy_branch (rnode, &leaf);
+    entry = APTERYX_NODE (leaf, g_strdup (REST_DEFAULTS_ENTRY));
+    keys = sch_list_keys (ctx->rschema);
+    for (GList *k = keys; k; k = k->next)
+        APTERYX_LEAF (entry, g_strdup ((char *) k->data), g_strdup (REST_DEFAULTS_ENTRY));
+    query = g_node_copy_deep (ctx->query, (GCopyFunc) g_strdup, NULL);
+    qnode = query;
+    for (guint depth = 1; depth < g_node_depth (ctx->qnode); depth++)
+        qnode = qnode->children;
+    sch_add_defaults (g_schema, ctx->rschema, &tree, &query, get_response_node (tree, ctx->rdepth), qnode,
+                      ctx->rdepth, ctx->qdepth, (ctx->schflags & ~SCH_F_TRIM_DEFAULTS) | SCH_F_ADD_DEFAULTS);
+
+    /* Keep everything except the keys */
+    template = APTERYX_NODE (NULL, g_strdup (REST_DEFAULTS_ENTRY));
+    leaf = get_response_node (tree, ctx->rdepth);
+    for (entry = leaf ? leaf->children : NULL; entry; entry = entry->next)
+    {
+        if (g_strcmp0 (APTERYX_NAME (entry), REST_DEFAULTS_ENTRY) == 0)
+            break;
+    }
+    while (entry && entry->children)
+    {
+        GNode *child = entry->children;
+        g_node_unlink (child);
+        if (g_list_find_custom (keys, APTERYX_NAME (child), (GCompareFunc) g_strcmp0))
+            apteryx_free_tree (child);
+        else
+            g_node_append (template, child);
+    }
+    g_list_free_full (keys, g_free);
+    apteryx_free_tree (query);
+    apteryx_free_tree (tree);
+
+    g_mutex_lock (&g_defaults_lock);
+    if (!g_defaults)
+        g_defaults = g_hash_table_new_full (g_str_hash, g_str_equal, g_free, (GDestroyNotify) apteryx_free_tree);
+    if (g_hash_table_lookup (g_defaults, key))
+    {
+        apteryx_free_tree (template);
+        template = g_hash_table_lookup (g_defaults, key);
+        g_free (key);
+    }
+    else
+        g_hash_table_insert (g_defaults, key, template);
+    g_mutex_unlock (&g_defaults_lock);
+    return template;
+}
+
+/* Add any defaults missing from a list entry */
+static void
+rest_defaults_merge (sch_node *schema, GNode *node, GNode *template)
+{
+    for (GNode *tchild = template->children; tchild; tchild = tchild->next)
+    {
+        GNode *child;
+        for (child = node->children; child; child = child->next)
         {
-            apteryx_free_tree (tree);
-            tree = NULL;
-            rc = HTTP_CODE_NOT_SUPPORTED;
-            error_tag = REST_E_TAG_OPER_NOT_SUPPORTED;
-            goto exit;
+            if (g_strcmp0 (APTERYX_NAME (child), APTERYX_NAME (tchild)) == 0)
+                break;
+        }
+        if (!child)
+        {
+            g_node_append (node, g_node_copy_deep (tchild, (GCopyFunc) g_strdup, NULL));
+        }
+        else if (!APTERYX_HAS_VALUE (tchild) && !APTERYX_HAS_VALUE (child))
+        {
+            sch_node *cschema = sch_node_child (schema, APTERYX_NAME (tchild));
+            if (cschema && !sch_is_leaf_list (cschema))
+                rest_defaults_merge (cschema, child, tchild);
         }
     }
+}
 
-    /* Check parsing succeeded and we have input when required */
-    if (!tree)
+/* Remove any leaves from a list entry that match the default. Returns true if nothing is left */
+static bool
+rest_defaults_trim (GNode *node, GNode *template)
+{
+    for (GNode *tchild = template->children; tchild; tchild = tchild->next)
     {
-        switch (sch_last_err ())
+        GNode *child;
+        for (child = node->children; child; child = child->next)
         {
-        case SCH_E_NOSCHEMANODE:
-            rc = HTTP_CODE_NOT_FOUND;
-            error_tag = REST_E_TAG_INVALID_VALUE;
-            break;
-        case SCH_E_NOTREADABLE:
-        case SCH_E_NOTWRITABLE:
-            rc = HTTP_CODE_FORBIDDEN;
-            error_tag = REST_E_TAG_ACCESS_DENIED;
-            break;
-        default:
-            rc = HTTP_CODE_BAD_REQUEST;
-            error_tag = REST_E_TAG_INVALID_VALUE;
-            break;
+            if (g_strcmp0 (APTERYX_NAME (child), APTERYX_NAME (tchild)) == 0)
+                break;
+        }
+        if (!child)
+            continue;
+        if ((APTERYX_HAS_VALUE (tchild) && APTERYX_HAS_VALUE (child) &&
+             g_strcmp0 (APTERYX_VALUE (child), APTERYX_VALUE (tchild)) == 0) ||
+            (!APTERYX_HAS_VALUE (tchild) && !APTERYX_HAS_VALUE (child) &&
+             rest_defaults_trim (child, tchild)))
+        {
+            g_node_unlink (child);
+            apteryx_free_tree (child);
         }
-        goto exit;
     }
+    return node->children == NULL;
+}
 
-    /* Adjust tree and child if it's a PUT with KEY/VALUE */
-    if (flags & FLAGS_PUT_KEY_VALUE_DATA && flags & FLAGS_METHOD_PUT)
+/* Add or trim defaults for every entry of a list from a cached template.
+   Returns false if the request needs the full schema walk */
+static bool
+rest_defaults_apply (rest_get_ctx *ctx, GNode *rnode)
+{
+    GNode *template;
+    sch_node *eschema;
+
+    /* Only a plain read of every entry of a list without nested lists */
+    if (!rnode || !ctx->rschema || ctx->rschema != ctx->qschema ||
+        !sch_is_list (ctx->rschema) || sch_is_leaf_list (ctx->rschema))
+        return false;
+    if (ctx->schflags & (SCH_F_CONDITIONS | SCH_F_DEPTH))
+        return false;
+    if (g_node_n_children (ctx->qnode) != 1 || ctx->qnode->children->children ||
+        g_strcmp0 (APTERYX_NAME (ctx->qnode->children), "*") != 0)
+        return false;
+    eschema = sch_node_child_first (ctx->rschema);
+    if (!eschema || rest_schema_has_list (eschema))
+        return false;
+
+    template = rest_defaults_template (ctx, rnode);
+    for (GNode *entry = rnode->children; entry; entry = entry->next)
     {
-        _rest_adjust_tree_for_key_value (tree, &child, api_subtree);
+        if (ctx->schflags & SCH_F_ADD_DEFAULTS)
+            rest_defaults_merge (eschema, entry, template);
+        else
+            rest_defaults_trim (entry, template);
     }
+    return true;
+}
 
-    /* Check for replace  - don't traverse tree if PUT is just setting a leaf */
-    if (flags & FLAGS_PUT_REPLACE && flags & FLAGS_METHOD_PUT)
+/* Write the result of the query as JSON to the response body (consumes tree) */
+static bool
+rest_get_render (rest_get_ctx *ctx, GNode *tree, GString *body)
+{
+    int flags = ctx->flags;
+    int schflags = ctx->schflags;
+    sch_node *rschema = ctx->rschema;
+    json_t *json = NULL;
+    bool written = false;
+    GNode *rnode;
+    gint64 start;
+
+    if (ctx->query && (schflags & SCH_F_ADD_DEFAULTS) && rschema)
     {
-        if (!sch_is_leaf (api_subtree))
-        {
-            sch_traverse_tree (g_schema, api_subtree, tree, schflags | SCH_F_ADD_MISSING_NULL);
-        }
+        start = g_get_monotonic_time ();
+        rnode = get_response_node (tree, ctx->rdepth);
+        if (!rest_defaults_apply (ctx, rnode))
+            sch_add_defaults (g_schema, rschema, &tree, &ctx->query, rnode, ctx->qnode, ctx->rdepth,
+                              ctx->qdepth, schflags);
+        rest_timing_add (TIMING_DEFAULTS, start);
     }
 
-    /* Write the combined tree to apteryx */
-    child->children = tree->children;
-    children = tree->children;
-    tree->children = NULL;
+    start = g_get_monotonic_time ();
+    if (tree)
+    {
+        /* Get rid of any unwanted nodes */
+        if (schflags & SCH_F_TRIM_DEFAULTS)
+        {
+            rnode = get_response_node (tree, ctx->rdepth);
+            if (!rest_defaults_apply (ctx, rnode))
+                sch_traverse_tree (g_schema, rschema, rnode, schflags);
+        }
 
-    /* Fixup the parent pointers for the children that now in the root tree */
-    for (GNode *cnode = child->children; cnode; cnode = cnode->next)
-        cnode->parent = child;
+        if ((schflags & SCH_F_DEPTH) && ctx->param_depth)
+        {
+            rnode = get_response_node (tree, ctx->rdepth);
+            sch_trim_tree_by_depth (g_schema, rschema, rnode, schflags, ctx->param_depth);
+        }
+        rest_timing_add (TIMING_TRIM, start);
 
-    if ((flags & FLAGS_CONDITIONS) &&
-        (flags & (FLAGS_METHOD_PUT | FLAGS_METHOD_PATCH | FLAGS_METHOD_POST)))
+        /* Convert the result to JSON */
+        start = g_get_monotonic_time ();
+        rnode = get_response_node (tree, ctx->rdepth);
+        if (rnode)
+        {
+            VERBOSE ("JSON:\n");
+            json = sch_gnode_to_json (g_schema, rschema, rnode, schflags);
+        }
+        if (json)
+        {
+            if ((!(flags & FLAGS_JSON_FORMAT_ROOT) ||
+                 (!(flags & FLAGS_RESTCONF) && ctx->qschema != rschema && sch_is_list (rschema)))
+                && !json_is_string (json))
+            {
+                /* Chop off the root node */
+                json_t *json_new = json_object_iter_value (json_object_iter (json));
+                json_incref (json_new);
+                json_decref (json);
+                json = json_new;
+            }
+            if (flags & FLAGS_JSON_FORMAT_MULTI)
+            {
+                /* Top level array */
+                json_t *json_new = json_array ();
+                json_array_append_new (json_new, json);
+                json = json_new;
+            }
+        }
+        else
+        {
+            json = json_object();
+        }
+        apteryx_free_tree (tree);
+    }
+    else
+    {
+        if ((schflags & SCH_F_DEPTH) && ctx->qschema && ctx->qnode)
+            json = sch_gnode_to_json (g_schema, ctx->qschema, ctx->qnode, schflags);
+        else
+            json = json_object();
+    }
+
+    if (json)
+    {
+        written = json_dump_callback (json, rest_json_append, body, JSON_ENCODE_ANY) == 0;
+        json_decref (json);
+    }
+    rest_timing_add (TIMING_SERIALIZE, start);
+    return written;
+}
+
+/* Helper threads for running independent parts of a large query at the same time.
+   A query is only split when the last read of the same path returned at least
+   REST_QUERY_SPLIT_MIN nodes, so small reads never pay for the extra search */
+#define REST_QUERY_THREADS_MAX 8
+#define REST_QUERY_SPLIT_MIN 1024
+#define REST_QUERY_SIZES_MAX 1024
+static GThreadPool *g_query_pool = NULL;
+static GHashTable *g_query_sizes = NULL;
+static GMutex g_query_sizes_lock;
+
+typedef struct _rest_query_fanout
+{
+    GMutex lock;
+    GCond cond;
+    int pending;
+} rest_query_fanout;
+
+typedef struct _rest_query_part
+{
+    GNode *query;
+    GNode *result;
+    rest_query_fanout *fanout;
+} rest_query_part;
+
+static void
+rest_query_part_run (gpointer data, gpointer user_data)
+{
+    rest_query_part *part = (rest_query_part *) data;
+    rest_query_fanout *fanout = part->fanout;
+
+    part->result = apteryx_query (part->query);
+    g_mutex_lock (&fanout->lock);
+    if (--fanout->pending == 0)
+        g_cond_signal (&fanout->cond);
+    g_mutex_unlock (&fanout->lock);
+}
+
+/* Where the query branches */
+static GNode *
+rest_query_branch (rest_get_ctx *ctx)
+{
+    GNode *node = ctx->fetch ? : ctx->query;
+
+    while (node && g_node_n_children (node) == 1 &&
+           g_strcmp0 (APTERYX_NAME (g_node_first_child (node)), "*") != 0)
+        node = g_node_first_child (node);
+    return node;
+}
+
+/* Remember how big the result of a query was */
+static void
+rest_query_size_save (const char *apath, guint size)
+{
+    g_mutex_lock (&g_query_sizes_lock);
+    if (!g_query_sizes || g_hash_table_size (g_query_sizes) >= REST_QUERY_SIZES_MAX)
+    {
+        if (g_query_sizes)
+            g_hash_table_destroy (g_query_sizes);
+        g_query_sizes = g_hash_table_new_full (g_str_hash, g_str_equal, g_free, NULL);
+    }
+    g_hash_table_replace (g_query_sizes, g_strdup (apath), GUINT_TO_POINTER (size));
+    g_mutex_unlock (&g_query_sizes_lock);
+}
+
+static guint
+rest_query_size (const char *apath)
+{
+    guint size;
+
+    g_mutex_lock (&g_query_sizes_lock);
+    size = g_query_sizes ? GPOINTER_TO_UINT (g_hash_table_lookup (g_query_sizes, apath)) : 0;
+    g_mutex_unlock (&g_query_sizes_lock);
+    return size;
+}
+
+/* Split the query where it branches into parts that can be run at the same time */
+static GList *
+rest_query_split (rest_get_ctx *ctx, GNode *node, const char *apath)
+{
+    GList *children = NULL;
+    GList *parts = NULL;
+    GList *iter;
+    guint nparts;
+    guint count;
+
+    if (!g_query_pool || !node || rest_query_size (apath) < REST_QUERY_SPLIT_MIN)
+        return NULL;
+
+    if (g_node_n_children (node) > 1)
+    {
+        for (GNode *child = node->children; child; child = child->next)
+            children = g_list_append (children, g_node_copy_deep (child, (GCopyFunc) g_strdup, NULL));
+    }
+    else if (node == ctx->qnode && ctx->qschema &&
+             (node == ctx->query || sch_is_list (ctx->qschema)))
+    {
+        /* Replace the wildcard for a whole model or list with the children that
+           actually exist, in the order apteryx gives them */
+        char *spath = g_strdup_printf ("%s/", apath);
+        GList *paths = apteryx_search (spath);
+
+        for (iter = paths; iter; iter = g_list_next (iter))
+        {
+            const char *name = strrchr ((const char *) iter->data, '/') + 1;
+            sch_node *schema = sch_is_list (ctx->qschema) ? NULL : sch_node_child (ctx->qschema, name);
+            GNode *child = APTERYX_NODE (NULL, g_strdup (name));
+            if (!schema || !sch_is_leaf (schema))
+                APTERYX_NODE (child, g_strdup ("*"));
+            children = g_list_append (children, child);
+        }
+        g_list_free_full (paths, free);
+        g_free (spath);
+    }
+
+    count = g_list_length (children);
+    if (count < 2)
+    {
+        g_list_free_full (children, (GDestroyNotify) apteryx_free_tree);
+        return NULL;
+    }
+
+    /* Share the children out in order between as many parts as we have threads */
+    nparts = MIN (count, (guint) g_thread_pool_get_max_threads (g_query_pool) + 1);
+    iter = children;
+    for (guint p = 0; p < nparts; p++)
+    {
+        GNode *leaf;
+        parts = g_list_append (parts, rest_query_copy_branch (node, &leaf));
+        for (guint n = 0; n < count / nparts + (p < count % nparts ? 1 : 0); n++, iter = g_list_next (iter))
+            g_node_append (leaf, (GNode *) iter->data);
+    }
+    g_list_free (children);
+    return parts;
+}
+
+/* Move the results of one part of a query into another */
+static GNode *
+rest_query_result_merge (GNode *dst, GNode *src)
+{
+    if (!dst)
+        return src;
+    if (!src)
+        return dst;
+    while (src->children)
+    {
+        GNode *schild = src->children;
+        GNode *dchild;
+
+        g_node_unlink (schild);
+        for (dchild = dst->children; dchild; dchild = dchild->next)
+        {
+            if (g_strcmp0 (APTERYX_NAME (dchild), APTERYX_NAME (schild)) == 0)
+                break;
+        }
+        if (dchild && !APTERYX_HAS_VALUE (dchild) && !APTERYX_HAS_VALUE (schild))
+            rest_query_result_merge (dchild, schild);
+        else if (dchild)
+            apteryx_free_tree (schild);
+        else
+            g_node_append (dst, schild);
+    }
+    apteryx_free_tree (src);
+    return dst;
+}
+
+/* Add the nodes at the depth limit that exist to the result of the query.
+   Nodes with the same parent are all checked with one search of the parent */
+static GNode *
+rest_get_query_boundary (rest_get_ctx *ctx, GNode *tree)
+{
+    GHashTable *found = NULL;
+    char *parent = NULL;
+
+    for (GList *iter = ctx->boundary; iter; iter = g_list_next (iter))
+    {
+        const char *path = (const char *) iter->data;
+        size_t len = strrchr (path, '/') - path;
+
+        if (!parent || strlen (parent) != len || strncmp (parent, path, len) != 0)
+        {
+            char *spath;
+            GList *paths;
+
+            g_free (parent);
+            parent = g_strndup (path, len);
+            if (found)
+                g_hash_table_destroy (found);
+            found = g_hash_table_new_full (g_str_hash, g_str_equal, free, NULL);
+            spath = g_strdup_printf ("%s/", parent);
+            paths = apteryx_search (spath);
+            for (GList *p = paths; p; p = g_list_next (p))
+                g_hash_table_add (found, p->data);
+            g_list_free (paths);
+            g_free (spath);
+        }
+        if (g_hash_table_contains (found, path))
+            tree = rest_get_add_boundary (tree, path);
+    }
+    if (found)
+        g_hash_table_destroy (found);
+    g_free (parent);
+    return tree;
+}
+
+/* Query the database, running independent parts of a large query at the same time */
+static GNode *
+rest_get_query (rest_get_ctx *ctx)
+{
+    rest_query_fanout fanout;
+    rest_query_part *parts;
+    GNode *branch = rest_query_branch (ctx);
+    char *apath = branch ? apteryx_node_path (branch) : NULL;
+    uint64_t ts = ctx->ts;
+    GList *queries;
+    GList *iter;
+    GNode *tree = NULL;
+    guint count;
+    guint i;
+
+    queries = rest_query_split (ctx, branch, apath);
+    if (!queries)
+    {
+        tree = apteryx_query (ctx->fetch ? : ctx->query);
+        goto done;
+    }
+
+    count = g_list_length (queries);
+    parts = g_malloc0 (count * sizeof (rest_query_part));
+    g_mutex_init (&fanout.lock);
+    g_cond_init (&fanout.cond);
+    fanout.pending = count - 1;
+    for (i = 0, iter = queries; iter; i++, iter = g_list_next (iter))
+    {
+        parts[i].query = (GNode *) iter->data;
+        parts[i].fanout = &fanout;
+        if (i > 0)
+            g_thread_pool_push (g_query_pool, &parts[i], NULL);
+    }
+
+    /* Run the first part in this thread while the helpers run the rest */
+    parts[0].result = apteryx_query (parts[0].query);
+    g_mutex_lock (&fanout.lock);
+    while (fanout.pending)
+        g_cond_wait (&fanout.cond, &fanout.lock);
+    g_mutex_unlock (&fanout.lock);
+    g_cond_clear (&fanout.cond);
+    g_mutex_clear (&fanout.lock);
+
+    for (i = 0; i < count; i++)
+    {
+        tree = rest_query_result_merge (tree, parts[i].result);
+        apteryx_free_tree (parts[i].query);
+    }
+    g_list_free (queries);
+    g_free (parts);
+
+    /* The parts are separate reads. If anything changed while they ran read it all again */
+    if (ts && rest_get_timestamp (ctx) != ts)
+    {
+        VERBOSE ("REST: \"%s\" changed during a split query\n", apath);
+        if (tree)
+            apteryx_free_tree (tree);
+        tree = apteryx_query (ctx->fetch ? : ctx->query);
+    }
+
+done:
+    if (apath)
+        rest_query_size_save (apath, tree ? g_node_n_nodes (tree, G_TRAVERSE_ALL) : 0);
+    free (apath);
+    return rest_get_query_boundary (ctx, tree);
+}
+
+static char *
+rest_api_get (int flags, const char *path, const char *if_none_match, const char *if_modified_since,
+              const char *remote_user, const char *remote_addr)
+{
+    rest_get_ctx ctx = { 0 };
+    uint64_t ts = 0;
+    GNode *tree;
+    GString *body = NULL;
+    char *resp = NULL;
+    gint64 start = g_get_monotonic_time ();
+
+    /* Convert the path to a GNode tree to use as the base of the apteryx query */
+    if (!rest_get_parse (&ctx, flags, path))
+    {
+        rest_timing_add (TIMING_PARSE, start);
+        goto exit;
+    }
+    rest_timing_add (TIMING_PARSE, start);
+
+    /* Handle GET RPC's */
+    if (ctx.rpcschema)
+    {
+        /* Check RPC supports GET */
+        if (flags & FLAGS_RESTCONF || !sch_is_readable (ctx.rpcschema))
+        {
+            VERBOSE ("REST: GET RPC not supported for %s\n", ctx.path);
+            ctx.error_tag = REST_E_TAG_OPER_NOT_SUPPORTED;
+            ctx.rc = HTTP_CODE_NOT_SUPPORTED;
+        }
+        else
+        {
+            resp = rest_rpc (flags, ctx.qnode, ctx.rpcschema, rest_rpc_query_input (ctx.qmark));
+        }
+        goto exit;
+    }
+
+    /* Get a timestamp for the root of the query path */
+    start = g_get_monotonic_time ();
+    ts = rest_get_timestamp (&ctx);
+    rest_timing_add (TIMING_QUERY, start);
+    if (if_none_match && if_none_match[0] != '\0' &&
+        ts == strtoull (if_none_match, NULL, 16))
+    {
+        VERBOSE ("REST: Path \"%s\" not modified since ETag:%s\n", ctx.rpath, if_none_match);
+        resp = g_strdup_printf ("Status: %d\r\n"
+                                "Content-Type: application/json\r\n"
+                                "Content-Length: 0\r\n\r\n",
+                                HTTP_CODE_NOT_MODIFIED);
+        goto exit;
+    }
+    if (if_modified_since && if_modified_since[0] != '\0')
+    {
+        struct tm last_modified;
+        time_t realtime;
+        strptime (if_modified_since, "%a, %d %b %Y %H:%M:%S GMT", &last_modified);
+        realtime = timegm (&last_modified);
+        if ((ts / 1000000) <= (realtime - g_boottime))
+        {
+            VERBOSE ("REST: Path \"%s\" not modified since Time:%s\n", ctx.rpath, if_modified_since);
+            ctx.rc = HTTP_CODE_NOT_MODIFIED;
+            resp = g_strdup_printf ("Status: %d\r\n"
+                                    "Content-Type: application/json\r\n"
+                                    "Content-Length: 0\r\n\r\n",
+                                    HTTP_CODE_NOT_MODIFIED);
+            goto exit;
+        }
+    }
+
+    /* Parse the query if provided */
+    start = g_get_monotonic_time ();
+    if (!rest_get_build_query (&ctx))
+    {
+        rest_timing_add (TIMING_PARSE, start);
+        goto exit;
+    }
+    rest_timing_add (TIMING_PARSE, start);
+
+    /* Query the database */
+    start = g_get_monotonic_time ();
+    tree = rest_get_query (&ctx);
+    rest_timing_add (TIMING_QUERY, start);
+    body = g_string_new (NULL);
+    if (!rest_get_render (&ctx, tree, body))
+    {
+        g_string_free (body, true);
+        body = NULL;
+    }
+exit:
+    if (logging)
+        log_get_head (flags, ctx.path, remote_user, remote_addr, ctx.rc);
+
+    if (!resp)
+    {
+        if (flags & FLAGS_RESTCONF && ctx.rc >= 400 && ctx.rc <= 499 && !body)
+        {
+            char *error = restconf_error (ctx.rc, ctx.error_tag);
+            body = g_string_new (error);
+            free (error);
+        }
+        char last_modified[128];
+        time_t realtime = (time_t) (g_boottime + (ts / 1000000));
+        struct tm *my_tm = gmtime (&realtime);
+        strftime (last_modified, 128, "%a, %d %b %Y %H:%M:%S GMT", my_tm);
+        resp = g_strdup_printf ("Status: %d\r\n"
+                                "Last-Modified: %s\r\n"
+                                "ETag: %" PRIX64 "\r\n"
+                                "Content-Type: %s\r\n"
+                                "Content-Length: %ld\r\n"
+                                "\r\n", ctx.rc, last_modified, ts,
+                                flags & FLAGS_RESTCONF ? "application/yang-data+json" : "application/json",
+                                body ? body->len : 0);
+        if (body && (flags & FLAGS_METHOD_HEAD) == 0)
+        {
+            resp = rest_response_prepend (resp, body);
+            body = NULL;
+        }
+    }
+    if (body)
+        g_string_free (body, true);
+    rest_get_ctx_free (&ctx);
+    return resp;
+}
+
+/* Merge a copy of the query tree src into the query tree dst */
+static void
+rest_query_merge (GNode *dst, GNode *src)
+{
+    for (GNode *schild = src->children; schild; schild = schild->next)
+    {
+        GNode *dchild;
+        for (dchild = dst->children; dchild; dchild = dchild->next)
+        {
+            if (g_strcmp0 (APTERYX_NAME (dchild), APTERYX_NAME (schild)) == 0)
+                break;
+        }
+        if (dchild)
+            rest_query_merge (dchild, schild);
+        else
+            g_node_append (dst, g_node_copy_deep (schild, (GCopyFunc) g_strdup, NULL));
+    }
+}
+
+/* Copy the part of a result tree that matches a single query from a merged result */
+static GNode *
+rest_tree_extract (GNode *result, GNode *query)
+{
+    GNode *node = APTERYX_NODE (NULL, g_strdup (APTERYX_NAME (result)));
+
+    if (!query->children)
+    {
+        /* A leaf in the query returns just the value */
+        if (APTERYX_HAS_VALUE (result))
+            APTERYX_NODE (node, g_strdup (APTERYX_VALUE (result)));
+    }
+    for (GNode *qchild = query->children; qchild; qchild = qchild->next)
+    {
+        bool wildcard = g_strcmp0 (APTERYX_NAME (qchild), "*") == 0;
+        for (GNode *rchild = result->children; rchild; rchild = rchild->next)
+        {
+            if (!wildcard && g_strcmp0 (APTERYX_NAME (rchild), APTERYX_NAME (qchild)) != 0)
+                continue;
+            if (wildcard && !qchild->children)
+            {
+                /* A trailing wildcard returns everything from here down */
+                g_node_append (node, g_node_copy_deep (rchild, (GCopyFunc) g_strdup, NULL));
+            }
+            else
+            {
+                GNode *child = rest_tree_extract (rchild, qchild);
+                if (child)
+                    g_node_append (node, child);
+            }
+        }
+    }
+    if (!node->children)
+    {
+        apteryx_free_tree (node);
+        node = NULL;
+    }
+    return node;
+}
+
+typedef struct _rest_bulk_entry
+{
+    const char *path;
+    const char *etag;
+    rest_get_ctx ctx;
+    bool not_modified;
+} rest_bulk_entry;
+
+/* Read a set of resources with as few apteryx queries as possible */
+static char *
+rest_api_bulk_get (int flags, const char *data, int length,
+                   const char *remote_user, const char *remote_addr)
+{
+    rest_bulk_entry *entries = NULL;
+    GHashTable *queries;
+    GHashTable *results;
+    GHashTable *stamps;
+    GHashTableIter iter;
+    gpointer name;
+    GNode *merged;
+    json_error_t error;
+    json_t *json;
+    json_t *value;
+    GString *body;
+    size_t count = 0;
+    size_t i;
+    char *resp;
+
+    /* Each request is read as a GET */
+    flags = (flags & ~FLAGS_METHOD_MASK) | FLAGS_METHOD_GET;
+
+    /* Expect an array of paths or { "path": string, "etag": string } objects */
+    json = length ? json_loadb (data, length, 0, &error) : NULL;
+    json_array_foreach (json, i, value)
+    {
+        if (!json_string_value (json_is_object (value) ? json_object_get (value, "path") : value))
+            break;
+    }
+    if (!json || !json_is_array (json) || i != json_array_size (json))
+    {
+        VERBOSE ("REST: Bulk request is not an array of paths\n");
+        if (json)
+            json_decref (json);
+        return rest_error_response (flags, HTTP_CODE_BAD_REQUEST, REST_E_TAG_MALFORMED);
+    }
+
+    count = json_array_size (json);
+    entries = g_malloc0 (count * sizeof (rest_bulk_entry));
+    queries = g_hash_table_new (g_str_hash, g_str_equal);
+    results = g_hash_table_new_full (g_str_hash, g_str_equal, NULL, (GDestroyNotify) apteryx_free_tree);
+    stamps = g_hash_table_new_full (g_str_hash, g_str_equal, NULL, g_free);
+    json_array_foreach (json, i, value)
+    {
+        rest_bulk_entry *entry = &entries[i];
+
+        if (json_is_object (value))
+        {
+            entry->path = json_string_value (json_object_get (value, "path"));
+            entry->etag = json_string_value (json_object_get (value, "etag"));
+        }
+        else
+        {
+            entry->path = json_string_value (value);
+        }
+        if (!rest_get_parse (&entry->ctx, flags, entry->path))
+            continue;
+        if (entry->ctx.rpcschema)
+        {
+            VERBOSE ("REST: RPC not supported in bulk request for %s\n", entry->ctx.path);
+            entry->ctx.rc = HTTP_CODE_NOT_SUPPORTED;
+            entry->ctx.error_tag = REST_E_TAG_OPER_NOT_SUPPORTED;
+            continue;
+        }
+        /* Only paths with an ETag need their own timestamp. Nothing under
+           the path has changed if it is no newer than the ETag */
+        if (entry->etag && entry->etag[0] != '\0')
+        {
+            uint64_t etag = strtoull (entry->etag, NULL, 16);
+            if (rest_get_timestamp (&entry->ctx) && entry->ctx.ts <= etag)
+            {
+                entry->ctx.ts = etag;
+                entry->not_modified = true;
+                continue;
+            }
+        }
+        if (!rest_get_build_query (&entry->ctx))
+            continue;
+
+        /* Combine this query with all the others in the same model */
+        merged = g_hash_table_lookup (queries, APTERYX_NAME (entry->ctx.query));
+        if (!merged)
+        {
+            merged = g_node_copy_deep (entry->ctx.query, (GCopyFunc) g_strdup, NULL);
+            g_hash_table_insert (queries, APTERYX_NAME (merged), merged);
+        }
+        else
+            rest_query_merge (merged, entry->ctx.query);
+    }
+
+    /* One trip to the database for each model. The last change to the model
+       is the ETag for the paths in it that were read without one. It is read
+       before the query so that a change in between gives a newer ETag */
+    g_hash_table_iter_init (&iter, queries);
+    while (g_hash_table_iter_next (&iter, &name, (gpointer *) &merged))
+    {
+        char *mpath = apteryx_node_path (merged);
+        uint64_t *ts = g_new (uint64_t, 1);
+        GNode *result;
+
+        *ts = apteryx_timestamp (mpath);
+        result = apteryx_query (merged);
+        g_hash_table_insert (stamps, name, ts);
+        free (mpath);
+        if (result)
+            g_hash_table_insert (results, name, result);
+    }
+
+    /* Render each response from its own part of the result */
+    body = g_string_new ("{");
+    for (i = 0; i < count; i++)
+    {
+        rest_bulk_entry *entry = &entries[i];
+        rest_get_ctx *ctx = &entry->ctx;
+        json_t *jkey;
+
+        if (entry->not_modified)
+            ctx->rc = HTTP_CODE_NOT_MODIFIED;
+        else if (!ctx->ts && ctx->query && g_hash_table_lookup (stamps, APTERYX_NAME (ctx->query)))
+            ctx->ts = *(uint64_t *) g_hash_table_lookup (stamps, APTERYX_NAME (ctx->query));
+        if (logging)
+            log_get_head (flags, ctx->path, remote_user, remote_addr, ctx->rc);
+
+        if (i)
+            g_string_append_c (body, ',');
+        jkey = json_string (entry->path);
+        json_dump_callback (jkey, rest_json_append, body, JSON_ENCODE_ANY);
+        json_decref (jkey);
+        g_string_append_printf (body, ":{\"status\":%d", ctx->rc);
+        if (ctx->rc == HTTP_CODE_OK || ctx->rc == HTTP_CODE_NOT_MODIFIED)
+            g_string_append_printf (body, ",\"etag\":\"%" PRIX64 "\"", ctx->ts);
+        if (ctx->rc == HTTP_CODE_OK)
+        {
+            GNode *result = g_hash_table_lookup (results, APTERYX_NAME (ctx->query));
+            GNode *tree = result ? rest_tree_extract (result, ctx->query) : NULL;
+            gsize len = body->len;
+
+            /* Drop the key and anything partly written if the data cannot be rendered */
+            g_string_append (body, ",\"data\":");
+            if (!rest_get_render (ctx, tree, body))
+                g_string_truncate (body, len);
+        }
+        else if (flags & FLAGS_RESTCONF && ctx->rc >= 400 && ctx->rc <= 499)
+        {
+            char *error = restconf_error (ctx->rc, ctx->error_tag);
+            if (error)
+                g_string_append_printf (body, ",\"data\":%s", error);
+            free (error);
+        }
+        g_string_append_c (body, '}');
+        rest_get_ctx_free (ctx);
+    }
+    g_string_append_c (body, '}');
+    g_hash_table_destroy (results);
+    g_hash_table_destroy (stamps);
+    g_hash_table_iter_init (&iter, queries);
+    while (g_hash_table_iter_next (&iter, NULL, (gpointer *) &merged))
+        apteryx_free_tree (merged);
+    g_hash_table_destroy (queries);
+    g_free (entries);
+    json_decref (json);
+
+    resp = g_strdup_printf ("Status: %d\r\n"
+                            "Content-Type: %s\r\n"
+                            "Content-Length: %ld\r\n"
+                            "\r\n", HTTP_CODE_OK,
+                            flags & FLAGS_RESTCONF ? "application/yang-data+json" : "application/json",
+                            body->len);
+    return rest_response_prepend (resp, body);
+}
+
+static bool
+restconf_is_list_key_leaf_update (sch_node *api_subtree, GNode *child, GNode *tnode)
+{
+    sch_node *parent1 = sch_node_parent (api_subtree);
+    sch_node *parent2 = sch_node_parent (parent1);   /* Might need to go up another level */
+    sch_node *list_parent = NULL;
+    bool key_update = false;
+    bool case1 = true;
+
+    if (parent1 && sch_is_list (parent1))
+    {
+        list_parent = parent1;
+    }
+    else if (parent2 && sch_is_list (parent2))
+    {
+        list_parent = parent2;
+        case1 = false;
+    }
+    if (list_parent)
+    {
+        GList *keys = sch_list_keys (list_parent);
+        char *list_name = sch_name (list_parent);
+        if (g_strcmp0 (list_name, APTERYX_NAME (tnode)) == 0)
+        {
+            tnode = tnode->children;
+        }
+        for (GNode *node = g_node_first_sibling (tnode); !key_update && node; node = g_node_next_sibling (node))
+        {
+            for (GList *key = keys; !key_update && key != NULL; key = key->next)
+            {
+                if (g_strcmp0 ((char *)key->data, APTERYX_NAME (node)) == 0 && node->children)
+                {
+                    char *value = APTERYX_NAME (node->children);
+                    char *path = apteryx_node_path (child);
+                    char *query = case1 ? g_strdup_printf ("%s/%s", path, (char *)key->data) : g_strdup (path);
+                    char *res = apteryx_get (query);
+                    if (res && g_strcmp0 (res, value))
+                        key_update = true;
+
+                    g_free (res);
+                    g_free (path);
+                    g_free (query);
+                    break;
+                }
+            }
+        }
+        g_free (list_name);
+        g_list_free_full (keys, g_free);
+    }
+    return key_update;
+}
+
+/*
+ * Adjust a data tree for the PUT case where the data is a key/value pair. The top node has to be
+ * removed, and if the path includes a key value, there should be only one node under the
+ * top node and this can also be removed.
+ * child - either points to a node matching the first child of tree or a key under a list node
+ *         that matches the first child of tree.
+ * tree - points to a root node ('/'), under which is the data being PUT, which if it is a
+ *        list, could have multiple children for multiple list elements in the tree.
+ */
+static void
+_rest_adjust_tree_for_key_value (GNode *tree, GNode **child, sch_node *api_subtree)
+{
+    GNode *parent = (*child)->parent;
+    GNode *node;
+    bool child_is_key = false;
+    bool is_list = sch_is_list (api_subtree);
+    bool tree_parent_match = parent == NULL ? false : g_strcmp0 (APTERYX_NAME (parent), APTERYX_NAME (tree->children)) == 0;
+
+    /* Look for parent of child that matches top of tree - this means child is a key */
+    if (is_list && tree_parent_match)
+    {
+        child_is_key = true;
+    }
+
+    /* Adjust the tree by ditching the first node under the root node. */
+    node = tree->children;
+    tree->children = node->children;
+    g_free (node->data);
+    node->children = NULL;
+    node->parent = NULL;
+    g_node_destroy (node);
+    for (node = tree->children; node; node = node->next)
+    {
+        node->parent = tree;
+    }
+
+
+    /* If child is key, remove it, it will be one of tree's children. */
+    if (child_is_key)
+    {
+        /* parent must be valid, otherwise child_is_key could not be true */
+        parent->children = NULL;
+        (*child)->parent = NULL;
+        g_free ((*child)->data);
+        g_node_destroy (*child);
+        *child = parent;
+    }
+}
+
+/* State carried between the stages of a request that modifies data */
+typedef struct _rest_set_ctx
+{
+    int flags;
+    int schflags;
+    const char *path;
+    GNode *root;
+    GNode *child;
+    GNode *children;
+    sch_node *api_subtree;
+    sch_node *rpcschema;
+    json_t *json;
+    char *body;
+    int depth;
+    int rc;
+    rest_e_tag error_tag;
+} rest_set_ctx;
+
+static void
+rest_set_ctx_free (rest_set_ctx *ctx)
+{
+    if (ctx->json)
+        json_decref (ctx->json);
+    ctx->json = NULL;
+    free (ctx->body);
+    ctx->body = NULL;
+    apteryx_free_tree (ctx->root);
+    ctx->root = NULL;
+}
+
+/* Read the whole of a body that was left in the request */
+static char *
+rest_read_body (req_handle handle, int length)
+{
+    char *data = calloc (length + 1, 1);
+    int len = read_request (handle, data, length);
+
+    if (len < length)
+    {
+        ERROR ("ERROR: Not enough bytes received on standard input\n");
+        data[len > 0 ? len : 0] = '\0';
+    }
+    return data;
+}
+
+/* Read and throw away any of a body that was left in the request */
+static void
+rest_discard_body (req_handle handle)
+{
+    char buffer[4096];
+
+    while (read_request (handle, buffer, sizeof (buffer)) > 0);
+}
+
+typedef struct _rest_body_reader
+{
+    req_handle handle;
+    int remaining;
+} rest_body_reader;
+
+static size_t
+rest_body_read (void *buffer, size_t buflen, void *data)
+{
+    rest_body_reader *reader = (rest_body_reader *) data;
+    int len = buflen < (size_t) reader->remaining ? (int) buflen : reader->remaining;
+
+    if (len <= 0)
+        return 0;
+    len = read_request (reader->handle, buffer, len);
+    if (len <= 0)
+    {
+        reader->remaining = 0;
+        return 0;
+    }
+    reader->remaining -= len;
+    return len;
+}
+
+/* Parse JSON from the body, reading it from the request as it arrives if it has not
+   been read already. Parsing stops at the first error without reading the rest */
+static json_t *
+rest_json_load (req_handle handle, const char *data, int length, size_t flags, json_error_t *error)
+{
+    rest_body_reader reader = { handle, length };
+
+    if (data || !handle)
+        return json_loadb (data, data ? strlen (data) : 0, flags, error);
+    return json_load_callback (rest_body_read, &reader, flags, error);
+}
+
+/* Validate the path, check any preconditions and parse the JSON data */
+static bool
+rest_post_parse (rest_set_ctx *ctx, int flags, const char *path, req_handle handle, const char *data, int length,
+                 const char *if_match, const char *if_unmodified_since, const char *if_none_match)
+{
+    sch_node *api_subtree = NULL;
+    GNode *child = NULL;
+    GNode *node;
+    json_t *json = NULL;
+    json_error_t error;
+    char *apath = NULL;
+    int schflags = 0;
+    uint64_t ts = 0;
+
+    ctx->flags = flags;
+    ctx->path = path;
+
+    /* Parsing options - always set arrays and types */
+    schflags = SCH_F_JSON_ARRAYS | SCH_F_JSON_TYPES | SCH_F_MODIFY_DATA;
+    if (verbose)
+        schflags |= SCH_F_DEBUG;
+    if (flags & FLAGS_JSON_FORMAT_NS)
+        schflags |= SCH_F_NS_MODEL_NAME;
+    schflags |= SCH_F_STRIP_DATA;
+    ctx->schflags = schflags;
+
+    /* Generate an aperyx tree from the path */
+    ctx->root = sch_path_to_gnode (g_schema, NULL, path, schflags, &api_subtree);
+    if (!ctx->root || !api_subtree)
+    {
+        VERBOSE ("REST: Path \"%s\" not found\n", path);
+        ctx->rc = HTTP_CODE_NOT_FOUND;
+        ctx->error_tag = REST_E_TAG_INVALID_VALUE;
+        return false;
+    }
+
+    /* Check if this is an RPC */
+    ctx->rpcschema = rest_rpc_schema (api_subtree);
+    if (ctx->rpcschema)
+        api_subtree = ctx->rpcschema;
+
+    /* Make sure any leaf nodes are writable */
+    if ((sch_is_leaf (api_subtree) && !sch_is_writable (api_subtree)))
+    {
+        VERBOSE ("REST: Path \"%s\" not writable\n", path);
+        ctx->rc = HTTP_CODE_FORBIDDEN;
+        ctx->error_tag = REST_E_TAG_ACCESS_DENIED;
+        return false;
+    }
+
+    /* Find the end of the path node */
+    child = ctx->root;
+    while (child && g_node_first_child (child))
+        child = g_node_first_child (child);
+
+    if (!ctx->rpcschema)
+    {
+        /* Get a timestamp for the apteryx path */
+        apath = apteryx_node_path (child);
+        ts = apteryx_timestamp (apath);
+        free (apath);
+        if (if_match && if_match[0] != '\0' &&
+            ts != strtoull (if_match, NULL, 16))
+        {
+            VERBOSE ("REST: Path \"%s\" modified since ETag:%s\n", path, if_match);
+            ctx->rc = HTTP_CODE_PRECONDITION_FAILED;
+            ctx->error_tag = REST_E_TAG_OPER_FAILED;
+            return false;
+        }
+        if (if_none_match && if_none_match[0] != '\0' &&
+            ts == strtoull (if_none_match, NULL, 16))
+        {
+            VERBOSE ("REST: Path \"%s\" unmodified since ETag:%s\n", path, if_none_match);
+            ctx->rc = HTTP_CODE_PRECONDITION_FAILED;
+            ctx->error_tag = REST_E_TAG_OPER_FAILED;
+            return false;
+        }
+        if (if_unmodified_since && if_unmodified_since[0] != '\0')
+        {
+            struct tm last_modified;
+            time_t realtime;
+            strptime (if_unmodified_since, "%a, %d %b %Y %H:%M:%S GMT", &last_modified);
+            realtime = timegm (&last_modified);
+            if ((ts / 1000000) > (realtime - g_boottime))
+            {
+                VERBOSE ("REST: Path \"%s\" modified since Time:%s\n", path, if_unmodified_since);
+                ctx->rc =  HTTP_CODE_PRECONDITION_FAILED;
+                ctx->error_tag = REST_E_TAG_OPER_FAILED;
+                return false;
+            }
+        }
+    }
+
+    /* Leaf values and RPC input may not be JSON so need all of the body */
+    if (!data && length && (flags & FLAGS_BODY_STREAM) &&
+        (ctx->rpcschema || sch_is_leaf (api_subtree)))
+    {
+        data = ctx->body = rest_read_body (handle, length);
+    }
+
+    /* Run check For PUT requiring data to be a key/value object. */
+    if (flags & FLAGS_PUT_KEY_VALUE_DATA && flags & FLAGS_METHOD_PUT)
+    {
+        char *data_resource_name;
+        sch_node *parent = sch_node_parent (api_subtree);
+        json_t *put_value = rest_json_load (handle, data, length, JSON_DECODE_ANY, &error);
+
+        /* Find the data resource node name - go up one if we are at a list key node */
+        if (sch_is_list (parent))
+        {
+            data_resource_name = sch_name (parent);
+            api_subtree = parent;
+        }
+        else
+        {
+            data_resource_name = sch_name (api_subtree);
+        }
+        if (json_object_size (put_value) != 1 || json_object_get (put_value, data_resource_name) == NULL)
+        {
+            VERBOSE ("RESTCONF: Data \"%s\" is not a single key:value (child=%s, schema=%s)\n", data ? : "", data_resource_name,
+                     sch_name (api_subtree));
+            ctx->rc = HTTP_CODE_BAD_REQUEST;
+            ctx->error_tag = REST_E_TAG_INVALID_VALUE;
+            g_free (data_resource_name);
+            if (put_value)
+                json_decref (put_value);
+            return false;
+        }
+        json = put_value;
+        g_free (data_resource_name);
+    }
+    /* Parse the JSON data (support full path to leaf value) */
+    else if (length && sch_is_leaf (api_subtree))
+    {
+        char *name;
+        sch_node *pschema = sch_node_parent (api_subtree);
+        json_t *value = json_loadb (data, strlen (data), JSON_DECODE_ANY, &error);
+        if (!value && data && data[0] != '{' && data[0] != '[')
+        {
+            value = json_stringn (data, strlen (data));
+        }
+        if (sch_is_leaf_list (pschema))
+        {
+            if (json_is_integer (value))
+                name = g_strdup_printf ("%" JSON_INTEGER_FORMAT, json_integer_value (value));
+            else if (json_is_boolean (value))
+                name = g_strdup_printf ("%s", json_is_true (value) ? "true" : "false");
+            else
+                name = g_strdup_printf ("%s", json_string_value (value));
+        }
+        else
+            name = sch_name (api_subtree);
+        json = json_object ();
+        json_object_set_new (json, name, value);
+        free (name);
+        /* Jump back node */
+        api_subtree = pschema;
+        node = child;
+        child = child->parent;
+        g_node_unlink (node);
+        free (node->data);
+        g_node_destroy (node);
+    }
+    else if (length)
+    {
+        json = rest_json_load (handle, data, length, 0, &error);
+        if (!json && ctx->rpcschema && !(flags & FLAGS_RESTCONF))
+        {
+            /* In non RESTCONF mode we support single input parameters without keys in RPC's */
+            sch_node *ischema = sch_node_child (api_subtree, "input");
+            sch_node *ichild = ischema ? sch_node_child_first (ischema) : NULL;
+            if (ischema && ichild && !sch_node_next_sibling (ichild))
+            {
+                json_t *value = json_loads (data, JSON_DECODE_ANY, &error);
+                if (!value && data && data[0] != '{' && data[0] != '[')
+                    value = json_stringn (data, strlen (data));
+                if (value)
+                {
+                    char *name = sch_name (ichild);
+                    json = json_object ();
+                    json_object_set_new (json, name, value);
+                    free (name);
+                }
+            }
+        }
+        if (!json)
+        {
+            ERROR ("error: on line %d: %s\n", error.line, error.text);
+            ctx->rc = HTTP_CODE_BAD_REQUEST;
+            ctx->error_tag = REST_E_TAG_MALFORMED;
+            return false;
+        }
+    }
+
+    ctx->api_subtree = api_subtree;
+    ctx->child = child;
+    ctx->json = json;
+    return true;
+}
+
+/* Convert the JSON data to an apteryx tree ready to be written */
+static bool
+rest_post_build (rest_set_ctx *ctx)
+{
+    int flags = ctx->flags;
+    int schflags = ctx->schflags;
+    sch_node *api_subtree = ctx->api_subtree;
+    GNode *tree = NULL;
+
+    /* Convert to GNode and validate the data */
+    if (ctx->json)
+    {
+        if (flags & FLAGS_PUT_KEY_VALUE_DATA && flags & FLAGS_METHOD_PUT)
+        {
+            tree = sch_json_to_gnode (g_schema, sch_node_parent (api_subtree), ctx->json, schflags);
+        }
+        else
+        {
+            tree = sch_json_to_gnode (g_schema, api_subtree, ctx->json, schflags);
+        }
+        json_decref (ctx->json);
+        ctx->json = NULL;
+    }
+
+    if (tree && (flags & FLAGS_RESTCONF))
+    {
+        bool not_supported = false;
+        if (flags & (FLAGS_METHOD_PUT | FLAGS_METHOD_PATCH))
+        {
+            /* For a restconf PUT or PATCH do not allow the change of an existing list key field */
+            if (restconf_is_list_key_leaf_update (api_subtree, ctx->child, tree->children))
+            {
+                not_supported = true;
+            }
+        }
+
+        if (flags & (FLAGS_METHOD_PATCH | FLAGS_METHOD_POST) &&
+            sch_is_leaf_list (api_subtree))
+        {
+            /* A leaf list entry should be fully defined in the data portion of the set */
+            not_supported = true;
+        }
+
+        if (not_supported)
+        {
+            apteryx_free_tree (tree);
+            ctx->rc = HTTP_CODE_NOT_SUPPORTED;
+            ctx->error_tag = REST_E_TAG_OPER_NOT_SUPPORTED;
+            return false;
+        }
+    }
+
+    /* Check parsing succeeded and we have input when required */
+    if (!tree)
+    {
+        switch (sch_last_err ())
+        {
+        case SCH_E_NOSCHEMANODE:
+            ctx->rc = HTTP_CODE_NOT_FOUND;
+            ctx->error_tag = REST_E_TAG_INVALID_VALUE;
+            break;
+        case SCH_E_NOTREADABLE:
+        case SCH_E_NOTWRITABLE:
+            ctx->rc = HTTP_CODE_FORBIDDEN;
+            ctx->error_tag = REST_E_TAG_ACCESS_DENIED;
+            break;
+        default:
+            ctx->rc = HTTP_CODE_BAD_REQUEST;
+            ctx->error_tag = REST_E_TAG_INVALID_VALUE;
+            break;
+        }
+        return false;
+    }
+
+    /* Adjust tree and child if it's a PUT with KEY/VALUE */
+    if (flags & FLAGS_PUT_KEY_VALUE_DATA && flags & FLAGS_METHOD_PUT)
+    {
+        _rest_adjust_tree_for_key_value (tree, &ctx->child, api_subtree);
+    }
+
+    /* Check for replace  - don't traverse tree if PUT is just setting a leaf */
+    if (flags & FLAGS_PUT_REPLACE && flags & FLAGS_METHOD_PUT)
+    {
+        if (!sch_is_leaf (api_subtree))
+        {
+            sch_traverse_tree (g_schema, api_subtree, tree, schflags | SCH_F_ADD_MISSING_NULL);
+        }
+    }
+
+    /* Write the combined tree to apteryx */
+    ctx->child->children = tree->children;
+    ctx->children = tree->children;
+    tree->children = NULL;
+    apteryx_free_tree (tree);
+
+    /* Fixup the parent pointers for the children that now in the root tree */
+    for (GNode *cnode = ctx->child->children; cnode; cnode = cnode->next)
+        cnode->parent = ctx->child;
+
+    if ((flags & FLAGS_CONDITIONS) &&
+        (flags & (FLAGS_METHOD_PUT | FLAGS_METHOD_PATCH | FLAGS_METHOD_POST)))
+    {
+        if (!sch_apply_conditions (g_schema, NULL, ctx->root, schflags))
+        {
+            ctx->rc = HTTP_CODE_NOT_FOUND;
+            ctx->error_tag = REST_E_TAG_INVALID_VALUE;
+            return false;
+        }
+    }
+    return true;
+}
+
+static char *
+rest_api_post (int flags, const char *path, req_handle handle, const char *data, int length, const char *if_match,
+               const char *if_unmodified_since, const char *if_none_match, const char *server_name,
+               const char *server_port, const char *remote_user, const char *remote_addr)
+{
+    rest_set_ctx ctx = { 0 };
+    char *resp = NULL;
+    char *error_string = NULL;
+    char *location = NULL;
+    bool res;
+    gint64 start = g_get_monotonic_time ();
+
+    /* Generate an aperyx tree from the path and parse the data */
+    res = rest_post_parse (&ctx, flags, path, handle, data, length, if_match, if_unmodified_since,
+                           if_none_match);
+    rest_timing_add (TIMING_PARSE, start);
+    if (!res)
+        goto exit;
+
+    /* Handle rpc's */
+    if (ctx.rpcschema)
+    {
+        resp = rest_rpc (flags, ctx.child, ctx.rpcschema, ctx.json);
+        ctx.json = NULL;
+        goto exit;
+    }
+
+    /* Convert to GNode and validate the data */
+    start = g_get_monotonic_time ();
+    res = rest_post_build (&ctx);
+    rest_timing_add (TIMING_BUILD, start);
+    if (!res)
+        goto exit;
+
+    start = g_get_monotonic_time ();
+    if (flags & FLAGS_RESTCONF && flags & FLAGS_METHOD_POST)
+    {
+        res = apteryx_cas_tree (ctx.root, 0);
+        if (res)
+            location = g_strdup_printf ("https://%s:%s%s/%s", server_name, server_port,
+                                        path, APTERYX_NAME (ctx.children));
+    }
+    else
+        res = apteryx_set_tree (ctx.root);
+    rest_timing_add (TIMING_APPLY, start);
+    if (res)
+    {
+        ctx.rc = flags & FLAGS_METHOD_POST ? HTTP_CODE_CREATED : HTTP_CODE_NO_CONTENT;
+    }
+    else if (errno == -EBUSY)
+    {
+        ctx.rc = HTTP_CODE_CONFLICT;
+        ctx.error_tag = REST_E_TAG_DATA_EXISTS;
+    }
+    else
+    {
+        ctx.rc = HTTP_CODE_FORBIDDEN;
+        ctx.error_tag = REST_E_TAG_ACCESS_DENIED;
+    }
+
+exit:
+    if (logging)
+        log_post_put_patch (flags, path, &ctx.root, remote_user, remote_addr, ctx.rc);
+
+    if (!resp)
+    {
+        if (flags & FLAGS_RESTCONF && ctx.rc >= 400 && ctx.rc <= 499)
+        {
+            error_string = restconf_error (ctx.rc, ctx.error_tag);
+        }
+        if (location)
+        {
+            resp = g_strdup_printf ("Status: %d\r\n"
+                                    "Content-Type: %s\r\n"
+                                    "Content-Length: %ld\r\n"
+                                    "Location: %s\r\n"
+                                    "\r\n" "%s", ctx.rc,
+                                    flags & FLAGS_RESTCONF ? "application/yang-data+json" : "application/json",
+                                    error_string ? strlen (error_string) : 0,
+                                    location, error_string ? : "");
+            g_free (location);
+        }
+        else
+            resp = g_strdup_printf ("Status: %d\r\n"
+                                    "Content-Type: %s\r\n"
+                                    "Content-Length: %ld\r\n"
+                                    "\r\n" "%s", ctx.rc,
+                                    flags & FLAGS_RESTCONF ? "application/yang-data+json" : "application/json",
+                                    error_string ? strlen (error_string) : 0,
+                                    error_string ? : "");
+    }
+    free (error_string);
+    rest_set_ctx_free (&ctx);
+    return resp;
+}
+
+/* Validate the path and build a query for everything to be deleted */
+static bool
+rest_delete_parse (rest_set_ctx *ctx, int flags, const char *path)
+{
+    sch_node *api_subtree = NULL;
+    int schflags = SCH_F_MODIFY_DATA; /* We are going to modify the tree */
+
+    ctx->flags = flags;
+    ctx->path = path;
+    ctx->rc = HTTP_CODE_NO_CONTENT;
+
+    /* Parsing options */
+    if (verbose)
+        schflags |= SCH_F_DEBUG;
+    if (flags & FLAGS_JSON_FORMAT_ARRAYS)
+        schflags |= SCH_F_JSON_ARRAYS;
+    if (flags & FLAGS_JSON_FORMAT_TYPES)
+        schflags |= SCH_F_JSON_TYPES;
+    if (flags & FLAGS_JSON_FORMAT_NS)
+        schflags |= SCH_F_NS_MODEL_NAME;
+    if (flags & FLAGS_CONFIG_ONLY)
+        schflags |= SCH_F_CONFIG; /* We only want to delete config-nodes */
+    ctx->schflags = schflags;
+
+    /* Generate an aperyx query from the path */
+    ctx->root = sch_path_to_gnode (g_schema, NULL, path, schflags, &api_subtree);
+    if (!ctx->root || !api_subtree)
+    {
+        VERBOSE ("REST: Path \"%s\" not found\n", path);
+        ctx->rc = HTTP_CODE_NOT_FOUND;
+        ctx->error_tag = REST_E_TAG_INVALID_VALUE;
+        return false;
+    }
+    if (sch_is_leaf (api_subtree) && !sch_is_writable (api_subtree))
+    {
+        VERBOSE ("REST: Path \"%s\" not writable\n", path);
+        ctx->rc = HTTP_CODE_FORBIDDEN;
+        ctx->error_tag = REST_E_TAG_ACCESS_DENIED;
+        return false;
+    }
+    ctx->api_subtree = api_subtree;
+    ctx->depth = g_node_max_height (ctx->root);
+    ctx->child = get_response_node (ctx->root, ctx->depth);
+
+    /* DELETE RPC's are handled by the caller */
+    ctx->rpcschema = rest_rpc_schema (api_subtree);
+    if (ctx->rpcschema)
+        return true;
+
+    /* We may want to get everything from here down */
+    if (sch_node_child_first (api_subtree))
+    {
+        GNode *child = ctx->root;
+        while (child->children)
+            child = child->children;
+        /* Get everything from here down if we do not already have a star */
+        if (g_strcmp0 (APTERYX_NAME (child), "*") != 0)
+        {
+            DEBUG ("%*s%s\n", g_node_max_height (ctx->root) * 2, " ", "*");
+            APTERYX_NODE (child, g_strdup ("*"));
+        }
+    }
+    return true;
+}
+
+/* Set all leaves in the queried tree to NULL. Returns false if there is nothing to write */
+static bool
+rest_delete_null (rest_set_ctx *ctx, GNode *tree)
+{
+    sch_node *api_subtree = ctx->api_subtree;
+    char *name = NULL;
+    bool write = false;
+
+    /* Set all leaves to NULL if we are allowed */
+    GNode *rnode = get_response_node (tree, ctx->depth);
+
+    /* Special treatment is required for the deletion of a leaf list item */
+    if (api_subtree && sch_is_leaf (api_subtree) && (name = sch_name (api_subtree)) &&
+        sch_is_leaf_list (sch_node_parent (api_subtree)) &&
+        g_strcmp0 (name, "*") == 0)
+    {
+        if (rnode && rnode->children->data)
+        {
+            free (rnode->children->data);
+            rnode->children->data = g_strdup ("");
+            write = true;
+        }
+    }
+    else if (!sch_traverse_tree (g_schema, api_subtree, rnode, ctx->schflags | SCH_F_SET_NULL))
+    {
+        ctx->rc = HTTP_CODE_FORBIDDEN;
+        ctx->error_tag = REST_E_TAG_ACCESS_DENIED;
+    }
+    else if (g_node_max_height (tree) <= ctx->depth)
+    {
+        if (ctx->flags & FLAGS_RESTCONF)
+        {
+            ctx->rc = HTTP_CODE_NOT_FOUND;
+            ctx->error_tag = REST_E_TAG_INVALID_VALUE;
+        }
+        else
+        {
+            /* Non-RESTCONF DELETE is idempotent: nothing to delete is success */
+            ctx->rc = HTTP_CODE_NO_CONTENT;
+        }
+    }
+    else
+    {
+        write = true;
+    }
+    g_free (name);
+    return write;
+}
+
+/* Implemented by doing a query and setting all data to NULL */
+static char *
+rest_api_delete (int flags, const char *path, const char *remote_user, const char *remote_addr)
+{
+    rest_set_ctx ctx = { 0 };
+    char *error_string = NULL;
+    char *resp = NULL;
+    gint64 start = g_get_monotonic_time ();
+    bool res;
+
+    /* Generate an aperyx query from the path */
+    res = rest_delete_parse (&ctx, flags, path);
+    rest_timing_add (TIMING_PARSE, start);
+    if (!res)
+        goto exit;
+
+    /* Handle DELETE RPC's */
+    if (ctx.rpcschema)
+    {
+        /* Do not support DELETE when using pure restconf */
+        if (flags & FLAGS_RESTCONF)
+        {
+            ctx.error_tag = REST_E_TAG_OPER_NOT_SUPPORTED;
+            ctx.rc = HTTP_CODE_NOT_SUPPORTED;
+        }
+        else
+        {
+            resp = rest_rpc (flags, ctx.child, ctx.rpcschema, NULL);
+        }
+        goto exit;
+    }
+
+    /* Query the database */
+    start = g_get_monotonic_time ();
+    GNode *tree = apteryx_query (ctx.root);
+    rest_timing_add (TIMING_QUERY, start);
+    if (tree)
+    {
+        if (rest_delete_null (&ctx, tree))
+        {
+            start = g_get_monotonic_time ();
+            res = apteryx_set_tree (tree);
+            rest_timing_add (TIMING_APPLY, start);
+            if (res)
+            {
+                ctx.rc = HTTP_CODE_NO_CONTENT;
+            }
+            else
+            {
+                ctx.rc = HTTP_CODE_BAD_REQUEST;
+                ctx.error_tag = REST_E_TAG_INVALID_VALUE;
+            }
+        }
+
+        if (logging)
+            log_delete (flags, path, &tree, remote_user, remote_addr, ctx.rc);
+
+        apteryx_free_tree (tree);
+    }
+    else if (logging)
+        log_delete (flags, path, NULL, remote_user, remote_addr, ctx.rc);
+
+exit:
+    if (!resp)
+    {
+        if (flags & FLAGS_RESTCONF && ctx.rc >= 400 && ctx.rc <= 499)
+        {
+            error_string = restconf_error (ctx.rc, ctx.error_tag);
+        }
+        resp = g_strdup_printf ("Status: %d\r\n"
+                                "Content-Type: %s\r\n"
+                                "Content-Length: %ld\r\n"
+                                "\r\n" "%s", ctx.rc,
+                                flags & FLAGS_RESTCONF ? "application/yang-data+json" : "application/json",
+                                error_string ? strlen (error_string) : 0,
+                                error_string ? : "");
+        free (error_string);
+    }
+    rest_set_ctx_free (&ctx);
+    return resp;
+}
+
+/* Merge a copy of a tree to be written into another. Values in src replace those in dst */
+static void
+rest_tree_merge_copy (GNode *dst, GNode *src)
+{
+    for (GNode *schild = src->children; schild; schild = schild->next)
+    {
+        GNode *dchild;
+        for (dchild = dst->children; dchild; dchild = dchild->next)
+        {
+            if (g_strcmp0 (APTERYX_NAME (dchild), APTERYX_NAME (schild)) == 0)
+                break;
+        }
+        if (dchild && !APTERYX_HAS_VALUE (dchild) && !APTERYX_HAS_VALUE (schild))
+        {
+            rest_tree_merge_copy (dchild, schild);
+            continue;
+        }
+        if (dchild)
+        {
+            g_node_unlink (dchild);
+            apteryx_free_tree (dchild);
+        }
+        g_node_append (dst, g_node_copy_deep (schild, (GCopyFunc) g_strdup, NULL));
+    }
+}
+
+/* Set every value below a node to NULL */
+static void
+rest_tree_null (GNode *node)
+{
+    if (APTERYX_HAS_VALUE (node))
+    {
+        free (node->children->data);
+        node->children->data = g_strdup ("");
+        return;
+    }
+    for (GNode *child = node->children; child; child = child->next)
+        rest_tree_null (child);
+}
+
+typedef struct _rest_batch_op
+{
+    const char *operation;
+    const char *path;
+    const char *if_match;
+    char *data;
+    int flags;
+    gchar **names; /* Node names from the model root down to a deleted path */
+    rest_set_ctx ctx;
+} rest_batch_op;
+
+/* Find the node for the path of a delete in the combined tree */
+static GNode *
+rest_batch_find (GNode *tree, gchar **names)
+{
+    for (int i = 0; tree && names[i]; i++)
+    {
+        GNode *child = tree->children;
+        while (child && g_strcmp0 (APTERYX_NAME (child), names[i]) != 0)
+            child = child->next;
+        tree = child;
+    }
+    return tree;
+}
+
+/* Validate a set of operations and apply them all in one transaction */
+static char *
+rest_api_batch (int flags, const char *data, int length,
+                const char *remote_user, const char *remote_addr)
+{
+    rest_batch_op *ops = NULL;
+    GNode *combined;
+    GNode *tree;
+    uint64_t cas = UINT64_MAX;
+    json_error_t error;
+    json_t *json;
+    json_t *value;
+    json_t *results;
+    char *body;
+    char *resp;
+    size_t count;
+    size_t i;
+    bool valid = true;
+    int rc = HTTP_CODE_OK;
+
+    /* Expect an array of { "operation": string, "path": string, "value": any, "if-match": string } */
+    json = length ? json_loadb (data, length, 0, &error) : NULL;
+    json_array_foreach (json, i, value)
+    {
+        const char *operation = json_string_value (json_object_get (value, "operation"));
+        if (!json_string_value (json_object_get (value, "path")))
+            break;
+        if (g_strcmp0 (operation, "delete") != 0 &&
+            ((g_strcmp0 (operation, "merge") != 0 && g_strcmp0 (operation, "replace") != 0) ||
+             !json_object_get (value, "value")))
+            break;
+    }
+    if (!json || !json_is_array (json) || i != json_array_size (json))
+    {
+        VERBOSE ("REST: Batch request is not an array of operations\n");
+        if (json)
+            json_decref (json);
+        return rest_error_response (flags, HTTP_CODE_BAD_REQUEST, REST_E_TAG_MALFORMED);
+    }
+
+    /* Validate every operation against the schema before writing anything */
+    count = json_array_size (json);
+    ops = g_malloc0 (count * sizeof (rest_batch_op));
+    json_array_foreach (json, i, value)
+    {
+        rest_batch_op *op = &ops[i];
+
+        op->operation = json_string_value (json_object_get (value, "operation"));
+        op->path = json_string_value (json_object_get (value, "path"));
+        op->if_match = json_string_value (json_object_get (value, "if-match"));
+        op->flags = flags & ~FLAGS_METHOD_MASK;
+        if (g_strcmp0 (op->operation, "delete") == 0)
+        {
+            op->flags |= FLAGS_METHOD_DELETE;
+            if (!rest_delete_parse (&op->ctx, op->flags, op->path))
+                continue;
+            if (op->ctx.rpcschema)
+            {
+                op->ctx.rc = HTTP_CODE_NOT_SUPPORTED;
+                op->ctx.error_tag = REST_E_TAG_OPER_NOT_SUPPORTED;
+                continue;
+            }
+            if (op->if_match && op->if_match[0] != '\0')
+            {
+                char *apath = apteryx_node_path (op->ctx.child);
+                uint64_t ts = apteryx_timestamp (apath);
+                free (apath);
+                if (ts != strtoull (op->if_match, NULL, 16))
+                {
+                    VERBOSE ("REST: Path \"%s\" modified since ETag:%s\n", op->path, op->if_match);
+                    op->ctx.rc = HTTP_CODE_PRECONDITION_FAILED;
+                    op->ctx.error_tag = REST_E_TAG_OPER_FAILED;
+                    continue;
+                }
+            }
+            /* Remember where the delete applies for nodes added by earlier operations */
+            GPtrArray *names = g_ptr_array_new ();
+            for (GNode *node = op->ctx.child; node && node->parent; node = node->parent)
+                g_ptr_array_insert (names, 0, g_strdup (APTERYX_NAME (node)));
+            g_ptr_array_insert (names, 0, g_strdup (APTERYX_NAME (op->ctx.root) + 1));
+            g_ptr_array_add (names, NULL);
+            op->names = (gchar **) g_ptr_array_free (names, false);
+            /* Swap the query for the data it finds with all leaves set to NULL */
+            tree = apteryx_query (op->ctx.root);
+            apteryx_free_tree (op->ctx.root);
+            op->ctx.root = tree;
+            op->ctx.child = NULL;
+            if (tree && !rest_delete_null (&op->ctx, tree))
+            {
+                apteryx_free_tree (op->ctx.root);
+                op->ctx.root = NULL;
+            }
+        }
+        else
+        {
+            if (g_strcmp0 (op->operation, "merge") == 0)
+                op->flags |= FLAGS_METHOD_PATCH;
+            else
+                op->flags |= FLAGS_METHOD_PUT | FLAGS_PUT_REPLACE;
+            op->data = json_dumps (json_object_get (value, "value"), JSON_ENCODE_ANY);
+            if (!rest_post_parse (&op->ctx, op->flags, op->path, NULL, op->data, strlen (op->data),
+                                  op->if_match, NULL, NULL))
+                continue;
+            if (op->ctx.rpcschema)
+            {
+                op->ctx.rc = HTTP_CODE_NOT_SUPPORTED;
+                op->ctx.error_tag = REST_E_TAG_OPER_NOT_SUPPORTED;
+                continue;
+            }
+            if (!rest_post_build (&op->ctx))
+                continue;
+            op->ctx.rc = HTTP_CODE_NO_CONTENT;
+        }
+        if (op->if_match && op->if_match[0] != '\0')
+            cas = MIN (cas, strtoull (op->if_match, NULL, 16));
+    }
+    for (i = 0; i < count && valid; i++)
+    {
+        if (ops[i].ctx.rc >= 400)
+        {
+            rc = ops[i].ctx.rc;
+            valid = false;
+        }
+    }
+
+    /* Combine the operations in order so later changes win. The model roots
+       are children of one root so every model is written in the same call */
+    combined = APTERYX_NODE (NULL, g_strdup (""));
+    for (i = 0; i < count && valid; i++)
+    {
+        GNode *root = ops[i].ctx.root;
+        if (ops[i].names && (tree = rest_batch_find (combined, ops[i].names)))
+            rest_tree_null (tree);
+        if (!root)
+            continue;
+        for (tree = combined->children; tree; tree = tree->next)
+        {
+            if (g_strcmp0 (APTERYX_NAME (tree), APTERYX_NAME (root) + 1) == 0)
+                break;
+        }
+        if (!tree)
+            tree = APTERYX_NODE (combined, g_strdup (APTERYX_NAME (root) + 1));
+        rest_tree_merge_copy (tree, root);
+    }
+
+    /* Write the changes. With an ETag nothing may have changed since the oldest one */
+    if (valid && combined->children)
+    {
+        int res = HTTP_CODE_NO_CONTENT;
+        rest_e_tag error_tag = REST_E_TAG_NONE;
+        bool written;
+
+        written = cas != UINT64_MAX ? apteryx_cas_tree (combined, cas) : apteryx_set_tree (combined);
+        if (!written)
+        {
+            if (errno == -EBUSY && cas != UINT64_MAX)
+            {
+                res = HTTP_CODE_PRECONDITION_FAILED;
+                error_tag = REST_E_TAG_OPER_FAILED;
+            }
+            else if (errno == -EBUSY)
+            {
+                res = HTTP_CODE_CONFLICT;
+                error_tag = REST_E_TAG_DATA_EXISTS;
+            }
+            else
+            {
+                res = HTTP_CODE_FORBIDDEN;
+                error_tag = REST_E_TAG_ACCESS_DENIED;
+            }
+            rc = res;
+        }
+        for (i = 0; i < count; i++)
+        {
+            /* A failed precondition is reported against the operations with an ETag */
+            if (res == HTTP_CODE_PRECONDITION_FAILED && !(ops[i].if_match && ops[i].if_match[0] != '\0'))
+            {
+                ops[i].ctx.rc = HTTP_CODE_FAILED_DEPENDENCY;
+                continue;
+            }
+            ops[i].ctx.rc = res;
+            ops[i].ctx.error_tag = error_tag;
+        }
+    }
+    apteryx_free_tree (combined);
+
+    /* Report the status of each operation */
+    results = json_array ();
+    for (i = 0; i < count; i++)
+    {
+        rest_batch_op *op = &ops[i];
+        json_t *result = json_object ();
+
+        /* Nothing is applied when any operation fails validation */
+        if (!valid && op->ctx.rc < 400)
+            op->ctx.rc = HTTP_CODE_FAILED_DEPENDENCY;
+        if (logging && op->flags & FLAGS_METHOD_DELETE)
+            log_delete (op->flags, op->path, &op->ctx.root, remote_user, remote_addr, op->ctx.rc);
+        else if (logging)
+            log_post_put_patch (op->flags, op->path, &op->ctx.root, remote_user, remote_addr, op->ctx.rc);
+        json_object_set_new (result, "status", json_integer (op->ctx.rc));
+        if (op->ctx.error_tag != REST_E_TAG_NONE)
+            json_object_set_new (result, "error-tag", json_string (error_tags[op->ctx.error_tag]));
+        json_array_append_new (results, result);
+        rest_set_ctx_free (&op->ctx);
+        g_strfreev (op->names);
+        free (op->data);
+    }
+    g_free (ops);
+    json_decref (json);
+    json = json_object ();
+    json_object_set_new (json, "results", results);
+    body = json_dumps (json, 0);
+    json_decref (json);
+
+    resp = g_strdup_printf ("Status: %d\r\n"
+                            "Content-Type: %s\r\n"
+                            "Content-Length: %ld\r\n"
+                            "\r\n" "%s", rc,
+                            flags & FLAGS_RESTCONF ? "application/yang-data+json" : "application/json",
+                            body ? strlen (body) : 0,
+                            body ? : "");
+    free (body);
+    return resp;
+}
+
+static bool
+rest_option_check_children (sch_node *schema)
+{
+    for (sch_node *s = sch_node_child_first (schema); s; s = sch_node_next_sibling (s))
+    {
+        if (sch_is_writable (s))
+            return true;
+
+        if (rest_option_check_children (s))
+            return true;
+    }
+    return false;
+}
+
+static char *
+rest_api_options (int flags, const char *path)
+{
+    sch_node *schema;
+    sch_ns *ns;
+    char *resp = NULL;
+    char *error_string = NULL;
+    char *options = NULL;
+    char *key;
+    char *colon;
+    char *_path = g_strdup (path);
+    char *ptr = strchr (_path, '=');
+    int len = 0;
+    int rc = HTTP_CODE_NOT_FOUND;
+    bool read_write = false;
+
+    /* Substitute key equals value with a slash to make the sch_lookup work */
+    while (ptr)
+    {
+        *ptr = '/';
+        ptr = strchr (ptr, '=');
+    }
+
+    ptr = _path;
+    if (ptr[0] == '/')
+    {
+        ptr++;
+    }
+
+    key = strchr (ptr, '/');
+    if (key)
+    {
+        len = key - ptr;
+        key = g_strndup (ptr, len);
+    }
+    else
+    {
+        key = g_strdup (ptr);
+    }
+
+    colon = strchr (key, ':');
+    if (colon)
+    {
+        *colon = '\0';
+        colon++;
+        ptr += colon - key;
+    }
+
+    ns = sch_lookup_ns (g_schema, NULL, key, SCH_F_NS_MODEL_NAME, false);
+    schema = sch_lookup_with_ns (g_schema, ns, ptr);
+    g_free (_path);
+    g_free (key);
+
+    if (schema)
+    {
+        if (!sch_is_leaf (schema))
+        {
+            read_write = rest_option_check_children (schema);
+        }
+        else
+        {
+            read_write = sch_is_writable (schema);
+        }
+        options = g_strdup_printf ("%s%s%s", sch_is_readable (schema) ? "GET,HEAD,OPTIONS" : "",
+                                    read_write ? "," : "",
+                                    read_write ? "POST,PUT,PATCH,DELETE" : "");
+        rc = HTTP_CODE_OK;
+    }
+
+    if (rc == HTTP_CODE_OK)
+    {
+        resp = g_strdup_printf ("Status: %u\r\n"
+                                "Allow: %s\r\n"
+                                "Accept-Patch: %s\r\n"
+                                "Content-Type: text/html\r\n"
+                                "Content-Length: 0\r\n"
+                                "\r\n", rc, options,
+                                flags & FLAGS_RESTCONF ? "application/yang-data+json" : "application/json");
+        g_free (options);
+    }
+    else
+    {
+        if (flags & FLAGS_RESTCONF)
+        {
+            error_string = restconf_error (rc, REST_E_TAG_INVALID_VALUE);
+        }
+        resp = g_strdup_printf ("Status: %d\r\n"
+                                "Content-Type: %s\r\n"
+                                "Content-Length: %ld\r\n"
+                                "\r\n" "%s", rc,
+                                flags & FLAGS_RESTCONF ? "application/yang-data+json" : "application/json",
+                                error_string ? strlen (error_string) : 0,
+                                error_string ? : "");
+        free (error_string);
+    }
+    return resp;
+}
+
+typedef struct WatchRequest
+{
+    req_handle handle;
+    int flags;
+    rest_schema *schema;
+    sch_node *api;
+    char *path;
+    char *wpath;
+} WatchRequest;
+static GList *g_watch_requests = NULL;
+static pthread_mutex_t g_watch_lock = PTHREAD_MUTEX_INITIALIZER;
+
+static bool
+watch_callback (GNode * root, void *arg)
+{
+    WatchRequest *req = (WatchRequest *) arg;
+    sch_instance *schema = g_schema;
+    GNode *node;
+    json_t *json;
+    char *data;
+    int schflags = 0;
+
+    /* Protect the watch request list */
+    pthread_mutex_lock (&g_watch_lock);
+
+    /* Make sure the request is still valid */
+    if (!g_list_find (g_watch_requests, req))
+    {
+        ERROR ("REST: Watch callback no longer valid\n");
+        goto exit;
+    }
+    g_schema = req->schema->instance;
+
+    VERBOSE ("REST(%p): Watch callback for \"%s\"\n", req->handle, req->path);
+
+    /* Find the node representing the requested data */
+    node = apteryx_path_node (root, req->path);
+    if (!node)
+    {
+        ERROR ("REST(%p): Watch callback could not find requested node in data\n", req->handle);
+        goto exit;
+    }
+
+    /* Convert the data to json from the expected path offset */
+    if (verbose)
+        schflags |= SCH_F_DEBUG;
+    if (req->flags & FLAGS_JSON_FORMAT_ARRAYS)
+        schflags |= SCH_F_JSON_ARRAYS;
+    if (req->flags & FLAGS_JSON_FORMAT_TYPES)
+        schflags |= SCH_F_JSON_TYPES;
+    if (req->flags & FLAGS_JSON_FORMAT_NS)
+        schflags |= (SCH_F_NS_MODEL_NAME|SCH_F_NS_PREFIX);
+    if (req->flags & FLAGS_CONDITIONS)
+        schflags |= SCH_F_CONDITIONS;
+
+    json = sch_gnode_to_json (g_schema, req->api, node, schflags);
+    if (!json || (data = json_dumps (json, JSON_ENCODE_ANY)) == NULL)
+    {
+        ERROR ("REST(%p): Failed to convert watch callback data to json\n", req->handle);
+        if (json)
+            json_decref (json);
+        goto exit;
+    }
+
+    /* Send the event */
+    if (req->flags & FLAGS_EVENT_STREAM)
+        send_response (req->handle, "data: ", false);
+    send_response (req->handle, data, false);
+    /* SSE detects end of data via an empty line */
+    if (req->flags & FLAGS_EVENT_STREAM)
+        send_response (req->handle, "\r\n\r\n", true);
+    else
+        send_response (req->handle, "\r\n", true);
+    metrics_watch_event ();
+    json_decref (json);
+    free (data);
+
+exit:
+    g_schema = schema;
+    pthread_mutex_unlock (&g_watch_lock);
+    apteryx_free_tree (root);
+    return true;
+}
+
+static void
+rest_api_watch (req_handle handle, int flags, const char *path)
+{
+    sch_node *api_subtree = sch_lookup (g_schema, path);
+    if (!api_subtree)
+    {
+        char *resp = g_strdup_printf ("Status: 404\r\n"
+                                      "Content-Type: text/html\r\n\r\n"
+                                      "The requested URL %s was not found on this server.\n",
+                                      path);
+        send_response (handle, resp, false);
+        g_free (resp);
+        return;
+    }
+
+    WatchRequest *req = g_malloc0 (sizeof (WatchRequest));
+    req->handle = handle;
+    req->flags = flags | FLAGS_JSON_FORMAT_ARRAYS | FLAGS_JSON_FORMAT_TYPES;
+    req->schema = rest_schema_ref (g_schema_pinned);
+    req->api = api_subtree;
+    req->path = g_strdup (path);
+    if (sch_is_leaf (api_subtree))
+        req->wpath = g_strdup (path);
+    else
+        req->wpath = g_strdup_printf ("%s/*", path);
+    DEBUG ("REST(%p): Adding watch for \"%s\"\n", req->handle, path);
+    pthread_mutex_lock (&g_watch_lock);
+    g_watch_requests = g_list_append (g_watch_requests, req);
+    pthread_mutex_unlock (&g_watch_lock);
+    metrics_watch (true);
+    add_callback (APTERYX_WATCHERS_PATH, req->wpath, (void *) watch_callback, true,
+                  (void *) req, 1, 0);
+
+    /* Response */
+    send_response (handle, "Status: 200\r\n", false);
+    send_response (handle, "Connection: 'keep-alive'\r\n", false);
+    if (flags & FLAGS_APPLICATION_STREAM)
+        send_response (handle, "Content-type: application/stream+json\r\n", false);
+    else
+        send_response (handle, "Content-type: text/event-stream\r\n", false);
+    send_response (handle, "Cache-Control: 'no-cache'\r\n", false);
+    send_response (handle, "\r\n", true);
+
+    /* Initial data */
+    GNode *query = sch_path_to_query (g_schema, NULL, path, 0);
+    GNode *tree = query ? apteryx_query (query) : NULL;
+    if (query)
+        apteryx_free_tree (query);
+    if (tree)
+    {
+        watch_callback (tree, (void *) req);
+    }
+    else
+    {
+        /* Send some empty lines to force the web server
+           to respond to the client */
+        send_response (handle, "\r\n\r\n", true);
+    }
+
+    while (is_connected (req->handle, false))
+    {
+        /* still alive */
+    }
+    DEBUG ("REST(%p): Removing watch for \"%s\"\n", req->handle, path);
+    pthread_mutex_lock (&g_watch_lock);
+    g_watch_requests = g_list_remove (g_watch_requests, req);
+    pthread_mutex_unlock (&g_watch_lock);
+    delete_callback (APTERYX_WATCHERS_PATH, req->wpath, (void *) watch_callback, (void *) req);
+    metrics_watch (false);
+    rest_schema_unpin (req->schema);
+    g_free (req->path);
+    g_free (req->wpath);
+    g_free (req);
+}
+
+/* RESTCONF resources that only change with the schema. They are rendered once for
+   each schema and docroot and sent with the yang-library content-id as their ETag */
+static GHashTable *g_restconf_cache = NULL;
+static char *g_content_id = NULL;
+static guint g_restconf_epoch = 0;
+static GMutex g_restconf_lock;
+
+static void
+rest_restconf_reset (char *content_id)
+{
+    g_mutex_lock (&g_restconf_lock);
+    if (g_restconf_cache)
+        g_hash_table_destroy (g_restconf_cache);
+    g_restconf_cache = NULL;
+    g_free (g_content_id);
+    g_content_id = content_id;
+    g_restconf_epoch++;
+    g_mutex_unlock (&g_restconf_lock);
+}
+
+/* Publish the yang-library for the current schema */
+static void
+rest_yang_library_create (void)
+{
+    rest_restconf_reset (yang_library_create (g_schema));
+}
+
+static char *
+rest_restconf_render (int flags, const char *rpath, const char *path,
+                      const char *remote_user, const char *remote_addr)
+{
+    json_t *json = NULL;
+    char *body = NULL;
+
+    if (strcmp (path, "/operations") == 0)
     {
-        if (!sch_apply_conditions (g_schema, NULL, root, schflags))
+        json_t *obj = json_object ();
+        sch_node *schema = sch_lookup (g_schema, path);
+        sch_node *child = schema ? sch_node_child_first (schema) : NULL;
+
+        json = json_object ();
+        while (child)
         {
-            rc = HTTP_CODE_NOT_FOUND;
-            error_tag = REST_E_TAG_INVALID_VALUE;
-            goto exit;
+            char *name = sch_name (child);
+            char *model = sch_model (child, false);
+            char *fname = g_strdup_printf ("%s:%s", model, name);
+            char *rpcpath = g_strdup_printf ("%s/operations/%s", rpath, fname);
+            json_object_set_new (obj, fname, json_string (rpcpath));
+            free (rpcpath);
+            free (fname);
+            free (model);
+            free (name);
+            child = sch_node_next_sibling (child);
         }
+        json_object_set_new (json, "ietf-restconf:operations", obj);
     }
-
-    if (flags & FLAGS_RESTCONF && flags & FLAGS_METHOD_POST)
-    {
-        res = apteryx_cas_tree (root, 0);
-        if (res)
-            location = g_strdup_printf ("https://%s:%s%s/%s", server_name, server_port,
-                                        path, APTERYX_NAME (children));
-    }
-    else
-        res = apteryx_set_tree (root);
-    if (res)
+    else if (strcmp (path, "/yang-library-version") == 0)
     {
-        rc = flags & FLAGS_METHOD_POST ? HTTP_CODE_CREATED : HTTP_CODE_NO_CONTENT;
+        json = json_object ();
+        json_object_set_new (json, "yang-library-version", json_string ("2019-01-04"));
     }
-    else if (errno == -EBUSY)
+    else if (path[0] == '\0')
     {
-        rc = HTTP_CODE_CONFLICT;
-        error_tag = REST_E_TAG_DATA_EXISTS;
+        json_t *obj = json_object ();
+        char *root_resource = g_strdup_printf ("ietf-restconf:%s", rpath + 1);
+
+        json = json_object ();
+        json_object_set_new (obj, "data", json_object ());
+        json_object_set_new (obj, "operations", json_object ());
+        json_object_set_new (obj, "yang-library-version", json_string ("2019-01-04"));
+        json_object_set_new (json, root_resource, obj);
+        free (root_resource);
     }
     else
     {
-        rc = HTTP_CODE_FORBIDDEN;
-        error_tag = REST_E_TAG_ACCESS_DENIED;
-    }
+        /* The yang-library, also returned for an empty data path */
+        char *resp = rest_api_get (flags, "/ietf-yang-library:yang-library", NULL, NULL,
+                                   remote_user, remote_addr);
+        const char *data = resp ? strstr (resp, "\r\n\r\n") : NULL;
 
-exit:
-    if (logging)
-        log_post_put_patch (flags, path, root, remote_user, remote_addr, rc);
-
-    if (!resp)
-    {
-        if (flags & FLAGS_RESTCONF && rc >= 400 && rc <= 499)
-        {
-            error_string = restconf_error (rc, error_tag);
-        }
-        if (location)
-        {
-            resp = g_strdup_printf ("Status: %d\r\n"
-                                    "Content-Type: %s\r\n"
-                                    "Content-Length: %ld\r\n"
-                                    "Location: %s\r\n"
-                                    "\r\n" "%s", rc,
-                                    flags & FLAGS_RESTCONF ? "application/yang-data+json" : "application/json",
-                                    error_string ? strlen (error_string) : 0,
-                                    location, error_string ? : "");
-            g_free (location);
-        }
-        else
-            resp = g_strdup_printf ("Status: %d\r\n"
-                                    "Content-Type: %s\r\n"
-                                    "Content-Length: %ld\r\n"
-                                    "\r\n" "%s", rc,
-                                    flags & FLAGS_RESTCONF ? "application/yang-data+json" : "application/json",
-                                    error_string ? strlen (error_string) : 0,
-                                    error_string ? : "");
+        if (data && g_str_has_prefix (resp, "Status: 200\r\n"))
+            body = strdup (data + 4);
+        g_free (resp);
+        return body;
     }
-    free (error_string);
-    apteryx_free_tree (tree);
-    apteryx_free_tree (root);
-    return resp;
+    body = json_dumps (json, 0);
+    json_decref (json);
+    return body;
 }
 
-/* Implemented by doing a query and setting all data to NULL */
 static char *
-rest_api_delete (int flags, const char *path, const char *remote_user, const char *remote_addr)
+rest_restconf_static (int flags, const char *rpath, const char *path, const char *if_none_match,
+                      const char *remote_user, const char *remote_addr)
 {
-    sch_node *api_subtree = NULL;
-    char *error_string = NULL;
-    char *resp = NULL;
-    char *name = NULL;
-    int rc = HTTP_CODE_NO_CONTENT;
-    rest_e_tag error_tag = REST_E_TAG_NONE;
-    int schflags = SCH_F_MODIFY_DATA; /* We are going to modify the tree */
+    bool library = strcmp (path, "/data") == 0 || strcmp (path, "/data/ietf-yang-library:yang-library") == 0;
+    char *resp;
+    char *etag;
+    char *key;
+    char *body;
+    guint epoch;
 
-    /* Parsing options */
-    if (verbose)
-        schflags |= SCH_F_DEBUG;
-    if (flags & FLAGS_JSON_FORMAT_ARRAYS)
-        schflags |= SCH_F_JSON_ARRAYS;
-    if (flags & FLAGS_JSON_FORMAT_TYPES)
-        schflags |= SCH_F_JSON_TYPES;
-    if (flags & FLAGS_JSON_FORMAT_NS)
-        schflags |= SCH_F_NS_MODEL_NAME;
-    if (flags & FLAGS_CONFIG_ONLY)
-        schflags |= SCH_F_CONFIG; /* We only want to delete config-nodes */
+    if (!library && path[0] != '\0' && strcmp (path, "/operations") != 0 &&
+        strcmp (path, "/yang-library-version") != 0)
+        return NULL;
 
-    /* Generate an aperyx query from the path */
-    GNode *query = sch_path_to_gnode (g_schema, NULL, path, schflags, &api_subtree);
-    if (!query || !api_subtree)
+    g_mutex_lock (&g_restconf_lock);
+    etag = g_strdup_printf ("%s.%u", g_content_id ? : "0", g_schema_pinned->generation);
+    key = g_strdup_printf ("%u:%x:%s%s", g_schema_pinned->generation, flags, rpath, path);
+    resp = g_restconf_cache ? g_strdup (g_hash_table_lookup (g_restconf_cache, key)) : NULL;
+    epoch = g_restconf_epoch;
+    g_mutex_unlock (&g_restconf_lock);
+
+    if (rest_etag_match (if_none_match, etag))
     {
-        VERBOSE ("REST: Path \"%s\" not found\n", path);
-        rc = HTTP_CODE_NOT_FOUND;
-        error_tag = REST_E_TAG_INVALID_VALUE;
-        goto exit;
+        g_free (resp);
+        resp = g_strdup_printf ("Status: %d\r\n"
+                                "ETag: %s\r\n"
+                                "Content-Length: 0\r\n\r\n",
+                                HTTP_CODE_NOT_MODIFIED, etag);
+        if (library && logging)
+            log_get_head (flags, path, remote_user, remote_addr, HTTP_CODE_NOT_MODIFIED);
     }
-    if (sch_is_leaf (api_subtree) && !sch_is_writable (api_subtree))
+    else if (resp)
     {
-        VERBOSE ("REST: Path \"%s\" not writable\n", path);
-        apteryx_free_tree (query);
-        rc = HTTP_CODE_FORBIDDEN;
-        error_tag = REST_E_TAG_ACCESS_DENIED;
-        goto exit;
+        if (library && logging)
+            log_get_head (flags, path, remote_user, remote_addr, HTTP_CODE_OK);
     }
-
-    int query_depth = g_node_max_height (query);
-
-    /* Handle DELETE RPC's */
-    sch_node *rpcschema = rest_rpc_schema (api_subtree);
-    if (rpcschema)
+    else if ((body = rest_restconf_render (flags, rpath, library ? "/data" : path,
+                                           remote_user, remote_addr)) != NULL)
     {
-        /* Do not support DELETE when using pure restconf */
-        if (flags & FLAGS_RESTCONF)
-        {
-            error_tag = REST_E_TAG_OPER_NOT_SUPPORTED;
-            rc = HTTP_CODE_NOT_SUPPORTED;
-        }
-        else
+        resp = g_strdup_printf ("Status: %d\r\n"
+                                "ETag: %s\r\n"
+                                "Content-Type: application/yang-data+json\r\n"
+                                "Content-Length: %ld\r\n"
+                                "\r\n" "%s",
+                                HTTP_CODE_OK, etag, strlen (body), body);
+        free (body);
+
+        /* Unless the yang-library changed while rendering */
+        g_mutex_lock (&g_restconf_lock);
+        if (epoch == g_restconf_epoch)
         {
-            resp = rest_rpc (flags, get_response_node (query, query_depth), rpcschema, NULL);
+            if (!g_restconf_cache)
+                g_restconf_cache = g_hash_table_new_full (g_str_hash, g_str_equal, g_free, g_free);
+            g_hash_table_replace (g_restconf_cache, key, g_strdup (resp));
+            key = NULL;
         }
-        apteryx_free_tree (query);
-        goto exit;
+        g_mutex_unlock (&g_restconf_lock);
     }
+    g_free (key);
+    g_free (etag);
+    return resp;
+}
 
-    /* We may want to get everything from here down */
-    if (sch_node_child_first (api_subtree))
+/* Data models loaded on demand (-L) */
+typedef struct _rest_model
+{
+    char *path;
+    char *file;
+    gint loaded;
+    bool present;
+} rest_model;
+static GHashTable *g_models = NULL;
+static GHashTable *g_model_index = NULL;
+static char *g_model_dir = NULL;
+static GMutex g_models_lock;
+static GMutex g_models_load_lock;
+static gint g_models_all = 0;
+/* Models wanted by requests waiting for a load (protected by g_models_lock) */
+static GList *g_models_pending = NULL;
+
+static void
+rest_models_index_add (GHashTable *index, const char *key, rest_model *model)
+{
+    GList *models = g_hash_table_lookup (index, key);
+
+    if (!models)
+        g_hash_table_insert (index, g_strdup (key), g_list_append (NULL, model));
+    else if (!g_list_find (models, model))
+        models = g_list_append (models, model);
+}
+
+/* Index a model by its name, prefix, namespace and top level nodes
+   without parsing the rest of the file */
+static void
+rest_models_index_file (GHashTable *index, rest_model *model)
+{
+    const char *attrs[] = { "model", "prefix", "namespace", NULL };
+    xmlTextReaderPtr reader;
+    int ret;
+
+    reader = xmlReaderForFile (model->path, NULL, XML_PARSE_NONET);
+    if (!reader)
     {
-        GNode *child = query;
-        while (child->children)
-            child = child->children;
-        /* Get everything from here down if we do not already have a star */
-        if (g_strcmp0 (APTERYX_NAME (child), "*") != 0)
-        {
-            DEBUG ("%*s%s\n", g_node_max_height (query) * 2, " ", "*");
-            APTERYX_NODE (child, g_strdup ("*"));
-        }
+        ERROR ("REST: Failed to index model \"%s\"\n", model->path);
+        return;
     }
-
-    /* Query the database */
-    GNode *tree = apteryx_query (query);
-    apteryx_free_tree (query);
-    if (tree)
+    ret = xmlTextReaderRead (reader);
+    while (ret == 1)
     {
-        /* Set all leaves to NULL if we are allowed */
-        GNode *rnode = get_response_node (tree, query_depth);
+        const char *name = (const char *) xmlTextReaderConstLocalName (reader);
+        int depth = xmlTextReaderDepth (reader);
 
-        /* Special treatment is required for the deletion of a leaf list item */
-        if (api_subtree && sch_is_leaf (api_subtree) && (name = sch_name (api_subtree)) &&
-            sch_is_leaf_list (sch_node_parent (api_subtree)) &&
-            g_strcmp0 (name, "*") == 0)
-        {
-            if (rnode && rnode->children->data)
-            {
-                free (rnode->children->data);
-                rnode->children->data = g_strdup ("");
-                if (apteryx_set_tree (tree))
-                {
-                    rc = HTTP_CODE_NO_CONTENT;
-                }
-                else
-                {
-                    rc = HTTP_CODE_BAD_REQUEST;
-                    error_tag = REST_E_TAG_INVALID_VALUE;
-                }
-            }
-        }
-        else if (!sch_traverse_tree (g_schema, api_subtree, rnode, schflags | SCH_F_SET_NULL))
+        if (xmlTextReaderNodeType (reader) != XML_READER_TYPE_ELEMENT)
         {
-            rc = HTTP_CODE_FORBIDDEN;
-            error_tag = REST_E_TAG_ACCESS_DENIED;
+            ret = xmlTextReaderRead (reader);
+            continue;
         }
-        else if (g_node_max_height (tree) <= query_depth)
+        if (depth == 0)
         {
-            if (flags & FLAGS_RESTCONF)
+            for (int i = 0; g_strcmp0 (name, "MODULE") == 0 && attrs[i]; i++)
             {
-                rc = HTTP_CODE_NOT_FOUND;
-                error_tag = REST_E_TAG_INVALID_VALUE;
-            }
-            else
-            {
-                /* Non-RESTCONF DELETE is idempotent: nothing to delete is success */
-                rc = HTTP_CODE_NO_CONTENT;
+                xmlChar *value = xmlTextReaderGetAttribute (reader, BAD_CAST attrs[i]);
+                if (value)
+                    rest_models_index_add (index, (const char *) value, model);
+                xmlFree (value);
             }
+            ret = xmlTextReaderRead (reader);
+            continue;
         }
-        else if (apteryx_set_tree (tree))
-        {
-            rc = HTTP_CODE_NO_CONTENT;
-        }
-        else
-        {
-            rc = HTTP_CODE_BAD_REQUEST;
-            error_tag = REST_E_TAG_INVALID_VALUE;
-        }
-        g_free (name);
-
-        if (logging)
-            log_delete (flags, path, tree, remote_user, remote_addr, rc);
-
-        apteryx_free_tree (tree);
-    }
-    else if (logging)
-        log_delete (flags, path, NULL, remote_user, remote_addr, rc);
-
-exit:
-    if (!resp)
-    {
-        if (flags & FLAGS_RESTCONF && rc >= 400 && rc <= 499)
+        if (g_strcmp0 (name, "NODE") == 0)
         {
-            error_string = restconf_error (rc, error_tag);
+            xmlChar *value = xmlTextReaderGetAttribute (reader, BAD_CAST "name");
+            if (value)
+            {
+                const char *colon = strchr ((const char *) value, ':');
+                rest_models_index_add (index, (const char *) value, model);
+                if (colon)
+                    rest_models_index_add (index, colon + 1, model);
+            }
+            xmlFree (value);
         }
-        resp = g_strdup_printf ("Status: %d\r\n"
-                                "Content-Type: %s\r\n"
-                                "Content-Length: %ld\r\n"
-                                "\r\n" "%s", rc,
-                                flags & FLAGS_RESTCONF ? "application/yang-data+json" : "application/json",
-                                error_string ? strlen (error_string) : 0,
-                                error_string ? : "");
-        free (error_string);
+        /* Skip everything below the top level */
+        ret = xmlTextReaderNext (reader);
     }
-    return resp;
+    xmlFreeTextReader (reader);
 }
 
-static bool
-rest_option_check_children (sch_node *schema)
+static void
+rest_models_link (const char *dir, const char *path, const char *file)
 {
-    for (sch_node *s = sch_node_child_first (schema); s; s = sch_node_next_sibling (s))
-    {
-        if (sch_is_writable (s))
-            return true;
+    char *target = realpath (path, NULL);
+    char *link = g_build_filename (dir, file, NULL);
 
-        if (rest_option_check_children (s))
-            return true;
-    }
-    return false;
+    if (!target || symlink (target, link) != 0)
+        ERROR ("REST: Failed to link model \"%s\": %s\n", path, strerror (errno));
+    free (target);
+    g_free (link);
 }
 
-static char *
-rest_api_options (int flags, const char *path)
+static void
+rest_models_dir_free (char *dir)
 {
-    sch_node *schema;
-    sch_ns *ns;
-    char *resp = NULL;
-    char *error_string = NULL;
-    char *options = NULL;
-    char *key;
-    char *colon;
-    char *_path = g_strdup (path);
-    char *ptr = strchr (_path, '=');
-    int len = 0;
-    int rc = HTTP_CODE_NOT_FOUND;
-    bool read_write = false;
+    GDir *gdir;
+    const char *file;
 
-    /* Substitute key equals value with a slash to make the sch_lookup work */
-    while (ptr)
+    if (!dir)
+        return;
+    gdir = g_dir_open (dir, 0, NULL);
+    while (gdir && (file = g_dir_read_name (gdir)) != NULL)
     {
-        *ptr = '/';
-        ptr = strchr (ptr, '=');
+        char *link = g_build_filename (dir, file, NULL);
+        unlink (link);
+        g_free (link);
     }
+    if (gdir)
+        g_dir_close (gdir);
+    rmdir (dir);
+    g_free (dir);
+}
 
-    ptr = _path;
-    if (ptr[0] == '/')
-    {
-        ptr++;
-    }
+/* Index every model in the model path into a new directory the loaded models are
+   read from. Files that are not models and models already loaded are linked into it */
+static bool
+rest_models_scan (const char *path, GHashTable **index, char **dir)
+{
+    gchar **dirs = g_strsplit (path, ":", -1);
+    GHashTableIter iter;
+    rest_model *model;
 
-    key = strchr (ptr, '/');
-    if (key)
+    *dir = g_dir_make_tmp ("apteryx-rest-XXXXXX", NULL);
+    if (!*dir)
     {
-        len = key - ptr;
-        key = g_strndup (ptr, len);
+        ERROR ("REST: Failed to create a directory for the loaded models\n");
+        g_strfreev (dirs);
+        return false;
     }
-    else
+    *index = g_hash_table_new_full (g_str_hash, g_str_equal, g_free, (GDestroyNotify) g_list_free);
+    g_hash_table_iter_init (&iter, g_models);
+    while (g_hash_table_iter_next (&iter, NULL, (gpointer *) &model))
+        model->present = false;
+    for (int i = 0; dirs[i]; i++)
     {
-        key = g_strdup (ptr);
-    }
+        GDir *gdir = g_dir_open (dirs[i], 0, NULL);
+        const char *file;
 
-    colon = strchr (key, ':');
-    if (colon)
+        while (gdir && (file = g_dir_read_name (gdir)) != NULL)
+        {
+            char *filename = g_build_filename (dirs[i], file, NULL);
+            if (!g_str_has_suffix (file, ".xml"))
+            {
+                rest_models_link (*dir, filename, file);
+                g_free (filename);
+                continue;
+            }
+            model = g_hash_table_lookup (g_models, filename);
+            if (!model)
+            {
+                model = g_malloc0 (sizeof (rest_model));
+                model->path = filename;
+                model->file = g_strdup (file);
+                g_hash_table_insert (g_models, model->path, model);
+            }
+            else
+                g_free (filename);
+            model->present = true;
+            rest_models_index_file (*index, model);
+            if (g_atomic_int_get (&model->loaded) || g_atomic_int_get (&g_models_all))
+            {
+                rest_models_link (*dir, model->path, model->file);
+                g_atomic_int_set (&model->loaded, 1);
+            }
+        }
+        if (gdir)
+            g_dir_close (gdir);
+    }
+    g_hash_table_iter_init (&iter, g_models);
+    while (g_hash_table_iter_next (&iter, NULL, (gpointer *) &model))
     {
-        *colon = '\0';
-        colon++;
-        ptr += colon - key;
+        if (!model->present)
+            g_atomic_int_set (&model->loaded, 0);
     }
+    g_strfreev (dirs);
+    DEBUG ("REST: Indexed %d models\n", g_hash_table_size (g_models));
+    return true;
+}
 
-    ns = sch_lookup_ns (g_schema, NULL, key, SCH_F_NS_MODEL_NAME, false);
-    schema = sch_lookup_with_ns (g_schema, ns, ptr);
-    g_free (_path);
-    g_free (key);
+/* Rebuild what is derived from the whole schema after new models are published */
+static void
+rest_schema_changed (bool rebind)
+{
+    rest_schema_enter ();
+    if (!g_models || g_atomic_int_get (&g_models_all))
+        rest_yang_library_create ();
+    if (rebind)
+        rest_static_reset ();
 
-    if (schema)
+    /* Move active watches to the new schema without dropping the clients */
+    pthread_mutex_lock (&g_watch_lock);
+    for (GList *iter = g_watch_requests; rebind && iter; iter = g_list_next (iter))
     {
-        if (!sch_is_leaf (schema))
-        {
-            read_write = rest_option_check_children (schema);
-        }
-        else
+        WatchRequest *req = (WatchRequest *) iter->data;
+        sch_node *api = sch_lookup (g_schema, req->path);
+        if (api)
         {
-            read_write = sch_is_writable (schema);
+            rest_schema_unpin (req->schema);
+            req->schema = rest_schema_ref (g_schema_pinned);
+            req->api = api;
         }
-        options = g_strdup_printf ("%s%s%s", sch_is_readable (schema) ? "GET,HEAD,OPTIONS" : "",
-                                    read_write ? "," : "",
-                                    read_write ? "POST,PUT,PATCH,DELETE" : "");
-        rc = HTTP_CODE_OK;
     }
+    pthread_mutex_unlock (&g_watch_lock);
+    rest_schema_leave ();
+}
 
-    if (rc == HTTP_CODE_OK)
-    {
-        resp = g_strdup_printf ("Status: %u\r\n"
-                                "Allow: %s\r\n"
-                                "Accept-Patch: %s\r\n"
-                                "Content-Type: text/html\r\n"
-                                "Content-Length: 0\r\n"
-                                "\r\n", rc, options,
-                                flags & FLAGS_RESTCONF ? "application/yang-data+json" : "application/json");
-        g_free (options);
+/* Load the given models as well as those already loaded and publish the result */
+static void
+rest_models_load (GList *models, bool all)
+{
+    sch_instance *instance;
+    GList *pending;
+    GList *added = NULL;
+    gint64 start;
+
+    /* Loading parses every linked model again, so the models wanted by all the
+       requests that arrive during a load are added by a single load */
+    g_mutex_lock (&g_models_lock);
+    for (GList *iter = models; iter; iter = g_list_next (iter))
+    {
+        if (!g_list_find (g_models_pending, iter->data))
+            g_models_pending = g_list_prepend (g_models_pending, iter->data);
     }
-    else
+    g_mutex_unlock (&g_models_lock);
+
+    g_mutex_lock (&g_models_load_lock);
+    g_mutex_lock (&g_models_lock);
+    pending = g_models_pending;
+    g_models_pending = NULL;
+    g_mutex_unlock (&g_models_lock);
+    if (all)
     {
-        if (flags & FLAGS_RESTCONF)
+        g_list_free (pending);
+        pending = g_hash_table_get_values (g_models);
+    }
+    for (GList *iter = pending; iter; iter = g_list_next (iter))
+    {
+        rest_model *model = (rest_model *) iter->data;
+        if (model->present && !g_atomic_int_get (&model->loaded))
         {
-            error_string = restconf_error (rc, REST_E_TAG_INVALID_VALUE);
+            rest_models_link (g_model_dir, model->path, model->file);
+            added = g_list_prepend (added, model);
         }
-        resp = g_strdup_printf ("Status: %d\r\n"
-                                "Content-Type: %s\r\n"
-                                "Content-Length: %ld\r\n"
-                                "\r\n" "%s", rc,
-                                flags & FLAGS_RESTCONF ? "application/yang-data+json" : "application/json",
-                                error_string ? strlen (error_string) : 0,
-                                error_string ? : "");
-        free (error_string);
     }
-    return resp;
+    g_list_free (pending);
+    if (added)
+    {
+        start = g_get_monotonic_time ();
+        instance = sch_load (g_model_dir);
+        if (instance)
+        {
+            rest_schema_publish (instance);
+            DEBUG ("REST: Loaded %d more models in %" PRId64 "us\n",
+                   g_list_length (added), g_get_monotonic_time () - start);
+        }
+        else
+            ERROR ("REST: Failed to load models from \"%s\"\n", g_model_dir);
+        /* Do not try the same models again on every request */
+        for (GList *iter = added; iter; iter = g_list_next (iter))
+            g_atomic_int_set (&((rest_model *) iter->data)->loaded, 1);
+        g_list_free (added);
+    }
+    if (all && !g_atomic_int_get (&g_models_all))
+    {
+        /* The yang-library and /api.xml describe every model */
+        g_atomic_int_set (&g_models_all, 1);
+        rest_schema_changed (false);
+    }
+    g_mutex_unlock (&g_models_load_lock);
 }
 
-typedef struct WatchRequest
+static GList *
+rest_models_lookup (GList *models, const char *key)
 {
-    req_handle handle;
-    int flags;
-    sch_node *api;
-    char *path;
-    char *wpath;
-} WatchRequest;
-static GList *g_watch_requests = NULL;
-static pthread_mutex_t g_watch_lock = PTHREAD_MUTEX_INITIALIZER;
+    for (GList *iter = g_hash_table_lookup (g_model_index, key); iter; iter = g_list_next (iter))
+    {
+        if (!g_list_find (models, iter->data))
+            models = g_list_append (models, iter->data);
+    }
+    return models;
+}
 
-static bool
-watch_callback (GNode * root, void *arg)
+/* Make sure the models a request needs are loaded before it starts */
+static void
+rest_models_need (int flags, const char *path)
 {
-    WatchRequest *req = (WatchRequest *) arg;
-    GNode *node;
-    json_t *json;
-    char *data;
-    int schflags = 0;
+    GList *models = NULL;
+    bool loaded = true;
+    char *name;
+    char *node;
+    char *colon;
 
-    /* Protect the watch request list */
-    pthread_mutex_lock (&g_watch_lock);
+    if (!g_models || g_atomic_int_get (&g_models_all))
+        return;
+    if ((flags & FLAGS_RESTCONF) && (path[0] == '\0' || strcmp (path, "/yang-library-version") == 0))
+        return;
 
-    /* Make sure the request is still valid */
-    if (!g_list_find (g_watch_requests, req))
+    /* The first node of the path or its module selects the models */
+    if ((flags & FLAGS_RESTCONF) && g_ascii_strncasecmp (path, "/data", strlen ("/data")) == 0)
+        path += strlen ("/data");
+    if (g_str_has_prefix (path, "/operations/"))
+        path += strlen ("/operations");
+    if (path[0] == '/')
+        path++;
+    name = g_strndup (path, strcspn (path, "/?="));
+    colon = strchr (name, ':');
+    node = colon ? colon + 1 : name;
+    if (colon)
+        *colon = '\0';
+
+    if (name[0] == '\0' || strcmp (name, ".xml") == 0 || strcmp (name, "operations") == 0 ||
+        strcmp (name, "_bulk-get") == 0 || strcmp (name, "_batch") == 0 ||
+        (colon && strcmp (name, "ietf-yang-library") == 0) ||
+        strcmp (node, "yang-library") == 0 || strcmp (node, "modules-state") == 0)
     {
-        ERROR ("REST: Watch callback no longer valid\n");
-        goto exit;
+        /* Whole schema, or more than one path that is not looked at here */
+        rest_models_load (NULL, true);
+        g_free (name);
+        return;
     }
 
-    VERBOSE ("REST(%p): Watch callback for \"%s\"\n", req->handle, req->path);
-
-    /* Find the node representing the requested data */
-    node = apteryx_path_node (root, req->path);
-    if (!node)
+    g_mutex_lock (&g_models_lock);
+    if (colon)
     {
-        ERROR ("REST(%p): Watch callback could not find requested node in data\n", req->handle);
-        goto exit;
+        models = rest_models_lookup (models, name);
+        *colon = ':';
     }
+    models = rest_models_lookup (models, name);
+    models = rest_models_lookup (models, node);
+    g_mutex_unlock (&g_models_lock);
+    for (GList *iter = models; iter; iter = g_list_next (iter))
+        loaded = loaded && g_atomic_int_get (&((rest_model *) iter->data)->loaded);
+    if (!loaded)
+        rest_models_load (models, false);
+    g_list_free (models);
+    g_free (name);
+}
 
-    /* Convert the data to json from the expected path offset */
-    if (verbose)
-        schflags |= SCH_F_DEBUG;
-    if (req->flags & FLAGS_JSON_FORMAT_ARRAYS)
-        schflags |= SCH_F_JSON_ARRAYS;
-    if (req->flags & FLAGS_JSON_FORMAT_TYPES)
-        schflags |= SCH_F_JSON_TYPES;
-    if (req->flags & FLAGS_JSON_FORMAT_NS)
-        schflags |= (SCH_F_NS_MODEL_NAME|SCH_F_NS_PREFIX);
-    if (req->flags & FLAGS_CONDITIONS)
-        schflags |= SCH_F_CONDITIONS;
+static void
+rest_model_free (rest_model *model)
+{
+    g_free (model->path);
+    g_free (model->file);
+    g_free (model);
+}
 
-    json = sch_gnode_to_json (g_schema, req->api, node, schflags);
-    if (!json || (data = json_dumps (json, JSON_ENCODE_ANY)) == NULL)
+static bool
+rest_models_init (const char *path)
+{
+    g_models = g_hash_table_new_full (g_str_hash, g_str_equal, NULL, (GDestroyNotify) rest_model_free);
+    return rest_models_scan (path, &g_model_index, &g_model_dir);
+}
+
+static void
+rest_models_free (void)
+{
+    if (g_model_index)
+        g_hash_table_destroy (g_model_index);
+    g_model_index = NULL;
+    if (g_models)
+        g_hash_table_destroy (g_models);
+    g_models = NULL;
+    g_list_free (g_models_pending);
+    g_models_pending = NULL;
+    rest_models_dir_free (g_model_dir);
+    g_model_dir = NULL;
+}
+
+/* Reload the data models when the files in the model path change */
+#define REST_RELOAD_DELAY_MS 500
+static int g_reload_fd = -1;
+static guint g_reload_watch = 0;
+static guint g_reload_timer = 0;
+static GThread *g_reload_thread = NULL;
+static gint g_reload_busy = 0;
+
+static gpointer
+rest_schema_reload (gpointer data)
+{
+    sch_instance *instance = NULL;
+    GHashTable *index = NULL;
+    char *dir = NULL;
+    gint64 start = g_get_monotonic_time ();
+
+    g_mutex_lock (&g_models_load_lock);
+    if (g_models)
     {
-        ERROR ("REST(%p): Failed to convert watch callback data to json\n", req->handle);
-        if (json)
-            json_decref (json);
-        goto exit;
+        if (rest_models_scan (g_model_path, &index, &dir))
+            instance = sch_load (dir);
+        if (instance)
+        {
+            GHashTable *old_index;
+            char *old_dir;
+
+            g_mutex_lock (&g_models_lock);
+            old_index = g_model_index;
+            g_model_index = index;
+            old_dir = g_model_dir;
+            g_model_dir = dir;
+            g_mutex_unlock (&g_models_lock);
+            index = old_index;
+            dir = old_dir;
+        }
     }
+    else
+        instance = sch_load (g_model_path);
 
-    /* Send the event */
-    if (req->flags & FLAGS_EVENT_STREAM)
-        send_response (req->handle, "data: ", false);
-    send_response (req->handle, data, false);
-    /* SSE detects end of data via an empty line */
-    if (req->flags & FLAGS_EVENT_STREAM)
-        send_response (req->handle, "\r\n\r\n", true);
+    if (instance)
+    {
+        /* Requests in flight finish on the schema they started with */
+        rest_schema_publish (instance);
+        rest_schema_changed (true);
+        NOTICE ("REST: Reloaded data models in %" PRId64 "us\n", g_get_monotonic_time () - start);
+    }
     else
-        send_response (req->handle, "\r\n", true);
-    json_decref (json);
-    free (data);
+        ERROR ("REST: Failed to reload data models from \"%s\"\n", g_model_path);
+    g_mutex_unlock (&g_models_load_lock);
 
-exit:
-    pthread_mutex_unlock (&g_watch_lock);
-    apteryx_free_tree (root);
-    return true;
+    if (index)
+        g_hash_table_destroy (index);
+    rest_models_dir_free (dir);
+    g_atomic_int_set (&g_reload_busy, 0);
+    return NULL;
 }
 
-static void
-rest_api_watch (req_handle handle, int flags, const char *path)
+static gboolean
+rest_reload_start (gpointer data)
 {
-    sch_node *api_subtree = sch_lookup (g_schema, path);
-    if (!api_subtree)
+    g_reload_timer = 0;
+    if (g_atomic_int_get (&g_reload_busy))
     {
-        char *resp = g_strdup_printf ("Status: 404\r\n"
-                                      "Content-Type: text/html\r\n\r\n"
-                                      "The requested URL %s was not found on this server.\n",
-                                      path);
-        send_response (handle, resp, false);
-        g_free (resp);
-        return;
+        /* Changed again while loading */
+        g_reload_timer = g_timeout_add (REST_RELOAD_DELAY_MS, rest_reload_start, NULL);
+        return false;
     }
+    if (g_reload_thread)
+        g_thread_join (g_reload_thread);
+    g_atomic_int_set (&g_reload_busy, 1);
+    g_reload_thread = g_thread_new ("schema reload", rest_schema_reload, NULL);
+    return false;
+}
 
-    WatchRequest *req = g_malloc0 (sizeof (WatchRequest));
-    req->handle = handle;
-    req->flags = flags | FLAGS_JSON_FORMAT_ARRAYS | FLAGS_JSON_FORMAT_TYPES;
-    req->api = api_subtree;
-    req->path = g_strdup (path);
-    if (sch_is_leaf (api_subtree))
-        req->wpath = g_strdup (path);
-    else
-        req->wpath = g_strdup_printf ("%s/*", path);
-    DEBUG ("REST(%p): Adding watch for \"%s\"\n", req->handle, path);
-    pthread_mutex_lock (&g_watch_lock);
-    g_watch_requests = g_list_append (g_watch_requests, req);
-    pthread_mutex_unlock (&g_watch_lock);
-    add_callback (APTERYX_WATCHERS_PATH, req->wpath, (void *) watch_callback, true,
-                  (void *) req, 1, 0);
+static gboolean
+rest_reload_event (GIOChannel *source, GIOCondition condition, gpointer data)
+{
+    char buf[4096] __attribute__ ((aligned (__alignof__ (struct inotify_event))));
 
-    /* Response */
-    send_response (handle, "Status: 200\r\n", false);
-    send_response (handle, "Connection: 'keep-alive'\r\n", false);
-    if (flags & FLAGS_APPLICATION_STREAM)
-        send_response (handle, "Content-type: application/stream+json\r\n", false);
-    else
-        send_response (handle, "Content-type: text/event-stream\r\n", false);
-    send_response (handle, "Cache-Control: 'no-cache'\r\n", false);
-    send_response (handle, "\r\n", true);
+    if (read (g_reload_fd, buf, sizeof (buf)) <= 0)
+        return true;
 
-    /* Initial data */
-    GNode *query = sch_path_to_query (g_schema, NULL, path, 0);
-    GNode *tree = query ? apteryx_query (query) : NULL;
-    if (query)
-        apteryx_free_tree (query);
-    if (tree)
+    /* Wait for the files to settle before loading them */
+    if (g_reload_timer)
+        g_source_remove (g_reload_timer);
+    g_reload_timer = g_timeout_add (REST_RELOAD_DELAY_MS, rest_reload_start, NULL);
+    return true;
+}
+
+static void
+rest_reload_init (const char *path)
+{
+    gchar **dirs = g_strsplit (path, ":", -1);
+    GIOChannel *channel;
+
+    g_reload_fd = inotify_init1 (IN_NONBLOCK | IN_CLOEXEC);
+    if (g_reload_fd < 0)
     {
-        watch_callback (tree, (void *) req);
+        ERROR ("REST: Failed to watch the model path for changes\n");
+        g_strfreev (dirs);
+        return;
     }
-    else
+    for (int i = 0; dirs[i]; i++)
     {
-        /* Send some empty lines to force the web server
-           to respond to the client */
-        send_response (handle, "\r\n\r\n", true);
+        if (inotify_add_watch (g_reload_fd, dirs[i], IN_CREATE | IN_CLOSE_WRITE | IN_DELETE | IN_MOVE) < 0)
+            ERROR ("REST: Failed to watch \"%s\" for changes\n", dirs[i]);
     }
+    g_strfreev (dirs);
+    channel = g_io_channel_unix_new (g_reload_fd);
+    g_reload_watch = g_io_add_watch (channel, G_IO_IN, rest_reload_event, NULL);
+    g_io_channel_unref (channel);
+}
 
-    while (is_connected (req->handle, false))
+static void
+rest_reload_shutdown (void)
+{
+    if (g_reload_watch)
+        g_source_remove (g_reload_watch);
+    g_reload_watch = 0;
+    if (g_reload_timer)
+        g_source_remove (g_reload_timer);
+    g_reload_timer = 0;
+    if (g_reload_thread)
+        g_thread_join (g_reload_thread);
+    g_reload_thread = NULL;
+    if (g_reload_fd >= 0)
+        close (g_reload_fd);
+    g_reload_fd = -1;
+}
+
+/* Label the request metrics with the top-level model of the path (without any module
+   prefix). Only names found in the schema are used so the label values are bounded */
+static void
+rest_metrics_model (int flags, const char *path)
+{
+    char *apath;
+    int len;
+
+    if ((flags & FLAGS_RESTCONF) && g_ascii_strncasecmp (path, "/data/", strlen ("/data/")) == 0)
+        path += strlen ("/data");
+    if (path[0] == '/')
+        path++;
+    len = strcspn (path, "/=?");
+    if (memchr (path, ':', len))
     {
-        /* still alive */
+        const char *name = (char *) memchr (path, ':', len) + 1;
+        len -= name - path;
+        path = name;
     }
-    DEBUG ("REST(%p): Removing watch for \"%s\"\n", req->handle, path);
-    pthread_mutex_lock (&g_watch_lock);
-    g_watch_requests = g_list_remove (g_watch_requests, req);
-    pthread_mutex_unlock (&g_watch_lock);
-    delete_callback (APTERYX_WATCHERS_PATH, req->wpath, (void *) watch_callback, (void *) req);
-    g_free (req->path);
-    g_free (req->wpath);
-    g_free (req);
+    if (len == 0)
+        return;
+    apath = g_strdup_printf ("/%.*s", len, path);
+    if (sch_lookup (g_schema, apath))
+        metrics_request_model (apath + 1);
+    g_free (apath);
 }
 
-void
-rest_api (req_handle handle, int flags, const char *rpath, const char *path,
-          const char *if_match, const char *if_none_match,
-          const char *if_modified_since, const char *if_unmodified_since,
-          const char *server_name, const char *server_port,
-          const char *remote_addr, const char *remote_user,
-          const char *data, int length)
+static void
+rest_api_process (req_handle handle, int flags, const char *rpath, const char *path,
+                  const char *if_match, const char *if_none_match,
+                  const char *if_modified_since, const char *if_unmodified_since,
+                  const char *server_name, const char *server_port,
+                  const char *remote_addr, const char *remote_user,
+                  const char *data, int length)
 {
+    const char *uri = path;
+    char *body = NULL;
     char *resp = NULL;
 
     VERBOSE ("REQ:\n[0x%x] %s\n", flags, path);
@@ -1864,79 +5066,64 @@ rest_api (req_handle handle, int flags, const char *rpath, const char *path,
 
     /* Process method */
     path = path + strlen (rpath);
+    rest_metrics_model (flags, path);
     if (flags & FLAGS_RESTCONF)
     {
-        json_t *json = NULL;
-        int rc = HTTP_CODE_OK;
-        if (g_ascii_strncasecmp (path, "/data", strlen("/data")) == 0)
-            path += strlen ("/data");
-        else if (flags & FLAGS_METHOD_GET && g_strcmp0 (path, "/operations") == 0)
-        {
-            json = json_object();
-            json_t *obj = json_object ();
-            sch_node *schema = sch_lookup (g_schema, path);
-            sch_node *child = schema ? sch_node_child_first (schema) : NULL;
-            while (child)
-            {
-                char *name = sch_name (child);
-                char *model = sch_model (child, false);
-                char *fname = g_strdup_printf ("%s:%s", model, name);
-                char *rpcpath = g_strdup_printf ("%s/operations/%s", rpath, fname);
-                json_object_set_new (obj, fname, json_string (rpcpath));
-                free (rpcpath);
-                free (fname);
-                free (model);
-                free (name);
-                child = sch_node_next_sibling (child);
-            }
-            json_object_set_new (json, "ietf-restconf:operations", obj);
-        }
-        else if (flags & FLAGS_METHOD_GET && g_strcmp0 (path, "/yang-library-version") == 0)
-        {
-            json = json_object();
-            json_object_set_new (json, "yang-library-version", json_string ("2019-01-04"));
-        }
-        else if (flags & FLAGS_METHOD_GET && path[0] == '\0')
-        {
-            json = json_object();
-            json_t *obj = json_object();
-            json_object_set_new (obj, "data", json_object ());
-            json_object_set_new (obj, "operations", json_object ());
-            json_object_set_new (obj, "yang-library-version", json_string ("2019-01-04"));
-            char *root_resource = g_strdup_printf ("ietf-restconf:%s", rpath + 1);
-            json_object_set_new (json, root_resource, obj);
-            free (root_resource);
-        }
-        if (json)
+        if ((flags & FLAGS_METHOD_GET) && !strchr (path, '?'))
+            resp = rest_restconf_static (flags, rpath, path, if_none_match, remote_user, remote_addr);
+        if (resp)
         {
-            char *json_str = json_dumps (json, 0);
-            resp = g_strdup_printf ("Status: %d\r\n"
-                                    "Content-Type: application/yang-data+json\r\n"
-                                    "Content-Length: %ld\r\n"
-                                    "\r\n" "%s",
-                                    rc,
-                                    json_str ? strlen (json_str) : 0,
-                                    json_str ? : "");
-            free (json_str);
-            json_decref (json);
             VERBOSE ("RESP:\n%s\n", resp);
             send_response (handle, resp, false);
             g_free (resp);
             return;
         }
+        if (g_ascii_strncasecmp (path, "/data", strlen("/data")) == 0)
+            path += strlen ("/data");
+    }
+    if (flags & FLAGS_METHOD_POST && strcmp (path, "/_bulk-get") == 0)
+    {
+        if (flags & FLAGS_BODY_STREAM)
+        {
+            gint64 start = g_get_monotonic_time ();
+            data = body = rest_read_body (handle, length);
+            rest_timing_add (TIMING_READ, start);
+        }
+        resp = rest_api_bulk_get (flags, data, length, remote_user, remote_addr);
+    }
+    else if (flags & FLAGS_METHOD_POST && strcmp (path, "/_batch") == 0)
+    {
+        if (flags & FLAGS_BODY_STREAM)
+        {
+            gint64 start = g_get_monotonic_time ();
+            data = body = rest_read_body (handle, length);
+            rest_timing_add (TIMING_READ, start);
+        }
+        resp = rest_api_batch (flags, data, length, remote_user, remote_addr);
     }
-    if (flags & FLAGS_METHOD_GET || flags & FLAGS_METHOD_HEAD)
+    else if (flags & FLAGS_METHOD_GET || flags & FLAGS_METHOD_HEAD)
     {
-        if (strcmp (path, ".xml") == 0)
+        rest_static *api_xml = strcmp (path, ".xml") == 0 ? rest_static_api_xml () : NULL;
+        if (api_xml)
         {
-            rest_api_xml (handle);
+            rest_api_static (handle, flags, api_xml, if_none_match);
+            rest_static_unref (api_xml);
             return;
         }
         else if (strcmp (path, ".html") == 0)
         {
-            rest_api_html (handle);
+            rest_api_static (handle, flags, g_api_html, if_none_match);
+            return;
+        }
+        else if (strcmp (path, "/.metrics") == 0)
+            resp = rest_api_metrics (flags);
+        else if (g_str_has_prefix (path, REST_JOBS_PATH) && (flags & (FLAGS_EVENT_STREAM | FLAGS_APPLICATION_STREAM)))
+        {
+            rest_api_job_watch (handle, flags, path + strlen (REST_JOBS_PATH));
             return;
         }
+        else if (g_str_has_prefix (path, REST_JOBS_PATH))
+            resp = rest_api_job (flags, path + strlen (REST_JOBS_PATH));
         else if (flags & (FLAGS_EVENT_STREAM | FLAGS_APPLICATION_STREAM))
         {
             rest_api_watch (handle, flags, path);
@@ -1950,7 +5137,7 @@ rest_api (req_handle handle, int flags, const char *rpath, const char *path,
                                  remote_user, remote_addr);
     }
     else if (flags & (FLAGS_METHOD_POST|FLAGS_METHOD_PUT|FLAGS_METHOD_PATCH))
-        resp = rest_api_post (flags, path, data, length, if_match, if_unmodified_since,
+        resp = rest_api_post (flags, path, handle, data, length, if_match, if_unmodified_since,
                               if_none_match, server_name, server_port, remote_user, remote_addr);
     else if (flags & FLAGS_METHOD_DELETE)
         resp = rest_api_delete (flags, path, remote_user, remote_addr);
@@ -1965,15 +5152,44 @@ rest_api (req_handle handle, int flags, const char *rpath, const char *path,
                                 path);
     }
 
+    if (logging_slow_usec)
+        log_slow (flags, uri, resp, remote_user, remote_addr);
+    if (flags & FLAGS_SERVER_TIMING)
+        resp = rest_timing_header (resp);
     VERBOSE ("RESP:\n%s\n", resp);
     send_response (handle, resp, false);
     g_free (resp);
+    free (body);
     return;
 }
 
+void
+rest_api (req_handle handle, int flags, const char *rpath, const char *path,
+          const char *if_match, const char *if_none_match,
+          const char *if_modified_since, const char *if_unmodified_since,
+          const char *server_name, const char *server_port,
+          const char *remote_addr, const char *remote_user,
+          const char *data, int length)
+{
+    rest_models_need (flags, path + strlen (rpath));
+    rest_schema_enter ();
+    g_rpath = rpath;
+    g_handle = handle;
+    rest_api_process (handle, flags, rpath, path, if_match, if_none_match,
+                      if_modified_since, if_unmodified_since, server_name, server_port,
+                      remote_addr, remote_user, data, length);
+    /* Requests that fail before the body is parsed leave it unread */
+    if (flags & FLAGS_BODY_STREAM)
+        rest_discard_body (handle);
+    g_rpath = NULL;
+    g_handle = NULL;
+    rest_schema_leave ();
+}
+
 gboolean
 rest_init (const char *path)
 {
+    sch_instance *instance = NULL;
     struct sysinfo info;
     struct timespec monotime;
     struct timespec monotime_raw;
@@ -1987,26 +5203,84 @@ rest_init (const char *path)
     g_boottime += (monotime.tv_sec - monotime_raw.tv_sec);
 
     /* Load Data Models */
-    g_schema = sch_load (path);
-    if (!g_schema)
+    g_model_path = g_strdup (path);
+    if (rest_lazy_models && rest_models_init (path))
+    {
+        /* Models are loaded when first needed */
+        instance = sch_load (g_model_dir);
+        if (!instance)
+            rest_models_free ();
+    }
+    if (!instance)
+        instance = sch_load (path);
+    if (!instance)
     {
         return false;
     }
+    rest_schema_publish (instance);
 
-    yang_library_create (g_schema);
+    rest_schema_enter ();
+    rest_yang_library_create ();
     restconf_monitoring_create (g_schema);
+    rest_static_reset ();
+    rest_schema_leave ();
+    rest_reload_init (path);
 
     /* Register with the YANG condition parser */
     sch_condition_register (debug, verbose);
 
+    /* Helper threads for large queries */
+    if (g_get_num_processors () > 1)
+    {
+        g_query_pool = g_thread_pool_new (rest_query_part_run, NULL,
+                                          MIN (g_get_num_processors (), REST_QUERY_THREADS_MAX),
+                                          FALSE, NULL);
+    }
+
+    /* Executor for async RPCs */
+    g_jobs_pool = g_thread_pool_new (rest_job_run, NULL, REST_JOBS_THREADS, FALSE, NULL);
 
     return true;
 }
 
+/* Drop jobs that have not started and abort the running ones. This has to
+   happen before the Lua states they run in are closed */
+void
+rest_jobs_shutdown (void)
+{
+    if (g_jobs_pool)
+    {
+        rest_rpc_cancel ();
+        g_thread_pool_free (g_jobs_pool, true, true);
+    }
+    g_jobs_pool = NULL;
+}
+
 void
 rest_shutdown (void)
 {
+    rest_reload_shutdown ();
+
+    /* Wait for any helper threads */
+    if (g_query_pool)
+        g_thread_pool_free (g_query_pool, false, true);
+    g_query_pool = NULL;
+    rest_jobs_shutdown ();
+    if (g_jobs)
+        g_hash_table_destroy (g_jobs);
+    g_jobs = NULL;
+    rest_defaults_cache_clear ();
+    rest_restconf_reset (NULL);
+    rest_static_unref (g_api_xml);
+    g_api_xml = NULL;
+    rest_static_free (g_api_html);
+    g_api_html = NULL;
+    g_free (g_model_path);
+    g_model_path = NULL;
+
     /* Cleanup datamodels */
-    if (g_schema)
-        sch_free (g_schema);
+    if (g_schema_current)
+        rest_schema_unpin (g_schema_current);
+    g_schema_current = NULL;
+    rest_models_free ();
 }
@@ -21,47 +21,417 @@
 #include <lualib.h>
 #include <lauxlib.h>
 #include <fnmatch.h>
+#include <sys/stat.h>
 
 struct rpc_handler {
     char *path;
     int flags;
-    int ref;
+    bool async;
+    bool views;
+    bool stream;
+    char *file; /* Handler loaded from this file when first called */
+    int *refs; /* The handler in each Lua state */
+    /* Execution budget (0 for the global default) */
+    gint64 budget_us;
+    gint64 budget_instructions;
+    /* Result caching for GET */
+    gint64 cache_ttl;
+    gchar **cache_keys;
+    /* Metrics */
+    guint64 calls;
+    guint64 duration_us;
+    guint64 buckets[METRICS_BUCKETS];
+    guint64 cache_hits;
+    guint64 cache_misses;
+    guint64 overruns;
+};
+
+/* Independent Lua states each running their own copy of the scripts.
+   An RPC checks out a free state for as long as its handler runs. Async
+   handlers can run for a long time, so when there are any they get states
+   of their own after the -j states used by everything else */
+struct rpc_state {
+    int index;
+    lua_State *ls;
+    /* Metrics */
+    guint64 calls;
+    guint64 wait_us;
 };
 
 #define REST_RPC_CB_TABLE_REGISTRY_INDEX "rest_rpc_cb_table"
-static pthread_mutex_t g_ls_lock = PTHREAD_MUTEX_INITIALIZER;
 static GList *g_rpcs = NULL;
-static lua_State *g_ls = NULL;
+static struct rpc_state *g_states = NULL;
+static int g_nstates = 0;
+static int g_ninline = 0;
+static GAsyncQueue *g_free_states = NULL;
+static GAsyncQueue *g_free_job_states = NULL;
 
 static void
 rpc_free (struct rpc_handler *rpc)
 {
     free (rpc->path);
+    g_free (rpc->refs);
+    g_free (rpc->file);
+    g_strfreev (rpc->cache_keys);
     free (rpc);
 }
 
-static int
-char_count (const char *s, char c)
+static struct rpc_state *
+rpc_state_get (bool async)
 {
-    int count = 0;
-    while (*s++)
-        if (*s == c) count++;
-    return count;
+    struct rpc_state *state;
+    gint64 start = g_get_monotonic_time ();
+
+    if (async && g_nstates > g_ninline)
+        state = (struct rpc_state *) g_async_queue_pop (g_free_job_states);
+    else
+        state = (struct rpc_state *) g_async_queue_pop (g_free_states);
+    __atomic_fetch_add (&state->calls, 1, __ATOMIC_RELAXED);
+    __atomic_fetch_add (&state->wait_us, g_get_monotonic_time () - start, __ATOMIC_RELAXED);
+    return state;
 }
 
-static gint
-rpc_cmp (struct rpc_handler *rpc, const char *path)
+static void
+rpc_state_put (struct rpc_state *state)
 {
-    /* Match with wildcards but only with the same number of path nodes */
-    if (char_count (rpc->path, '/') != char_count (path, '/'))
-        return -1;
-    return fnmatch (rpc->path, path, 0);
+    g_async_queue_push (state->index < g_ninline ? g_free_states : g_free_job_states, state);
 }
 
-static GList *
+/* Handler paths compiled into a tree of path segments. Segments with wildcards are
+   matched with fnmatch, but only after an exact match for the same segment failed */
+struct rpc_node {
+    char *pattern;
+    GHashTable *exact;
+    GList *wild;
+    struct rpc_handler *rpc;
+};
+
+#define REST_RPC_CACHE_MAX 1024
+static struct rpc_node *g_rpc_tree = NULL;
+static GHashTable *g_rpc_cache = NULL;
+static GMutex g_rpc_cache_lock;
+
+static struct rpc_node *
+rpc_node_new (const char *pattern)
+{
+    struct rpc_node *node = g_malloc0 (sizeof (struct rpc_node));
+    node->pattern = g_strdup (pattern);
+    return node;
+}
+
+static void
+rpc_node_free (struct rpc_node *node)
+{
+    if (node->exact)
+        g_hash_table_destroy (node->exact);
+    g_list_free_full (node->wild, (GDestroyNotify) rpc_node_free);
+    g_free (node->pattern);
+    g_free (node);
+}
+
+static void
+rpc_node_add (struct rpc_node *node, struct rpc_handler *rpc)
+{
+    gchar **segments = g_strsplit (rpc->path, "/", -1);
+
+    for (int i = 0; segments[i]; i++)
+    {
+        struct rpc_node *child = NULL;
+
+        if (strpbrk (segments[i], "*?[\\") == NULL)
+        {
+            if (!node->exact)
+                node->exact = g_hash_table_new_full (g_str_hash, g_str_equal, NULL,
+                                                     (GDestroyNotify) rpc_node_free);
+            child = g_hash_table_lookup (node->exact, segments[i]);
+            if (!child)
+            {
+                child = rpc_node_new (segments[i]);
+                g_hash_table_insert (node->exact, child->pattern, child);
+            }
+        }
+        else
+        {
+            for (GList *iter = node->wild; iter && !child; iter = g_list_next (iter))
+            {
+                if (g_strcmp0 (((struct rpc_node *) iter->data)->pattern, segments[i]) == 0)
+                    child = (struct rpc_node *) iter->data;
+            }
+            if (!child)
+            {
+                child = rpc_node_new (segments[i]);
+                node->wild = g_list_append (node->wild, child);
+            }
+        }
+        node = child;
+    }
+    /* The first handler loaded for a path wins */
+    if (!node->rpc)
+        node->rpc = rpc;
+    g_strfreev (segments);
+}
+
+static struct rpc_handler *
+rpc_node_find (struct rpc_node *node, gchar **segments)
+{
+    struct rpc_handler *rpc = NULL;
+    struct rpc_node *child;
+
+    if (!*segments)
+        return node->rpc;
+    child = node->exact ? g_hash_table_lookup (node->exact, *segments) : NULL;
+    if (child)
+        rpc = rpc_node_find (child, segments + 1);
+    for (GList *iter = node->wild; iter && !rpc; iter = g_list_next (iter))
+    {
+        child = (struct rpc_node *) iter->data;
+        if (fnmatch (child->pattern, *segments, 0) == 0)
+            rpc = rpc_node_find (child, segments + 1);
+    }
+    return rpc;
+}
+
+static struct rpc_handler *
 rpc_find (int flags, const char *path)
 {
-    return g_list_find_custom (g_rpcs, (gpointer) path, (GCompareFunc) rpc_cmp);
+    struct rpc_handler *rpc;
+    gchar **segments;
+
+    if (!g_rpc_tree)
+        return NULL;
+
+    g_mutex_lock (&g_rpc_cache_lock);
+    rpc = g_rpc_cache ? g_hash_table_lookup (g_rpc_cache, path) : NULL;
+    g_mutex_unlock (&g_rpc_cache_lock);
+    if (rpc)
+        return rpc;
+
+    segments = g_strsplit (path, "/", -1);
+    rpc = rpc_node_find (g_rpc_tree, segments);
+    g_strfreev (segments);
+    if (rpc)
+    {
+        g_mutex_lock (&g_rpc_cache_lock);
+        if (!g_rpc_cache || g_hash_table_size (g_rpc_cache) >= REST_RPC_CACHE_MAX)
+        {
+            if (g_rpc_cache)
+                g_hash_table_destroy (g_rpc_cache);
+            g_rpc_cache = g_hash_table_new_full (g_str_hash, g_str_equal, g_free, NULL);
+        }
+        g_hash_table_replace (g_rpc_cache, g_strdup (path), rpc);
+        g_mutex_unlock (&g_rpc_cache_lock);
+    }
+    return rpc;
+}
+
+/* Rendered results of GET RPCs whose handlers give cache hints, most recently used first */
+#define REST_RPC_RESULTS_MAX 256
+
+struct rpc_result {
+    char *key;
+    char *resp;
+    gint64 expires;
+    struct rpc_handler *rpc;
+    GList link;
+};
+static GHashTable *g_rpc_results = NULL;
+static GQueue g_rpc_results_lru = G_QUEUE_INIT;
+static GMutex g_rpc_results_lock;
+
+static void
+rpc_result_free (struct rpc_result *result)
+{
+    g_free (result->key);
+    g_free (result->resp);
+    g_free (result);
+}
+
+/* Remove a result (call with the results lock held) */
+static void
+rpc_result_remove (struct rpc_result *result)
+{
+    g_queue_unlink (&g_rpc_results_lru, &result->link);
+    g_hash_table_remove (g_rpc_results, result->key);
+}
+
+static void
+rpc_cache_key_append (GString *key, GNode *node)
+{
+    g_string_append_printf (key, "/%s", APTERYX_NAME (node));
+    if (APTERYX_HAS_VALUE (node))
+    {
+        g_string_append_printf (key, "=%s", APTERYX_VALUE (node));
+        return;
+    }
+    for (GNode *child = node->children; child; child = child->next)
+        rpc_cache_key_append (key, child);
+    g_string_append_c (key, ';');
+}
+
+/* The format flags, path and the input fields named by the handler (or all of the input) */
+static char *
+rpc_cache_key (struct rpc_handler *rpc, int flags, const char *path, GNode *input)
+{
+    GString *key = g_string_new (NULL);
+    GNode *fields = input ? g_node_first_child (input) : NULL;
+
+    g_string_append_printf (key, "%x:%s:", flags, path);
+    if (fields && rpc->cache_keys)
+    {
+        for (int i = 0; rpc->cache_keys[i]; i++)
+        {
+            GNode *field = fields->children;
+            while (field && g_strcmp0 (APTERYX_NAME (field), rpc->cache_keys[i]) != 0)
+                field = field->next;
+            if (field)
+                rpc_cache_key_append (key, field);
+            else
+                g_string_append_printf (key, "/%s;", rpc->cache_keys[i]);
+        }
+    }
+    else if (fields)
+        rpc_cache_key_append (key, fields);
+    return g_string_free (key, false);
+}
+
+/* A copy of the cached response for a GET RPC, or NULL if there is none */
+char *
+rest_rpc_cache_get (int flags, const char *path, GNode *input)
+{
+    struct rpc_handler *rpc = rpc_find (flags, path);
+    struct rpc_result *result;
+    char *resp = NULL;
+    char *key;
+
+    if (!rpc || !rpc->cache_ttl || !(flags & FLAGS_METHOD_GET))
+        return NULL;
+
+    key = rpc_cache_key (rpc, flags, path, input);
+    g_mutex_lock (&g_rpc_results_lock);
+    result = g_rpc_results ? g_hash_table_lookup (g_rpc_results, key) : NULL;
+    if (result && result->expires < g_get_monotonic_time ())
+    {
+        rpc_result_remove (result);
+        result = NULL;
+    }
+    if (result)
+    {
+        g_queue_unlink (&g_rpc_results_lru, &result->link);
+        g_queue_push_head_link (&g_rpc_results_lru, &result->link);
+        resp = g_strdup (result->resp);
+    }
+    g_mutex_unlock (&g_rpc_results_lock);
+    g_free (key);
+
+    if (resp)
+        __atomic_fetch_add (&rpc->cache_hits, 1, __ATOMIC_RELAXED);
+    else
+        __atomic_fetch_add (&rpc->cache_misses, 1, __ATOMIC_RELAXED);
+    logging_access_cache (resp != NULL);
+    return resp;
+}
+
+/* Keep the response to a GET RPC if its handler asked for it */
+void
+rest_rpc_cache_put (int flags, const char *path, GNode *input, const char *resp)
+{
+    struct rpc_handler *rpc = rpc_find (flags, path);
+    struct rpc_result *result;
+
+    if (!rpc || !rpc->cache_ttl || !(flags & FLAGS_METHOD_GET))
+        return;
+
+    result = g_malloc0 (sizeof (struct rpc_result));
+    result->key = rpc_cache_key (rpc, flags, path, input);
+    result->resp = g_strdup (resp);
+    result->expires = g_get_monotonic_time () + rpc->cache_ttl;
+    result->rpc = rpc;
+    result->link.data = result;
+    g_mutex_lock (&g_rpc_results_lock);
+    if (!g_rpc_results)
+        g_rpc_results = g_hash_table_new_full (g_str_hash, g_str_equal, NULL, (GDestroyNotify) rpc_result_free);
+    if (g_hash_table_lookup (g_rpc_results, result->key))
+        rpc_result_remove (g_hash_table_lookup (g_rpc_results, result->key));
+    g_hash_table_insert (g_rpc_results, result->key, result);
+    g_queue_push_head_link (&g_rpc_results_lru, &result->link);
+    while (g_queue_get_length (&g_rpc_results_lru) > REST_RPC_RESULTS_MAX)
+        rpc_result_remove ((struct rpc_result *) g_queue_peek_tail (&g_rpc_results_lru));
+    g_mutex_unlock (&g_rpc_results_lock);
+}
+
+/* Drop the cached results of the handler for a path (or of every handler) */
+void
+rest_rpc_cache_invalidate (const char *path)
+{
+    struct rpc_handler *rpc = path ? rpc_find (0, path) : NULL;
+    GList *iter;
+
+    if (path && (!rpc || !rpc->cache_ttl))
+        return;
+    g_mutex_lock (&g_rpc_results_lock);
+    iter = g_rpc_results_lru.head;
+    while (iter)
+    {
+        struct rpc_result *result = (struct rpc_result *) iter->data;
+        iter = iter->next;
+        if (!rpc || result->rpc == rpc)
+            rpc_result_remove (result);
+    }
+    g_mutex_unlock (&g_rpc_results_lock);
+}
+
+/* rpc_cache_invalidate([path]) for handlers to call when what they report changes */
+static int
+rpc_lua_cache_invalidate (lua_State *L)
+{
+    rest_rpc_cache_invalidate (lua_isstring (L, 1) ? lua_tostring (L, 1) : NULL);
+    return 0;
+}
+
+/* Lua instructions run between checks of the budget of a handler */
+#define REST_RPC_BUDGET_STEP 1000
+
+struct rpc_budget {
+    gint64 deadline;
+    gint64 instructions;
+    bool overrun;
+    bool cancelled;
+};
+static __thread struct rpc_budget *g_budget = NULL;
+static bool g_rpc_cancelled = false;
+
+/* Abort the running handler once it is over budget. The error is raised
+   again at each check so the handler cannot simply catch it and carry on */
+static void
+rpc_budget_hook (lua_State *L, lua_Debug *ar)
+{
+    struct rpc_budget *budget = g_budget;
+
+    if (!budget)
+        return;
+    if (__atomic_load_n (&g_rpc_cancelled, __ATOMIC_RELAXED))
+    {
+        budget->cancelled = true;
+        luaL_error (L, "RPC cancelled");
+    }
+    if (budget->instructions > 0)
+    {
+        budget->instructions -= REST_RPC_BUDGET_STEP;
+        if (budget->instructions <= 0)
+            budget->overrun = true;
+    }
+    if (budget->deadline && g_get_monotonic_time () > budget->deadline)
+        budget->overrun = true;
+    if (budget->overrun)
+        luaL_error (L, "RPC exceeded its execution budget");
+}
+
+/* Abort running handlers at their next check. Async handlers are always
+   checked so that shutdown does not have to wait for them to finish */
+void
+rest_rpc_cancel (void)
+{
+    __atomic_store_n (&g_rpc_cancelled, true, __ATOMIC_RELAXED);
 }
 
 static void
@@ -151,6 +521,96 @@ push_callback (lua_State* L, size_t ref)
     return true;
 }
 
+static int
+rpc_dump_writer (lua_State *L, const void *p, size_t size, void *data)
+{
+    g_string_append_len ((GString *) data, (const char *) p, size);
+    return 0;
+}
+
+/* Load a Lua file, using its compiled chunk from the cache directory when the
+   file has not changed. Cached chunks start with the path, mtime and size of
+   the file they were compiled from. */
+static int
+rpc_load_file (lua_State *L, const char *filename)
+{
+    gchar *contents = NULL;
+    gsize length = 0;
+    char *chunkname;
+    char *header;
+    char *cached;
+    struct stat st;
+    int error;
+
+    if (!rest_rpc_cache || stat (filename, &st) != 0)
+        return luaL_loadfile (L, filename);
+
+    chunkname = g_strdup_printf ("@%s", filename);
+    cached = g_strdup_printf ("%s/%08x.luac", rest_rpc_cache, g_str_hash (filename));
+    header = g_strdup_printf ("%s %" PRId64 ".%09ld %" PRId64 "\n", filename,
+                              (gint64) st.st_mtim.tv_sec, st.st_mtim.tv_nsec, (gint64) st.st_size);
+    if (g_file_get_contents (cached, &contents, &length, NULL) && g_str_has_prefix (contents, header))
+    {
+        size_t hlen = strlen (header);
+        error = luaL_loadbufferx (L, contents + hlen, length - hlen, chunkname, "b");
+        if (error == 0)
+            goto exit;
+        lua_pop (L, 1);
+    }
+
+    error = luaL_loadfile (L, filename);
+    if (error == 0)
+    {
+        GString *chunk = g_string_new (header);
+#if LUA_VERSION_NUM >= 503
+        int dumped = lua_dump (L, rpc_dump_writer, chunk, 0);
+#else
+        int dumped = lua_dump (L, rpc_dump_writer, chunk);
+#endif
+        if (dumped != 0 || !g_file_set_contents (cached, chunk->str, chunk->len, NULL))
+            DEBUG ("RPC: Failed to cache \"%s\" in \"%s\"\n", filename, cached);
+        g_string_free (chunk, true);
+    }
+
+exit:
+    g_free (contents);
+    g_free (header);
+    g_free (cached);
+    g_free (chunkname);
+    return error;
+}
+
+/* Load a handler given as a file name into a Lua state on its first call */
+static bool
+rpc_handler_load (lua_State *L, struct rpc_handler *rpc, int index)
+{
+    int top = lua_gettop (L);
+    int error;
+
+    if (!rpc->file)
+        return false;
+
+    DEBUG ("RPC: Load handler for %s from \"%s\"\n", rpc->path, rpc->file);
+    error = rpc_load_file (L, rpc->file);
+    if (error == 0)
+        error = lua_pcall (L, 0, 1, 0);
+    if (error != 0)
+    {
+        rpc_lua_error (L, error);
+        lua_settop (L, top);
+        return false;
+    }
+    if (!lua_isfunction (L, -1))
+    {
+        ERROR ("RPC[%s]: \"%s\" did not return a function\n", rpc->path, rpc->file);
+        lua_settop (L, top);
+        return false;
+    }
+    rpc->refs[index] = ref_callback (L, lua_gettop (L));
+    lua_settop (L, top);
+    return true;
+}
+
 static const char *
 lua_apteryx_tostring (lua_State *L, int i)
 {
@@ -267,42 +727,378 @@ lua_apteryx_dict2tree (lua_State *L, const char *path, int index)
     return root;
 }
 
+/* Lazy views of the input tree and a builder for the output tree.
+   Handlers registered with views = true get the input as a read-only
+   view of the GNode tree and a builder for the output as a fourth
+   argument, so neither tree is copied through Lua tables. Views are
+   only valid during the call that they were passed to. */
+#define REST_RPC_VIEW "rest_rpc_view"
+#define REST_RPC_BUILDER "rest_rpc_builder"
+
+struct rpc_view {
+    GNode *node;
+    guint64 call;
+};
+static guint64 g_view_calls = 0;
+static __thread guint64 g_view_call = 0;
+
+static void
+rpc_view_push (lua_State *L, GNode *node, const char *type)
+{
+    struct rpc_view *view = (struct rpc_view *) lua_newuserdata (L, sizeof (struct rpc_view));
+    view->node = node;
+    view->call = g_view_call;
+    luaL_getmetatable (L, type);
+    lua_setmetatable (L, -2);
+}
+
+static GNode *
+rpc_view_check (lua_State *L, int index, const char *type)
+{
+    struct rpc_view *view = (struct rpc_view *) luaL_checkudata (L, index, type);
+    if (!view->call || view->call != g_view_call)
+        luaL_error (L, "RPC view used outside of its call");
+    return view->node;
+}
+
+/* A leaf as its value and anything else as another view */
+static void
+rpc_view_push_child (lua_State *L, GNode *child)
+{
+    if (APTERYX_HAS_VALUE (child))
+        lua_pushstring (L, APTERYX_VALUE (child));
+    else
+        rpc_view_push (L, child, REST_RPC_VIEW);
+}
+
+static int
+rpc_view_index (lua_State *L)
+{
+    GNode *node = rpc_view_check (L, 1, REST_RPC_VIEW);
+    const char *name = luaL_checkstring (L, 2);
+
+    for (GNode *child = node->children; child; child = child->next)
+    {
+        if (g_strcmp0 (APTERYX_NAME (child), name) == 0)
+        {
+            rpc_view_push_child (L, child);
+            return 1;
+        }
+    }
+    lua_pushnil (L);
+    return 1;
+}
+
+static int
+rpc_view_newindex (lua_State *L)
+{
+    return luaL_error (L, "RPC input is read-only");
+}
+
+static int
+rpc_view_len (lua_State *L)
+{
+    lua_pushinteger (L, g_node_n_children (rpc_view_check (L, 1, REST_RPC_VIEW)));
+    return 1;
+}
+
+static int
+rpc_view_next (lua_State *L)
+{
+    GNode *child;
+
+    rpc_view_check (L, lua_upvalueindex (1), REST_RPC_VIEW);
+    child = (GNode *) lua_touserdata (L, lua_upvalueindex (2));
+    if (!child)
+        return 0;
+    lua_pushlightuserdata (L, child->next);
+    lua_replace (L, lua_upvalueindex (2));
+    lua_pushstring (L, APTERYX_NAME (child));
+    rpc_view_push_child (L, child);
+    return 2;
+}
+
+static int
+rpc_view_pairs (lua_State *L)
+{
+    GNode *node = rpc_view_check (L, 1, REST_RPC_VIEW);
+
+    lua_pushvalue (L, 1);
+    lua_pushlightuserdata (L, node->children);
+    lua_pushcclosure (L, rpc_view_next, 2);
+    lua_pushvalue (L, 1);
+    lua_pushnil (L);
+    return 3;
+}
+
+/* out:set (name, value) adds a leaf */
+static int
+rpc_builder_set (lua_State *L)
+{
+    GNode *node = rpc_view_check (L, 1, REST_RPC_BUILDER);
+    const char *name = luaL_checkstring (L, 2);
+    const char *value = lua_apteryx_tostring (L, 3);
+
+    if (value)
+        APTERYX_LEAF (node, strdup (name), strdup (value));
+    return 0;
+}
+
+/* out:node (name) adds a child and returns a builder for it */
+static int
+rpc_builder_node (lua_State *L)
+{
+    GNode *node = rpc_view_check (L, 1, REST_RPC_BUILDER);
+    const char *name = luaL_checkstring (L, 2);
+
+    rpc_view_push (L, APTERYX_NODE (node, strdup (name)), REST_RPC_BUILDER);
+    return 1;
+}
+
+/* out[name] = value adds a leaf, or a subtree copied from a table (unless it is empty) */
+static int
+rpc_builder_newindex (lua_State *L)
+{
+    GNode *node = rpc_view_check (L, 1, REST_RPC_BUILDER);
+    const char *name = luaL_checkstring (L, 2);
+
+    if (lua_istable (L, 3))
+    {
+        GNode *child = APTERYX_NODE (node, strdup (name));
+        lua_pushvalue (L, 3);
+        if (!_lua_apteryx_dict2tree (L, child, true))
+        {
+            g_node_unlink (child);
+            apteryx_free_tree (child);
+        }
+        lua_pop (L, 1);
+        return 0;
+    }
+    lua_settop (L, 3);
+    return rpc_builder_set (L);
+}
+
+static void
+rpc_views_register (lua_State *L)
+{
+    luaL_newmetatable (L, REST_RPC_VIEW);
+    lua_pushcfunction (L, rpc_view_index);
+    lua_setfield (L, -2, "__index");
+    lua_pushcfunction (L, rpc_view_newindex);
+    lua_setfield (L, -2, "__newindex");
+    lua_pushcfunction (L, rpc_view_len);
+    lua_setfield (L, -2, "__len");
+    lua_pushcfunction (L, rpc_view_pairs);
+    lua_setfield (L, -2, "__pairs");
+    lua_pop (L, 1);
+
+    luaL_newmetatable (L, REST_RPC_BUILDER);
+    lua_newtable (L);
+    lua_pushcfunction (L, rpc_builder_set);
+    lua_setfield (L, -2, "set");
+    lua_pushcfunction (L, rpc_builder_node);
+    lua_setfield (L, -2, "node");
+    lua_setfield (L, -2, "__index");
+    lua_pushcfunction (L, rpc_builder_newindex);
+    lua_setfield (L, -2, "__newindex");
+    lua_pop (L, 1);
+}
+
+static inline bool
+rpc_is_output (lua_State *L, int index)
+{
+    return lua_istable (L, index) || luaL_testudata (L, index, REST_RPC_BUILDER);
+}
+
+/* The output tree from a returned table, or the tree the builder made */
+static GNode *
+rpc_output (lua_State *L, int index, GNode **built)
+{
+    GNode *root;
+
+    if (!lua_istable (L, index))
+    {
+        root = *built;
+        *built = NULL;
+        if (root && !root->children)
+        {
+            apteryx_free_tree (root);
+            root = NULL;
+        }
+        return root;
+    }
+    return lua_apteryx_dict2tree (L, "output", index);
+}
+
+static int
+rpc_resume (lua_State *co, lua_State *L, int nargs, int *nresults)
+{
+#if LUA_VERSION_NUM >= 504
+    return lua_resume (co, L, nargs, nresults);
+#else
+    int res = lua_resume (co, L, nargs);
+    *nresults = lua_gettop (co);
+    return res;
+#endif
+}
+
+/* Add the children of a tree to the output gathered so far (consumes tree) */
+static void
+rpc_output_merge (GNode **merged, GNode *tree)
+{
+    GNode *child;
+
+    if (!*merged)
+    {
+        *merged = tree;
+        return;
+    }
+    while ((child = g_node_first_child (tree)))
+    {
+        g_node_unlink (child);
+        g_node_append (*merged, child);
+    }
+    apteryx_free_tree (tree);
+}
+
+/* Merge the children of each node that have the same name, as chunks that
+   each add to the same list or container leave them after being merged */
+static void
+rpc_output_combine (GNode *node)
+{
+    GHashTable *seen = g_hash_table_new (g_str_hash, g_str_equal);
+    GNode *child = g_node_first_child (node);
+
+    while (child)
+    {
+        GNode *next = g_node_next_sibling (child);
+        GNode *first;
+
+        if (!APTERYX_HAS_VALUE (child))
+        {
+            first = g_hash_table_lookup (seen, APTERYX_NAME (child));
+            if (first)
+            {
+                GNode *grandchild;
+                while ((grandchild = g_node_first_child (child)))
+                {
+                    g_node_unlink (grandchild);
+                    g_node_append (first, grandchild);
+                }
+                g_node_unlink (child);
+                apteryx_free_tree (child);
+            }
+            else
+                g_hash_table_insert (seen, APTERYX_NAME (child), child);
+        }
+        child = next;
+    }
+    g_hash_table_destroy (seen);
+    for (child = g_node_first_child (node); child; child = g_node_next_sibling (child))
+    {
+        if (!APTERYX_HAS_VALUE (child))
+            rpc_output_combine (child);
+    }
+}
+
+/* Run a streaming handler (and its arguments on the stack) as a coroutine.
+   Each table it yields is passed to chunk as an output tree, or merged into
+   *merged when there is no one to stream to. Leaves the return values or an
+   error on the stack as lua_pcall would */
+static int
+rpc_stream_call (lua_State *L, int nargs, rest_rpc_chunk_fn chunk, void *data, GNode **merged)
+{
+    lua_State *co = lua_newthread (L);
+    int nres = 0;
+    int thread;
+    int res;
+
+    lua_insert (L, -(nargs + 2));
+    lua_xmove (L, co, nargs + 1);
+    thread = lua_gettop (L);
+    res = rpc_resume (co, L, nargs, &nres);
+    while (res == LUA_YIELD)
+    {
+        GNode *tree = NULL;
+
+        if (nres >= 1 && lua_istable (co, -nres))
+            tree = lua_apteryx_dict2tree (co, "output", lua_gettop (co) - nres + 1);
+        lua_pop (co, nres);
+        if (tree && !chunk)
+            rpc_output_merge (merged, tree);
+        else if (tree)
+        {
+            bool sent = chunk (tree, data);
+            apteryx_free_tree (tree);
+            if (!sent)
+            {
+                /* The client has gone or the chunk could not be sent - abandon the handler */
+                lua_settop (L, thread - 1);
+                lua_pushboolean (L, false);
+                lua_pushstring (L, "RPC output could not be sent");
+                return LUA_OK;
+            }
+        }
+        res = rpc_resume (co, L, 0, &nres);
+    }
+    lua_xmove (co, L, res == LUA_OK ? nres : 1);
+    lua_remove (L, thread);
+    return res;
+}
+
 rest_rpc_error
-rest_rpc_execute (int flags, const char *path, GNode *input, GNode **output, char **error_message)
+rest_rpc_execute_stream (int flags, const char *path, GNode *input, rest_rpc_chunk_fn chunk, void *data,
+                         GNode **output, char **error_message)
 {
     rest_rpc_error rc = REST_RPC_E_NONE;
     GNode *root = NULL;
-    lua_State *L = g_ls;
+    GNode *built = NULL;
+    GNode *merged = NULL;
 
     VERBOSE ("RPC: %s\n", path);
 
-    pthread_mutex_lock (&g_ls_lock);
-
-    GList *entry = rpc_find (flags, path);
-    if (entry)
+    struct rpc_handler *rpc = rpc_find (flags, path);
+    if (rpc)
     {
-        struct rpc_handler *rpc = (struct rpc_handler *) entry->data;
-        int ssize = lua_gettop (L);
+        struct rpc_state *state;
+        lua_State *L;
+        int ssize;
         int rcount;
 
         /* Check this RPC supports the requested operation */
         if (!((flags & FLAGS_METHOD_MASK) & (rpc->flags & FLAGS_METHOD_MASK)))
         {
-            pthread_mutex_unlock (&g_ls_lock);
             ERROR ("RPC[%s]: does not support method (flags:0x%08x)\n", rpc->path, flags);
             return REST_RPC_E_NOT_FOUND;
         }
 
-        /* Load rpc function onto the lua stack */
-        if (!push_callback (L, rpc->ref))
+        /* Load rpc function onto the stack of a free lua state */
+        state = rpc_state_get (rpc->async);
+        L = state->ls;
+        ssize = lua_gettop (L);
+        if (!rpc->refs[state->index] && !rpc_handler_load (L, rpc, state->index))
+        {
+            rpc_state_put (state);
+            ERROR ("RPC[%s]: handler could not be loaded\n", rpc->path);
+            return REST_RPC_E_INTERNAL;
+        }
+        if (!push_callback (L, rpc->refs[state->index]))
         {
-            pthread_mutex_unlock (&g_ls_lock);
-            ERROR ("RPC[%s]: at ref 0x%08x not found\n", rpc->path, rpc->ref);
+            rpc_state_put (state);
+            ERROR ("RPC[%s]: at ref 0x%08x not found\n", rpc->path, rpc->refs[state->index]);
             return REST_RPC_E_INTERNAL;
         }
 
         /* Input - without the top level input node */
-        if (input)
+        if (rpc->views)
+        {
+            g_view_call = __atomic_add_fetch (&g_view_calls, 1, __ATOMIC_RELAXED);
+            if (input && g_node_first_child (input))
+                rpc_view_push (L, g_node_first_child (input), REST_RPC_VIEW);
+            else
+                lua_newtable (L);
+        }
+        else if (input)
             lua_apteryx_tree2dict (L, g_node_first_child (input));
         else
             lua_newtable (L);
@@ -322,9 +1118,59 @@ rest_rpc_execute (int flags, const char *path, GNode *input, GNode **output, cha
             lua_pushstring (L, "HEAD");
         else if (flags & FLAGS_METHOD_OPTIONS)
             lua_pushstring (L, "OPTIONS");
+        /* Output builder */
+        if (rpc->views)
+        {
+            built = APTERYX_NODE (NULL, strdup ("output"));
+            rpc_view_push (L, built, REST_RPC_BUILDER);
+        }
 
-        /* Call RPC */
-        int res = lua_pcall (L, 3, LUA_MULTRET, 0);
+        /* Call RPC within its budget. Async handlers are expected to run for a
+           long time so only their own budget applies */
+        gint64 start = g_get_monotonic_time ();
+        gint64 budget_us = rpc->budget_us ?: (rpc->async ? 0 : (gint64) rest_rpc_time_budget * 1000);
+        gint64 instructions = rpc->budget_instructions ?: (rpc->async ? 0 : rest_rpc_instruction_budget);
+        struct rpc_budget budget = { 0 };
+        if (budget_us || instructions || rpc->async)
+        {
+            budget.deadline = budget_us ? start + budget_us : 0;
+            budget.instructions = instructions;
+            g_budget = &budget;
+            lua_sethook (L, rpc_budget_hook, LUA_MASKCOUNT, REST_RPC_BUDGET_STEP);
+        }
+        int nargs = rpc->views ? 4 : 3;
+        int res = rpc->stream ? rpc_stream_call (L, nargs, chunk, data, &merged) :
+                                lua_pcall (L, nargs, LUA_MULTRET, 0);
+        if (g_budget)
+        {
+            lua_sethook (L, NULL, 0, 0);
+            g_budget = NULL;
+        }
+        gint64 duration = g_get_monotonic_time () - start;
+        __atomic_fetch_add (&rpc->calls, 1, __ATOMIC_RELAXED);
+        __atomic_fetch_add (&rpc->duration_us, duration, __ATOMIC_RELAXED);
+        __atomic_fetch_add (&rpc->buckets[metrics_bucket (duration)], 1, __ATOMIC_RELAXED);
+        if (budget.overrun || budget.cancelled)
+        {
+            if (budget.cancelled)
+            {
+                ERROR ("RPC[%s]: cancelled after %" PRId64 "us\n", path, duration);
+            }
+            else
+            {
+                ERROR ("RPC[%s]: aborted after %" PRId64 "us over its execution budget\n", path, duration);
+                __atomic_fetch_add (&rpc->overruns, 1, __ATOMIC_RELAXED);
+            }
+            lua_settop (L, ssize);
+            rpc_state_put (state);
+            g_view_call = 0;
+            if (built)
+                apteryx_free_tree (built);
+            if (merged)
+                apteryx_free_tree (merged);
+            *error_message = g_strdup (budget.cancelled ? "RPC cancelled" : "RPC exceeded its execution budget");
+            return REST_RPC_E_FAIL;
+        }
         if (res != 0)
             rpc_lua_error (L, res);
 
@@ -340,16 +1186,18 @@ rest_rpc_execute (int flags, const char *path, GNode *input, GNode **output, cha
         {
             if (!lua_toboolean (L, 2))
                 rc = REST_RPC_E_FAIL;
+            else
+                root = rpc_output (L, 2, &built);
             lua_pop (L, 2);
         }
-        else if (rcount == 1 && lua_istable (L, 2))
+        else if (rcount == 1 && rpc_is_output (L, 2))
         {
-            root = lua_apteryx_dict2tree (L, "output", 2);
+            root = rpc_output (L, 2, &built);
             lua_pop (L, 2);
         }
-        else if (rcount == 2 && lua_isboolean (L, 2) && lua_toboolean (L, 2) && lua_istable (L, 3))
+        else if (rcount == 2 && lua_isboolean (L, 2) && lua_toboolean (L, 2) && rpc_is_output (L, 3))
         {
-            root = lua_apteryx_dict2tree (L, "output", 3);
+            root = rpc_output (L, 3, &built);
             lua_pop (L, 3);
         }
         else if (rcount == 2 && lua_isboolean (L, 2) && !lua_toboolean (L, 2) && lua_isstring (L, 3))
@@ -358,9 +1206,9 @@ rest_rpc_execute (int flags, const char *path, GNode *input, GNode **output, cha
             rc = REST_RPC_E_FAIL;
             lua_pop (L, 3);
         }
-        else if (rcount == 2 && lua_isboolean (L, 2) && !lua_toboolean (L, 2) && lua_istable (L, 3))
+        else if (rcount == 2 && lua_isboolean (L, 2) && !lua_toboolean (L, 2) && rpc_is_output (L, 3))
         {
-            root = lua_apteryx_dict2tree (L, "output", 3);
+            root = rpc_output (L, 3, &built);
             rc = REST_RPC_E_FAIL;
             lua_pop (L, 3);
         }
@@ -371,7 +1219,12 @@ rest_rpc_execute (int flags, const char *path, GNode *input, GNode **output, cha
                 ERROR(" [%d] = %s\n", i, lua_typename (L, lua_type (L, i + 1)));
             while (lua_gettop (L))
                 lua_pop (L, 1);
-            pthread_mutex_unlock (&g_ls_lock);
+            rpc_state_put (state);
+            g_view_call = 0;
+            if (built)
+                apteryx_free_tree (built);
+            if (merged)
+                apteryx_free_tree (merged);
             return REST_RPC_E_INTERNAL;
         }
 
@@ -382,6 +1235,19 @@ rest_rpc_execute (int flags, const char *path, GNode *input, GNode **output, cha
             while (lua_gettop (L))
                 lua_pop (L, 1);
         }
+        rpc_state_put (state);
+        g_view_call = 0;
+        if (built)
+            apteryx_free_tree (built);
+
+        /* Chunks that were not streamed come before the returned output */
+        if (merged)
+        {
+            if (root)
+                rpc_output_merge (&merged, root);
+            rpc_output_combine (merged);
+            root = merged;
+        }
     }
     else
     {
@@ -390,17 +1256,35 @@ rest_rpc_execute (int flags, const char *path, GNode *input, GNode **output, cha
         rc = REST_RPC_E_NOT_FOUND;
     }
 
-    pthread_mutex_unlock (&g_ls_lock);
-
     *output = root;
     return rc;
 }
 
-static void
-rpc_push (struct rpc_handler *rpc, int *count)
+rest_rpc_error
+rest_rpc_execute (int flags, const char *path, GNode *input, GNode **output, char **error_message)
+{
+    return rest_rpc_execute_stream (flags, path, input, NULL, NULL, output, error_message);
+}
+
+/* Handlers registered with stream=true yield their output in chunks */
+bool
+rest_rpc_stream (const char *path)
+{
+    struct rpc_handler *rpc = rpc_find (0, path);
+    return rpc && rpc->stream;
+}
+
+/* Handlers registered with async=true run as jobs */
+bool
+rest_rpc_async (const char *path)
 {
-    lua_State *L = g_ls;
+    struct rpc_handler *rpc = rpc_find (0, path);
+    return rpc && rpc->async;
+}
 
+static void
+rpc_push (lua_State *L, struct rpc_handler *rpc, int index)
+{
     lua_newtable (L);
 
     /* Methods */
@@ -449,29 +1333,95 @@ rpc_push (struct rpc_handler *rpc, int *count)
     lua_pushstring (L, rpc->path);
     lua_settable (L, -3);
 
-    lua_rawseti (L, -2, *count);
-    (*count)++;
+    lua_rawseti (L, -2, index);
 }
 
-bool
-rest_rpc_init (const char *path)
+/* Report per handler call counts and latency (the handler list does not change once loaded) */
+void
+rest_rpc_metrics (GString *out)
+{
+    GList *iter;
+
+    g_string_append (out, "# HELP apteryx_rest_rpc_calls_total RPC handler calls.\n"
+                          "# TYPE apteryx_rest_rpc_calls_total counter\n");
+    for (iter = g_rpcs; iter; iter = g_list_next (iter))
+    {
+        struct rpc_handler *rpc = (struct rpc_handler *) iter->data;
+        g_string_append_printf (out, "apteryx_rest_rpc_calls_total{handler=\"%s\"} %" PRIu64 "\n",
+                                rpc->path, __atomic_load_n (&rpc->calls, __ATOMIC_RELAXED));
+    }
+    g_string_append (out, "# HELP apteryx_rest_rpc_duration_seconds Time taken by RPC handlers.\n"
+                          "# TYPE apteryx_rest_rpc_duration_seconds histogram\n");
+    for (iter = g_rpcs; iter; iter = g_list_next (iter))
+    {
+        struct rpc_handler *rpc = (struct rpc_handler *) iter->data;
+        guint64 buckets[METRICS_BUCKETS];
+        char *labels;
+        int i;
+
+        for (i = 0; i < METRICS_BUCKETS; i++)
+            buckets[i] = __atomic_load_n (&rpc->buckets[i], __ATOMIC_RELAXED);
+        labels = g_strdup_printf ("handler=\"%s\"", rpc->path);
+        metrics_histogram (out, "apteryx_rest_rpc_duration_seconds", labels, buckets,
+                           __atomic_load_n (&rpc->duration_us, __ATOMIC_RELAXED));
+        g_free (labels);
+    }
+    g_string_append (out, "# HELP apteryx_rest_rpc_budget_overruns_total RPC calls aborted for exceeding their execution budget.\n"
+                          "# TYPE apteryx_rest_rpc_budget_overruns_total counter\n");
+    for (iter = g_rpcs; iter; iter = g_list_next (iter))
+    {
+        struct rpc_handler *rpc = (struct rpc_handler *) iter->data;
+        g_string_append_printf (out, "apteryx_rest_rpc_budget_overruns_total{handler=\"%s\"} %" PRIu64 "\n",
+                                rpc->path, __atomic_load_n (&rpc->overruns, __ATOMIC_RELAXED));
+    }
+    g_string_append (out, "# HELP apteryx_rest_rpc_cache_hits_total GET RPCs answered from the result cache.\n"
+                          "# TYPE apteryx_rest_rpc_cache_hits_total counter\n");
+    for (iter = g_rpcs; iter; iter = g_list_next (iter))
+    {
+        struct rpc_handler *rpc = (struct rpc_handler *) iter->data;
+        if (rpc->cache_ttl)
+            g_string_append_printf (out, "apteryx_rest_rpc_cache_hits_total{handler=\"%s\"} %" PRIu64 "\n",
+                                    rpc->path, __atomic_load_n (&rpc->cache_hits, __ATOMIC_RELAXED));
+    }
+    g_string_append (out, "# HELP apteryx_rest_rpc_cache_misses_total GET RPCs that were not in the result cache.\n"
+                          "# TYPE apteryx_rest_rpc_cache_misses_total counter\n");
+    for (iter = g_rpcs; iter; iter = g_list_next (iter))
+    {
+        struct rpc_handler *rpc = (struct rpc_handler *) iter->data;
+        if (rpc->cache_ttl)
+            g_string_append_printf (out, "apteryx_rest_rpc_cache_misses_total{handler=\"%s\"} %" PRIu64 "\n",
+                                    rpc->path, __atomic_load_n (&rpc->cache_misses, __ATOMIC_RELAXED));
+    }
+    g_string_append (out, "# HELP apteryx_rest_rpc_state_calls_total RPC calls run in each Lua state.\n"
+                          "# TYPE apteryx_rest_rpc_state_calls_total counter\n");
+    for (int i = 0; i < g_nstates; i++)
+    {
+        g_string_append_printf (out, "apteryx_rest_rpc_state_calls_total{state=\"%d\"} %" PRIu64 "\n",
+                                i, __atomic_load_n (&g_states[i].calls, __ATOMIC_RELAXED));
+    }
+    g_string_append (out, "# HELP apteryx_rest_rpc_state_wait_seconds_total Time RPCs waited for a free Lua state.\n"
+                          "# TYPE apteryx_rest_rpc_state_wait_seconds_total counter\n");
+    for (int i = 0; i < g_nstates; i++)
+    {
+        g_string_append_printf (out, "apteryx_rest_rpc_state_wait_seconds_total{state=\"%d\"} %g\n",
+                                i, __atomic_load_n (&g_states[i].wait_us, __ATOMIC_RELAXED) / 1000000.0);
+    }
+}
+
+/* Load and run all the LUA files in a folder, returning the handlers they define */
+static GList *
+rpc_state_load (lua_State *L, const char *path)
 {
     struct dirent *entry;
+    GList *rpcs = NULL;
     DIR *dir;
 
-    /* New lua state with a table in the registry to stor callbacks */
-    g_ls = luaL_newstate ();
-    luaL_openlibs (g_ls);
-    lua_pushlightuserdata (g_ls, REST_RPC_CB_TABLE_REGISTRY_INDEX);
-    lua_newtable (g_ls);
-    lua_settable (g_ls, LUA_REGISTRYINDEX);
-
     /* Find all the LUA files in this folder */
     dir = opendir (path);
     if (dir == NULL)
     {
         DEBUG ("RPC: No script files in \"%s\"", path);
-        return true;
+        return NULL;
     }
 
     /* Load and execute all LUA files */
@@ -481,11 +1431,10 @@ rest_rpc_init (const char *path)
         if (ext && strcmp (".lua", ext) == 0)
         {
             char *filename = g_strdup_printf ("%s/%s", path, entry->d_name);
-            lua_State *L = g_ls;
             int error;
 
             DEBUG ("RPC: Load Lua file \"%s\"\n", filename);
-            error = luaL_loadfile (L, filename);
+            error = rpc_load_file (L, filename);
             free (filename);
             if (error != 0)
             {
@@ -512,6 +1461,7 @@ rest_rpc_init (const char *path)
             while (lua_next (L, 1) != 0)
             {
                 struct rpc_handler *rpc = g_malloc0 (sizeof (struct rpc_handler));
+                int ref = 0;
 
                 /* Parse the handler parameters */
                 if (lua_istable (L, 3))
@@ -550,23 +1500,70 @@ rest_rpc_init (const char *path)
                     }
                     if (lua_getfield (L, 3, "handler"))
                     {
-                        rpc->ref = ref_callback (L, 4);
+                        if (lua_type (L, 4) == LUA_TSTRING)
+                            rpc->file = g_build_filename (path, lua_tostring (L, 4), NULL);
+                        else
+                            ref = ref_callback (L, 4);
+                        lua_pop (L, 1);
+                    }
+                    lua_getfield (L, 3, "async");
+                    rpc->async = lua_toboolean (L, -1);
+                    lua_pop (L, 1);
+                    lua_getfield (L, 3, "views");
+                    rpc->views = lua_toboolean (L, -1);
+                    lua_pop (L, 1);
+                    lua_getfield (L, 3, "stream");
+                    rpc->stream = lua_toboolean (L, -1);
+                    lua_pop (L, 1);
+                    /* budget = { time=seconds, instructions=count } */
+                    lua_getfield (L, 3, "budget");
+                    if (lua_istable (L, -1))
+                    {
+                        lua_getfield (L, -1, "time");
+                        rpc->budget_us = lua_tonumber (L, -1) * G_USEC_PER_SEC;
+                        lua_pop (L, 1);
+                        lua_getfield (L, -1, "instructions");
+                        rpc->budget_instructions = lua_tonumber (L, -1);
+                        lua_pop (L, 1);
+                    }
+                    lua_pop (L, 1);
+                    /* cache = { ttl=seconds, key={string,} } */
+                    lua_getfield (L, 3, "cache");
+                    if (lua_istable (L, -1))
+                    {
+                        lua_getfield (L, -1, "ttl");
+                        rpc->cache_ttl = lua_tonumber (L, -1) * G_USEC_PER_SEC;
+                        lua_pop (L, 1);
+                        lua_getfield (L, -1, "key");
+                        if (lua_istable (L, -1))
+                        {
+                            GPtrArray *keys = g_ptr_array_new ();
+                            lua_pushnil (L);
+                            while (lua_next (L, -2) != 0)
+                            {
+                                if (lua_isstring (L, -1))
+                                    g_ptr_array_add (keys, g_strdup (lua_tostring (L, -1)));
+                                lua_pop (L, 1);
+                            }
+                            g_ptr_array_add (keys, NULL);
+                            rpc->cache_keys = (gchar **) g_ptr_array_free (keys, false);
+                        }
                         lua_pop (L, 1);
                     }
+                    lua_pop (L, 1);
                 }
 
                 /* Check we have enough info */
-                if (rpc->path && rpc->flags && rpc->ref)
+                if (rpc->path && rpc->flags && (ref || rpc->file))
                 {
-                    DEBUG ("    RPC[0x%04x]: %s\n", rpc->flags, rpc->path);
-                    g_rpcs = g_list_prepend (g_rpcs, (gpointer) rpc);
+                    rpc->refs = g_new0 (int, g_ninline + REST_JOBS_THREADS);
+                    rpc->refs[0] = ref;
+                    rpcs = g_list_prepend (rpcs, (gpointer) rpc);
                 }
                 else
                 {
                     ERROR ("Failed to parse an RPC handler from %s\n", entry->d_name);
-                    if (rpc->path)
-                        free (rpc->path);
-                    free (rpc);
+                    rpc_free (rpc);
                 }
 
                 lua_pop (L, 1);
@@ -575,13 +1572,90 @@ rest_rpc_init (const char *path)
         }
     }
     (void) closedir (dir);
-    g_rpcs = g_list_reverse (g_rpcs);
+    return g_list_reverse (rpcs);
+}
+
+static lua_State *
+rpc_state_new (void)
+{
+    /* New lua state with a table in the registry to store callbacks */
+    lua_State *L = luaL_newstate ();
+    luaL_openlibs (L);
+    lua_pushlightuserdata (L, REST_RPC_CB_TABLE_REGISTRY_INDEX);
+    lua_newtable (L);
+    lua_settable (L, LUA_REGISTRYINDEX);
+    lua_register (L, "rpc_cache_invalidate", rpc_lua_cache_invalidate);
+    rpc_views_register (L);
+    return L;
+}
+
+bool
+rest_rpc_init (const char *path)
+{
+    GList *iter;
+
+    if (rest_rpc_cache && g_mkdir_with_parents (rest_rpc_cache, 0755) != 0)
+    {
+        ERROR ("RPC: Failed to create cache directory \"%s\"\n", rest_rpc_cache);
+        rest_rpc_cache = NULL;
+    }
+    g_ninline = g_nstates = MAX (rest_rpc_states, 1);
+    g_states = g_new0 (struct rpc_state, g_ninline + REST_JOBS_THREADS);
+    g_free_states = g_async_queue_new ();
+    g_free_job_states = g_async_queue_new ();
+    for (int i = 0; i < g_nstates; i++)
+    {
+        struct rpc_state *state = &g_states[i];
+        GList *rpcs;
+
+        state->index = i;
+        state->ls = rpc_state_new ();
+        rpcs = rpc_state_load (state->ls, path);
+        if (i == 0)
+        {
+            g_rpcs = rpcs;
+            for (iter = g_rpcs; iter; iter = g_list_next (iter))
+            {
+                struct rpc_handler *rpc = (struct rpc_handler *) iter->data;
+                DEBUG ("    RPC[0x%04x]: %s\n", rpc->flags, rpc->path);
+                if (rpc->async)
+                    g_nstates = g_ninline + REST_JOBS_THREADS;
+            }
+        }
+        else
+        {
+            /* The same handlers in this state */
+            for (iter = rpcs; iter; iter = g_list_next (iter))
+            {
+                struct rpc_handler *copy = (struct rpc_handler *) iter->data;
+                for (GList *r = g_rpcs; r; r = g_list_next (r))
+                {
+                    struct rpc_handler *rpc = (struct rpc_handler *) r->data;
+                    if (!rpc->refs[i] && rpc->flags == copy->flags && g_strcmp0 (rpc->path, copy->path) == 0)
+                    {
+                        rpc->refs[i] = copy->refs[0];
+                        break;
+                    }
+                }
+            }
+            g_list_free_full (rpcs, (GDestroyNotify) rpc_free);
+        }
+
+        /* Push the rpc table to the lua instance */
+        int count = 1;
+        lua_newtable (state->ls);
+        for (iter = g_rpcs; iter; iter = g_list_next (iter))
+            rpc_push (state->ls, (struct rpc_handler *) iter->data, count++);
+        lua_setglobal (state->ls, "_RPCS");
+        rpc_state_put (state);
+    }
+    DEBUG ("RPC: %d handlers in %d Lua states (%d for async handlers)\n",
+           g_list_length (g_rpcs), g_nstates, g_nstates - g_ninline);
 
-    /* Push the rpc table to the lua instance */
-    int count = 1;
-    lua_newtable (g_ls);
-    g_list_foreach (g_rpcs, (GFunc) rpc_push, (gpointer) &count);
-    lua_setglobal (g_ls, "_RPCS");
+    /* Index the handlers by path */
+    g_rpc_tree = rpc_node_new (NULL);
+    for (iter = g_rpcs; iter; iter = g_list_next (iter))
+        rpc_node_add (g_rpc_tree, (struct rpc_handler *) iter->data);
 
     return true;
 }
@@ -589,10 +1663,29 @@ rest_rpc_init (const char *path)
 void
 rest_rpc_shutdown (void)
 {
+    if (g_rpc_results)
+        g_hash_table_destroy (g_rpc_results);
+    g_rpc_results = NULL;
+    g_queue_init (&g_rpc_results_lru);
+    if (g_rpc_cache)
+        g_hash_table_destroy (g_rpc_cache);
+    g_rpc_cache = NULL;
+    if (g_rpc_tree)
+        rpc_node_free (g_rpc_tree);
+    g_rpc_tree = NULL;
     g_list_foreach (g_rpcs, (GFunc) rpc_free, NULL);
-    if (g_ls)
-    {
-        lua_close (g_ls);
-        g_ls = NULL;
-    }
+    g_list_free (g_rpcs);
+    g_rpcs = NULL;
+    for (int i = 0; i < g_nstates; i++)
+        lua_close (g_states[i].ls);
+    g_free (g_states);
+    g_states = NULL;
+    g_nstates = 0;
+    g_ninline = 0;
+    if (g_free_states)
+        g_async_queue_unref (g_free_states);
+    g_free_states = NULL;
+    if (g_free_job_states)
+        g_async_queue_unref (g_free_job_states);
+    g_free_job_states = NULL;
 }
@@ -185,7 +185,11 @@ make -C $BUILD/../
 rc=$?; if [[ $rc != 0 ]]; then quit $rc; fi
 cp $BUILD/../models/*.xml $BUILD/etc/restconf/
 cp $BUILD/../models/*.map $BUILD/etc/restconf/
+# Logging is off until the tests write the logging options
+: > $BUILD/etc/restconf/logging.conf
 cp $BUILD/../models/*.lua $BUILD/usr/share/restconf/
+mkdir -p $BUILD/usr/share/restconf/handlers
+cp $BUILD/../models/handlers/*.lua $BUILD/usr/share/restconf/handlers/
 
 # Check tests
 echo Checking pytest coding style ...
@@ -317,12 +321,14 @@ fi
 
 # Start apteryx-rest
 rm -f $BUILD/apteryx-rest.sock
+rm -fr $BUILD/rpc-cache
+rm -f $BUILD/api-snapshot
 # TEST_WRAPPER="gdb -ex run --args"
 # TEST_WRAPPER="valgrind --leak-check=full"
 # TEST_WRAPPER="valgrind --tool=cachegrind"
 # TEST_WRAPPER="valgrind --tool=callgrind"
 G_SLICE=always-malloc LD_LIBRARY_PATH=$BUILD/usr/lib LUA_CPATH="$BUILD/usr/lib/lib?.so;;" \
-        $TEST_WRAPPER ../apteryx-rest $PARAM -m $BUILD/etc/restconf/ -r $BUILD/usr/share/restconf/ -p apteryx-rest.pid -s $SOCK
+        $TEST_WRAPPER ../apteryx-rest $PARAM -m $BUILD/etc/restconf/ -r $BUILD/usr/share/restconf/ -j 2 -C $BUILD/rpc-cache -c $BUILD/api-snapshot -l logging.conf -p apteryx-rest.pid -s $SOCK
 rc=$?; if [[ $rc != 0 ]]; then quit $rc; fi
 sleep 0.5
 cd $BUILD/../
@@ -3,8 +3,10 @@ import socket
 import struct
 
 FCGI_BEGIN_REQUEST = 1
+FCGI_END_REQUEST = 3
 FCGI_PARAMS = 4
 FCGI_STDIN = 5
+FCGI_STDOUT = 6
 FCGI_RESPONDER = 1
 
 
@@ -37,3 +39,26 @@ def fcgi_get(sock_path, docroot, path, accept):
                  fcgi_record(FCGI_PARAMS, b"") +
                  fcgi_record(FCGI_STDIN, b""))
     return sock
+
+
+def fcgi_read(sock):
+    """Read the whole response to a request and close the socket"""
+    data = b""
+    stdout = b""
+    try:
+        while True:
+            while len(data) >= 8:
+                _, rtype, _, length, padding, _ = struct.unpack("!BBHHBB", data[:8])
+                if len(data) < 8 + length + padding:
+                    break
+                if rtype == FCGI_END_REQUEST:
+                    return stdout.decode("utf-8")
+                if rtype == FCGI_STDOUT:
+                    stdout += data[8:8 + length]
+                data = data[8 + length + padding:]
+            chunk = sock.recv(4096)
+            if not chunk:
+                return stdout.decode("utf-8")
+            data += chunk
+    finally:
+        sock.close()
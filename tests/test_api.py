@@ -48,6 +48,22 @@ def test_restconf_operations_list():
 }""" % (docroot, docroot, docroot))
 
 
+def test_restconf_static_resources_etag():
+    response = requests.get("{}{}/data/ietf-yang-library:yang-library".format(server_uri, docroot), auth=server_auth, headers=get_restconf_headers)
+    assert response.status_code == 200
+    contentid = response.json()['ietf-yang-library:yang-library']['content-id']
+    for path in ["", "/operations", "/yang-library-version", "/data"]:
+        response = requests.get("{}{}{}".format(server_uri, docroot, path), auth=server_auth, headers=get_restconf_headers)
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+        assert etag.startswith(contentid)
+        headers = dict(get_restconf_headers)
+        headers["If-None-Match"] = etag
+        response = requests.get("{}{}{}".format(server_uri, docroot, path), auth=server_auth, headers=headers)
+        assert response.status_code == 304
+        assert len(response.content) == 0
+
+
 def test_restconf_yang_library_version():
     response = requests.get("{}{}/yang-library-version".format(server_uri, docroot), auth=server_auth, headers=get_restconf_headers)
     print(json.dumps(response.json(), indent=4, sort_keys=True))
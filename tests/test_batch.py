@@ -0,0 +1,103 @@
+import apteryx
+import json
+import requests
+from conftest import server_uri, server_auth, docroot
+
+
+def test_restapi_batch_merge_replace_delete():
+    data = json.dumps([
+        {"operation": "merge", "path": "/test/settings", "value": {"priority": "2", "debug": "0"}},
+        {"operation": "delete", "path": "/test/animals/animal/cat"},
+        {"operation": "replace", "path": "/test/animals", "value": {"animal": [{"name": "mouse", "colour": "white"}]}},
+        {"operation": "merge", "path": "/test/settings/priority", "value": "3"},
+    ])
+    response = requests.post("{}{}/_batch".format(server_uri, docroot), verify=False, auth=server_auth, data=data)
+    print(json.dumps(response.json(), indent=4, sort_keys=True))
+    assert response.status_code == 200
+    assert response.json() == json.loads("""
+{
+    "results": [
+        { "status": 204 },
+        { "status": 204 },
+        { "status": 204 },
+        { "status": 204 }
+    ]
+}
+""")
+    assert apteryx.get("/test/settings/priority") == "3"
+    assert apteryx.get("/test/settings/debug") == "0"
+    assert apteryx.get("/test/animals/animal/cat/name") is None
+    assert apteryx.get("/test/animals/animal/cat/type") is None
+    assert apteryx.get("/test/animals/animal/mouse/colour") == "white"
+    assert apteryx.get("/test/animals/animal/mouse/type") is None
+
+
+def test_restapi_batch_later_operations_win():
+    data = json.dumps([
+        {"operation": "delete", "path": "/test/settings/priority"},
+        {"operation": "merge", "path": "/test/settings", "value": {"priority": "5"}},
+    ])
+    response = requests.post("{}{}/_batch".format(server_uri, docroot), verify=False, auth=server_auth, data=data)
+    assert response.status_code == 200
+    assert apteryx.get("/test/settings/priority") == "5"
+
+
+def test_restapi_batch_delete_after_merge():
+    data = json.dumps([
+        {"operation": "merge", "path": "/test/animals", "value": {"animal": [{"name": "frog", "colour": "green"}]}},
+        {"operation": "delete", "path": "/test/animals/animal/frog"},
+    ])
+    response = requests.post("{}{}/_batch".format(server_uri, docroot), verify=False, auth=server_auth, data=data)
+    print(json.dumps(response.json(), indent=4, sort_keys=True))
+    assert response.status_code == 200
+    assert apteryx.get("/test/animals/animal/frog/name") is None
+    assert apteryx.get("/test/animals/animal/frog/colour") is None
+
+
+def test_restapi_batch_multiple_models():
+    data = json.dumps([
+        {"operation": "merge", "path": "/test/settings", "value": {"priority": "4"}},
+        {"operation": "merge", "path": "/testing-2:test/settings", "value": {"priority": "6"}},
+    ])
+    response = requests.post("{}{}/_batch".format(server_uri, docroot), verify=False, auth=server_auth, data=data)
+    print(json.dumps(response.json(), indent=4, sort_keys=True))
+    assert response.status_code == 200
+    assert response.json()["results"] == [{"status": 204}, {"status": 204}]
+    assert apteryx.get("/test/settings/priority") == "4"
+    assert apteryx.get("/t2:test/settings/priority") == "6"
+
+
+def test_restapi_batch_invalid_operation_writes_nothing():
+    data = json.dumps([
+        {"operation": "merge", "path": "/test/settings", "value": {"priority": "2"}},
+        {"operation": "merge", "path": "/test/cabbage", "value": {"leaves": "green"}},
+    ])
+    response = requests.post("{}{}/_batch".format(server_uri, docroot), verify=False, auth=server_auth, data=data)
+    print(json.dumps(response.json(), indent=4, sort_keys=True))
+    assert response.status_code == 404
+    assert response.json()["results"][0]["status"] == 424
+    assert response.json()["results"][1]["status"] == 404
+    assert apteryx.get("/test/settings/priority") == "1"
+
+
+def test_restapi_batch_if_match():
+    response = requests.get("{}{}/test/settings".format(server_uri, docroot), verify=False, auth=server_auth)
+    etag = response.headers["ETag"]
+    data = json.dumps([
+        {"operation": "merge", "path": "/test/settings", "value": {"priority": "2"}, "if-match": etag},
+        {"operation": "delete", "path": "/test/settings/debug", "if-match": "1234"},
+    ])
+    response = requests.post("{}{}/_batch".format(server_uri, docroot), verify=False, auth=server_auth, data=data)
+    print(json.dumps(response.json(), indent=4, sort_keys=True))
+    assert response.status_code == 412
+    assert response.json()["results"][0]["status"] == 424
+    assert response.json()["results"][1]["status"] == 412
+    assert apteryx.get("/test/settings/priority") == "1"
+    assert apteryx.get("/test/settings/debug") == "1"
+
+
+def test_restapi_batch_malformed():
+    response = requests.post("{}{}/_batch".format(server_uri, docroot), verify=False, auth=server_auth, data='[{"operation": "merge", "path": "/test/settings"}]')
+    assert response.status_code == 400
+    response = requests.post("{}{}/_batch".format(server_uri, docroot), verify=False, auth=server_auth, data='[{"operation": "create", "path": "/test/settings"}]')
+    assert response.status_code == 400
@@ -0,0 +1,85 @@
+import apteryx
+import json
+import requests
+from conftest import server_uri, server_auth, docroot, get_restconf_headers
+
+
+def test_restapi_bulk_get_multiple_paths():
+    data = json.dumps(["/test/settings/priority", "/test/settings", "/test/state/uptime/days"])
+    response = requests.post("{}{}/_bulk-get".format(server_uri, docroot), verify=False, auth=server_auth, data=data)
+    print(json.dumps(response.json(), indent=4, sort_keys=True))
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/json"
+    assert int(response.headers["Content-Length"]) == len(response.content)
+    result = response.json()
+    assert result["/test/settings/priority"]["status"] == 200
+    assert result["/test/settings/priority"]["data"] == json.loads('{ "priority": "1" }')
+    assert result["/test/settings"]["status"] == 200
+    assert result["/test/settings"]["data"] == json.loads("""
+{
+    "settings": {
+        "debug": "1",
+        "enable": "true",
+        "priority": "1",
+        "readonly": "0",
+        "volume": "1"
+    }
+}
+""")
+    assert result["/test/state/uptime/days"]["data"] == json.loads('{ "days": "5" }')
+
+
+def test_restapi_bulk_get_matches_get():
+    paths = ["/test/animals", "/test/animals/animal/cat", "/test/state/uptime?fields=hours"]
+    response = requests.post("{}{}/_bulk-get".format(server_uri, docroot), verify=False, auth=server_auth, data=json.dumps(paths))
+    assert response.status_code == 200
+    for path in paths:
+        single = requests.get("{}{}{}".format(server_uri, docroot, path), verify=False, auth=server_auth)
+        print(path, json.dumps(response.json()[path], indent=4, sort_keys=True))
+        assert response.json()[path]["status"] == single.status_code
+        assert int(response.json()[path]["etag"], 16) >= int(single.headers["ETag"], 16)
+        assert response.json()[path]["data"] == single.json()
+
+
+def test_restapi_bulk_get_etag():
+    response = requests.post("{}{}/_bulk-get".format(server_uri, docroot), verify=False, auth=server_auth, data='["/test/settings"]')
+    assert response.status_code == 200
+    etag = response.json()["/test/settings"]["etag"]
+    apteryx.set("/test/state/counter", "43")
+    data = json.dumps([{"path": "/test/settings", "etag": etag}, {"path": "/test/state/counter", "etag": etag}])
+    response = requests.post("{}{}/_bulk-get".format(server_uri, docroot), verify=False, auth=server_auth, data=data)
+    print(json.dumps(response.json(), indent=4, sort_keys=True))
+    assert response.status_code == 200
+    assert response.json()["/test/settings"]["status"] == 304
+    assert response.json()["/test/settings"]["etag"] == etag
+    assert "data" not in response.json()["/test/settings"]
+    assert response.json()["/test/state/counter"]["status"] == 200
+    assert response.json()["/test/state/counter"]["data"] == json.loads('{ "counter": "43" }')
+
+
+def test_restapi_bulk_get_invalid_path():
+    data = json.dumps(["/test/settings/priority", "/test/cabbage"])
+    response = requests.post("{}{}/_bulk-get".format(server_uri, docroot), verify=False, auth=server_auth, data=data)
+    print(json.dumps(response.json(), indent=4, sort_keys=True))
+    assert response.status_code == 200
+    assert response.json()["/test/settings/priority"]["status"] == 200
+    assert response.json()["/test/cabbage"]["status"] == 404
+
+
+def test_restapi_bulk_get_malformed():
+    response = requests.post("{}{}/_bulk-get".format(server_uri, docroot), verify=False, auth=server_auth, data='{"path": "/test/settings"}')
+    assert response.status_code == 400
+    response = requests.post("{}{}/_bulk-get".format(server_uri, docroot), verify=False, auth=server_auth, data='["/test/settings", 1]')
+    assert response.status_code == 400
+
+
+def test_restconf_bulk_get():
+    data = json.dumps(["/test/settings/priority", "/test/cabbage"])
+    response = requests.post("{}{}/_bulk-get".format(server_uri, docroot), auth=server_auth,
+                             headers=dict(get_restconf_headers, **{"Content-Type": "application/yang-data+json"}), data=data)
+    print(json.dumps(response.json(), indent=4, sort_keys=True))
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/yang-data+json"
+    assert response.json()["/test/settings/priority"]["data"] == json.loads('{ "priority": 1 }')
+    assert response.json()["/test/cabbage"]["status"] == 404
+    assert response.json()["/test/cabbage"]["data"]["ietf-restconf:errors"]["error"][0]["error-tag"] == "invalid-value"
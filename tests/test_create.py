@@ -774,3 +774,29 @@ def test_restconf_must_condition_false():
     }
 }
     """)
+
+
+def test_restconf_create_large_body():
+    data = json.dumps({"users": [{"name": f"user{i}", "age": i % 100} for i in range(3000)]})
+    assert len(data) > 64 * 1024
+    response = requests.post("{}{}/data/test/settings".format(server_uri, docroot), auth=server_auth, headers=set_restconf_headers, data=data)
+    assert response.status_code == 201
+    assert apteryx.get("/test/settings/users/user0/name") == "user0"
+    assert apteryx.get("/test/settings/users/user2999/age") == "99"
+
+
+def test_restconf_create_large_body_malformed():
+    data = '{"users": [' + ','.join(['{"name": "user%d", "age": 1}' % i for i in range(3000)]) + ',}'
+    assert len(data) > 64 * 1024
+    response = requests.post("{}{}/data/test/settings".format(server_uri, docroot), auth=server_auth, headers=set_restconf_headers, data=data)
+    assert response.status_code == 400
+    assert apteryx.get("/test/settings/users/user0/name") is None
+
+
+def test_restconf_create_large_body_not_found():
+    data = json.dumps({"users": [{"name": f"user{i}", "age": i % 100} for i in range(3000)]})
+    assert len(data) > 64 * 1024
+    response = requests.post("{}{}/data/test/cabbage".format(server_uri, docroot), auth=server_auth, headers=set_restconf_headers, data=data)
+    assert response.status_code == 404
+    response = requests.get("{}{}/data/test/settings/debug".format(server_uri, docroot), auth=server_auth, headers=get_restconf_headers)
+    assert response.status_code == 200
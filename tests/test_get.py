@@ -1,6 +1,7 @@
 import apteryx
 import json
 import requests
+import threading
 from conftest import server_uri, server_auth, docroot, get_restconf_headers, rfc3986_reserved
 
 
@@ -738,3 +739,65 @@ def test_restconf_get_must_condition_false():
 #   value is a zero-length string.
 #  Note that non-configuration lists are not required to define keys.
 #   In this case, a single list instance cannot be accessed.
+
+
+def test_restconf_get_list_many_entries():
+    for i in range(100):
+        apteryx.set(f"/test/settings/rules/{i}/index", str(i))
+        apteryx.set(f"/test/settings/rules/{i}/name", f"name{i}")
+    response = requests.get("{}{}/data/testing:test/settings/rules".format(server_uri, docroot), auth=server_auth, headers=get_restconf_headers)
+    assert response.status_code == 200
+    assert response.json() == {"testing:rules": [{"index": i, "name": f"name{i}"} for i in range(100)]}
+
+
+def test_restconf_get_model_matches_subtrees():
+    response = requests.get("{}{}/data/testing:test".format(server_uri, docroot), auth=server_auth, headers=get_restconf_headers)
+    print(json.dumps(response.json(), indent=4, sort_keys=True))
+    assert response.status_code == 200
+    tree = response.json()["testing:test"]
+    for subtree in ["settings", "state", "animals"]:
+        response = requests.get("{}{}/data/testing:test/{}".format(server_uri, docroot, subtree), auth=server_auth, headers=get_restconf_headers)
+        assert response.status_code == 200
+        assert tree[subtree] == response.json()["testing:" + subtree]
+
+
+def set_rules(count, name):
+    apteryx.set_tree({"test": {"settings": {"rules": {str(i): {"index": str(i), "name": name} for i in range(count)}}}})
+
+
+def get_rules():
+    response = requests.get("{}{}/data/testing:test/settings/rules".format(server_uri, docroot), auth=server_auth, headers=get_restconf_headers)
+    assert response.status_code == 200
+    return sorted(response.json()["testing:rules"], key=lambda rule: rule["index"])
+
+
+def test_restconf_get_list_split_query():
+    # 400 entries are over 2000 nodes, so reads after the first are split between the query threads
+    set_rules(400, "first")
+    for _ in range(3):
+        assert get_rules() == [{"index": i, "name": "first"} for i in range(400)]
+
+
+def test_restconf_get_list_split_query_consistent():
+    # Each write changes every entry at once. A split read that overlaps a write
+    # is read again, so no response mixes entries from different writes
+    set_rules(400, "0")
+    get_rules()
+    stop = threading.Event()
+
+    def writer():
+        version = 1
+        while not stop.is_set():
+            set_rules(400, str(version))
+            version += 1
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        for _ in range(20):
+            rules = get_rules()
+            assert len(rules) == 400
+            assert len({rule["name"] for rule in rules}) == 1
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,65 @@
+import glob
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import pytest
+
+from conftest import docroot
+from fcgi import fcgi_get, fcgi_read
+
+BUILD = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".build"))
+FCGI_SOCK_PATH = os.path.join(tempfile.gettempdir(), "apteryx-rest-lazy-test.sock")
+
+
+@pytest.fixture
+def lazy_instance():
+    # A private apteryx-rest instance that loads its models when first used. The
+    # models it has loaded are linked into a directory under its TMPDIR
+    if os.path.exists(FCGI_SOCK_PATH):
+        os.unlink(FCGI_SOCK_PATH)
+    tmpdir = tempfile.mkdtemp()
+    env = dict(os.environ, TMPDIR=tmpdir)
+    proc = subprocess.Popen([os.path.join(BUILD, "..", "apteryx-rest"), "-L",
+                             "-m", os.path.join(BUILD, "etc/restconf/"), "-s", FCGI_SOCK_PATH],
+                            cwd=BUILD, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(50):
+            if os.path.exists(FCGI_SOCK_PATH):
+                break
+            time.sleep(0.1)
+        else:
+            pytest.fail("apteryx-rest did not create socket %s" % FCGI_SOCK_PATH)
+        yield tmpdir
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+        if os.path.exists(FCGI_SOCK_PATH):
+            os.unlink(FCGI_SOCK_PATH)
+        shutil.rmtree(tmpdir)
+
+
+def loaded_models(tmpdir):
+    dirs = glob.glob(os.path.join(tmpdir, "apteryx-rest-*"))
+    assert len(dirs) == 1
+    return [name for name in os.listdir(dirs[0]) if name.endswith(".xml")]
+
+
+def test_lazy_models_load_on_first_access(lazy_instance):
+    assert loaded_models(lazy_instance) == []
+    response = fcgi_read(fcgi_get(FCGI_SOCK_PATH, docroot, "/test/settings/priority", "application/json"))
+    assert "Status: 200" in response
+    loaded = loaded_models(lazy_instance)
+    assert "testing.xml" in loaded
+    assert "testing-rpc.xml" not in loaded
+
+
+def test_lazy_models_load_all(lazy_instance):
+    response = fcgi_read(fcgi_get(FCGI_SOCK_PATH, docroot, ".xml", "text/xml"))
+    assert "Status: 200" in response
+    loaded = loaded_models(lazy_instance)
+    assert "testing.xml" in loaded
+    assert "testing-rpc.xml" in loaded
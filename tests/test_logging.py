@@ -0,0 +1,221 @@
+import json
+import os
+import pytest
+import re
+import requests
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from conftest import server_uri, server_auth, docroot, set_restconf_headers
+from fcgi import fcgi_get, fcgi_read
+from test_metrics import get_metrics
+
+# The logging options file passed to apteryx-rest with -l by run.sh
+logging_conf = os.path.join(os.getcwd(), ".build", "etc", "restconf", "logging.conf")
+access_fifo = os.path.join(os.getcwd(), ".build", "access-fifo")
+
+BUILD = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".build"))
+FCGI_SOCK_PATH = os.path.join(tempfile.gettempdir(), "apteryx-rest-logging-test.sock")
+
+
+def set_logging(options):
+    with open(logging_conf, "w") as f:
+        f.write(options + "\n")
+    # The options are reloaded from the main loop
+    time.sleep(0.5)
+
+
+@pytest.fixture(autouse=True)
+def logging_off():
+    yield
+    set_logging("")
+
+
+@pytest.fixture
+def stalled_logger():
+    # The audit logger blocks opening the access log until the fifo has a reader
+    if os.path.exists(access_fifo):
+        os.unlink(access_fifo)
+    os.mkfifo(access_fifo)
+    stop = threading.Event()
+
+    def drain():
+        fd = os.open(access_fifo, os.O_RDONLY | os.O_NONBLOCK)
+        while not stop.is_set():
+            try:
+                if not os.read(fd, 65536):
+                    time.sleep(0.01)
+            except BlockingIOError:
+                time.sleep(0.01)
+        os.close(fd)
+
+    thread = threading.Thread(target=drain)
+    yield access_fifo
+    # Let the logger empty the queue before logging is turned off
+    thread.start()
+    time.sleep(0.5)
+    set_logging("")
+    stop.set()
+    thread.join()
+    os.unlink(access_fifo)
+
+
+def get_dropped():
+    return get_metrics()["apteryx_rest_audit_dropped_total"]
+
+
+def test_logging_audit_queue_drops_when_full(stalled_logger):
+    url = "{}{}/test/settings/debug".format(server_uri, docroot)
+    before = get_dropped()
+    set_logging("patch overflow=drop access={}".format(stalled_logger))
+    # The first access record stalls the logger
+    assert requests.get(url, verify=False, auth=server_auth).status_code == 200
+    time.sleep(0.1)
+
+    # A write of thousands of leaves is queued as a single record
+    rules = [{"index": i, "name": "rule{}".format(i)} for i in range(5000)]
+    response = requests.patch("{}{}/data/test/settings".format(server_uri, docroot), auth=server_auth,
+                              headers=set_restconf_headers, data=json.dumps({"rules": rules}))
+    assert response.status_code == 204
+    assert get_dropped() == before
+
+    # Requests keep completing once the queue is full, and the records are counted
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        for _ in range(16):
+            statuses = list(pool.map(lambda _: requests.get(url, verify=False, auth=server_auth).status_code, range(512)))
+            assert statuses == [200] * 512
+            if get_dropped() > before:
+                break
+    assert get_dropped() > before
+
+
+def debug_log(options, count):
+    """Send count GETs to a private apteryx-rest instance run with -d, so audit records
+       are printed instead of going to syslog, and return the lines it logged"""
+    conf = os.path.join(BUILD, "etc", "restconf", "logging-test.conf")
+    with open(conf, "w") as f:
+        f.write(options + "\n")
+    if os.path.exists(FCGI_SOCK_PATH):
+        os.unlink(FCGI_SOCK_PATH)
+    with tempfile.TemporaryFile(mode="w+") as out:
+        proc = subprocess.Popen([os.path.join(BUILD, "..", "apteryx-rest"), "-d", "-l", "logging-test.conf",
+                                 "-m", os.path.join(BUILD, "etc/restconf/"), "-s", FCGI_SOCK_PATH],
+                                cwd=BUILD, stdout=out, stderr=subprocess.DEVNULL)
+        try:
+            for _ in range(50):
+                if os.path.exists(FCGI_SOCK_PATH):
+                    break
+                time.sleep(0.1)
+            else:
+                pytest.fail("apteryx-rest did not create socket %s" % FCGI_SOCK_PATH)
+            for _ in range(count):
+                response = fcgi_read(fcgi_get(FCGI_SOCK_PATH, docroot, "/test/settings/priority", "application/json"))
+                assert "Status: 200" in response
+            # The log is flushed when apteryx-rest exits
+            proc.send_signal(signal.SIGTERM)
+            assert proc.wait(timeout=15) == 0
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+            os.unlink(conf)
+            if os.path.exists(FCGI_SOCK_PATH):
+                os.unlink(FCGI_SOCK_PATH)
+        out.seek(0)
+        return out.read().splitlines()
+
+
+def slow_lines(lines):
+    return [line for line in lines if line.startswith("SLOW")]
+
+
+def test_logging_slow_requests():
+    lines = slow_lines(debug_log("slow=1us", 3))
+    assert len(lines) == 3
+    for line in lines:
+        assert re.match(r"SLOW  \[200\] \S*@\S* GET {}/test/settings/priority \d+ bytes \(.*total;dur=[0-9.]+\)$".format(docroot), line), line
+
+
+def test_logging_slow_threshold():
+    assert slow_lines(debug_log("slow=10s", 3)) == []
+
+
+def test_logging_slow_sample():
+    # Only the first of every four slow requests is logged
+    assert len(slow_lines(debug_log("slow=1us slow-sample=1/4", 8))) == 2
+
+
+access_log = os.path.join(os.getcwd(), ".build", "access.log")
+
+
+@pytest.fixture
+def access_files():
+    for path in (access_log, access_log + ".1"):
+        if os.path.exists(path):
+            os.unlink(path)
+    yield access_log
+    set_logging("")
+    for path in (access_log, access_log + ".1"):
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def read_access(path, count):
+    # Lines are written by the logger thread after the response is sent
+    lines = []
+    for _ in range(50):
+        if os.path.exists(path):
+            with open(path) as f:
+                lines = [json.loads(line) for line in f]
+            if len(lines) >= count:
+                break
+        time.sleep(0.1)
+    return lines
+
+
+def test_logging_access_line(access_files):
+    set_logging("access={}".format(access_files))
+    response = requests.get("{}{}/data/test/settings?depth=1".format(server_uri, docroot), auth=server_auth,
+                            headers={"Accept": "application/yang-data+json"})
+    assert response.status_code == 200
+    etag = requests.get("{}/api.xml".format(server_uri), auth=server_auth).headers["ETag"]
+    assert requests.get("{}/api.xml".format(server_uri), auth=server_auth,
+                        headers={"If-None-Match": etag}).status_code == 304
+    lines = read_access(access_files, 3)
+    assert len(lines) == 3
+    line = lines[0]
+    assert set(line.keys()) == {"timestamp", "method", "path", "query", "status", "bytes_in", "bytes_out",
+                                "duration_ms", "remote_user", "remote_addr", "cache", "etag"}
+    assert re.match(r"^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{3}Z$", line["timestamp"])
+    assert line["method"] == "GET"
+    assert line["path"] == "{}/data/test/settings".format(docroot)
+    assert line["query"] == "depth=1"
+    assert line["status"] == 200
+    assert line["bytes_in"] == 0
+    assert line["bytes_out"] >= len(response.content)
+    assert line["duration_ms"] >= 0
+    assert line["etag"] is None
+    assert lines[1]["path"] == "/api.xml" and lines[1]["query"] is None
+    assert lines[1]["status"] == 200 and lines[1]["etag"] is None
+    assert lines[2]["status"] == 304 and lines[2]["etag"] == "not-modified"
+
+
+def test_logging_access_rotate(access_files):
+    set_logging("access={} access-size=1024".format(access_files))
+    url = "{}{}/test/settings/priority".format(server_uri, docroot)
+    for _ in range(20):
+        assert requests.get(url, auth=server_auth).status_code == 200
+    # Each line is around 300 bytes, so the log has been moved to .1 more than once
+    for _ in range(50):
+        if os.path.exists(access_files + ".1") and read_access(access_files, 1):
+            break
+        time.sleep(0.1)
+    assert os.path.getsize(access_files + ".1") <= 1024
+    assert os.path.getsize(access_files) <= 1024
+    old = read_access(access_files + ".1", 1)
+    new = read_access(access_files, 1)
+    assert old and new
+    assert all(line["path"] == "{}/test/settings/priority".format(docroot) for line in old + new)
@@ -0,0 +1,62 @@
+import requests
+from conftest import server_uri, server_auth, docroot, set_restconf_headers
+
+
+def get_metrics():
+    response = requests.get("{}{}/.metrics".format(server_uri, docroot), verify=False, auth=server_auth)
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/plain")
+    metrics = {}
+    for line in response.text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            metrics[name] = float(value)
+    return metrics
+
+
+def test_metrics_requests():
+    before = get_metrics()
+    key = 'apteryx_rest_requests_total{method="GET",status="200",model="test"}'
+    response = requests.get("{}{}/test/settings".format(server_uri, docroot), verify=False, auth=server_auth)
+    assert response.status_code == 200
+    after = get_metrics()
+    print(after)
+    assert after[key] == before.get(key, 0) + 1
+    count = 'apteryx_rest_request_duration_seconds_count{method="GET",status="200",model="test"}'
+    inf = 'apteryx_rest_request_duration_seconds_bucket{method="GET",status="200",model="test",le="+Inf"}'
+    assert after[count] == after[inf] == after[key]
+    assert after["apteryx_rest_requests_in_flight"] >= 1
+    assert after["apteryx_rest_sent_bytes_total"] >= before["apteryx_rest_sent_bytes_total"] + len(response.content)
+
+
+def test_metrics_errors_and_bytes_in():
+    before = get_metrics()
+    data = '{"priority": "2"}'
+    response = requests.patch("{}{}/test/settings".format(server_uri, docroot), verify=False, auth=server_auth, data=data)
+    assert response.status_code == 204
+    response = requests.get("{}{}/test/cabbage".format(server_uri, docroot), verify=False, auth=server_auth)
+    assert response.status_code == 404
+    after = get_metrics()
+    key = 'apteryx_rest_requests_total{method="PATCH",status="204",model="test"}'
+    assert after[key] == before.get(key, 0) + 1
+    assert after["apteryx_rest_received_bytes_total"] >= before["apteryx_rest_received_bytes_total"] + len(data)
+    assert not any('model="cabbage"' in name for name in after)
+
+
+def test_metrics_rpc():
+    response = requests.post("{}{}/operations/testing-4:reboot".format(server_uri, docroot), auth=server_auth, headers=set_restconf_headers)
+    assert response.status_code == 204
+    metrics = get_metrics()
+    calls = [name for name in metrics if name.startswith("apteryx_rest_rpc_calls_total") and "reboot" in name]
+    assert len(calls) == 1 and metrics[calls[0]] >= 1
+    states = [name for name in metrics if name.startswith("apteryx_rest_rpc_state_calls_total")]
+    assert len(states) >= 1 and sum(metrics[name] for name in states) >= 1
+    assert all(metrics[name.replace("_calls_total", "_wait_seconds_total")] >= 0 for name in states)
+
+
+def test_metrics_model_only_from_schema():
+    response = requests.get("{}{}.xml".format(server_uri, docroot), verify=False, auth=server_auth)
+    assert response.status_code == 200
+    metrics = get_metrics()
+    assert not any('model=".metrics"' in name or 'model=".xml"' in name for name in metrics)
+    assert metrics["apteryx_rest_queue_depth"] >= 0
@@ -162,6 +162,24 @@ def test_restconf_query_content_nonconfig():
     """)
 
 
+def test_restconf_query_content_nonconfig_list_keys():
+    apteryx.set("/test/settings/users/alfred/name", "alfred")
+    apteryx.set("/test/settings/users/alfred/age", "87")
+    apteryx.set("/test/settings/users/alfred/active", "true")
+    response = requests.get("{}{}/data/test/settings/users?content=nonconfig".format(server_uri, docroot), auth=server_auth, headers=get_restconf_headers)
+    assert response.status_code == 200
+    assert len(response.content) > 0
+    print(json.dumps(response.json(), indent=4, sort_keys=True))
+    assert response.json() == json.loads("""
+{
+    "users": [{
+        "name": "alfred",
+        "active": true
+    }]
+}
+    """)
+
+
 def test_restconf_query_depth_unbounded():
     apteryx.set("/test/settings/time/day", "5")
     apteryx.set("/test/settings/time/hour", "12")
@@ -272,6 +290,27 @@ def test_restconf_query_depth_2_trunk():
     """)
 
 
+def test_restconf_query_depth_2_trunk_many_entries():
+    for i in range(100):
+        apteryx.set(f"/test/settings/users/user{i}/name", f"user{i}")
+        apteryx.set(f"/test/settings/users/user{i}/age", str(i))
+    response = requests.get("{}{}/data/test/settings?depth=2".format(server_uri, docroot), auth=server_auth, headers=get_restconf_headers)
+    assert response.status_code == 200
+    print(json.dumps(response.json(), indent=4, sort_keys=True))
+    assert response.json() == json.loads("""
+{
+    "settings": {
+        "debug": "enable",
+        "enable": true,
+        "priority": 1,
+        "readonly": "yes",
+        "users": [],
+        "volume": "1"
+    }
+}
+    """)
+
+
 def test_restconf_query_depth_2_list():
     apteryx.set("/test/settings/time/day", "5")
     apteryx.set("/test/settings/time/hour", "12")
@@ -1568,6 +1607,25 @@ def test_restconf_query_with_defaults_report_all_specific_leaf():
     """)
 
 
+def test_restconf_query_with_defaults_many_list_entries():
+    for i in range(4, 200):
+        apteryx.set(f"/interfaces/interface/eth{i}/name", f"eth{i}")
+        if i % 2:
+            apteryx.set(f"/interfaces/interface/eth{i}/mtu", "1500")
+        else:
+            apteryx.set(f"/interfaces/interface/eth{i}/mtu", "9000")
+    for mode in ["report-all", "trim"]:
+        response = requests.get("{}{}/data/interfaces/interface?with-defaults={}".format(server_uri, docroot, mode), auth=server_auth, headers=get_restconf_headers)
+        assert response.status_code == 200
+        entries = response.json()["interface"]
+        assert len(entries) == 200
+        for entry in entries:
+            single = requests.get("{}{}/data/interfaces/interface={}?with-defaults={}".format(server_uri, docroot, entry["name"], mode),
+                                  auth=server_auth, headers=get_restconf_headers)
+            assert single.status_code == 200
+            assert [entry] == single.json()["interface"]
+
+
 def test_restconf_query_proxy_with_defaults_report_all_leaf():
     apteryx.set("/logical-elements/logical-element/loop/name", "loopy")
     apteryx.set("/logical-elements/logical-element/loop/root", "root")
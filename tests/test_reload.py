@@ -0,0 +1,165 @@
+import apteryx
+import os
+import requests
+import struct
+import time
+from conftest import server_uri, server_auth, docroot
+
+# Models are loaded from the model path used by run.sh
+model_path = os.path.join(os.getcwd(), ".build", "etc", "restconf")
+model_source = os.path.join(os.getcwd(), ".build", "reload-test.xml")
+model_link = os.path.join(model_path, "reload-test.xml")
+
+model_xml = """<?xml version="1.0" encoding="UTF-8"?>
+<MODULE xmlns="http://test.com/ns/yang/reload-test" model="reload-test" namespace="http://test.com/ns/yang/reload-test" prefix="rt"
+        organization="Test Ltd" version="2024-01-01">
+  <NODE name="reloadtest" help="Added while the server is running">
+    <NODE name="value" mode="rw" help="A value"/>
+  </NODE>
+</MODULE>
+"""
+
+
+def wait_for_status(url, status):
+    for _ in range(50):
+        response = requests.get(url, verify=False, auth=server_auth)
+        if response.status_code == status:
+            return response
+        time.sleep(0.1)
+    return response
+
+
+def add_model():
+    with open(model_source, "w") as f:
+        f.write(model_xml)
+    # A symlink only generates a create event
+    os.symlink(model_source, model_link)
+
+
+def remove_model():
+    if os.path.lexists(model_link):
+        os.unlink(model_link)
+    if os.path.exists(model_source):
+        os.unlink(model_source)
+    apteryx.prune("/reloadtest")
+
+
+def test_reload_add_and_remove_model():
+    url = "{}{}/reloadtest/value".format(server_uri, docroot)
+    apteryx.set("/reloadtest/value", "hello")
+    try:
+        assert requests.get(url, verify=False, auth=server_auth).status_code == 404
+        add_model()
+        response = wait_for_status(url, 200)
+        assert response.status_code == 200
+        assert response.json() == {"value": "hello"}
+    finally:
+        remove_model()
+    assert wait_for_status(url, 404).status_code == 404
+
+
+def test_reload_watch_rebound():
+    apteryx.set("/test/settings/priority", "1")
+    url = "{}{}/test/settings/priority".format(server_uri, docroot)
+    response = requests.get(url, stream=True, verify=False, auth=server_auth, headers={'Accept': 'text/event-stream'}, timeout=5)
+    assert response.status_code == 200
+    lines = response.iter_lines(decode_unicode=True)
+    initial = update = False
+    try:
+        for line in lines:
+            if line == 'data: {"priority": 1}':
+                initial = True
+                break
+        apteryx.set("/reloadtest/value", "hello")
+        add_model()
+        assert wait_for_status("{}{}/reloadtest".format(server_uri, docroot), 200).status_code == 200
+        apteryx.set("/test/settings/priority", "2")
+        for line in lines:
+            if line == 'data: {"priority": 2}':
+                update = True
+                break
+    finally:
+        response.close()
+        remove_model()
+    assert initial is True, "Did not receive the event for initial data"
+    assert update is True, "Did not receive an event after the models were reloaded"
+
+
+# The /api.xml snapshot passed to apteryx-rest with -c by run.sh
+snapshot_path = os.path.join(os.getcwd(), ".build", "api-snapshot")
+snapshot_header = struct.Struct("8s72s24sQQQQ")
+
+
+def read_snapshot():
+    with open(snapshot_path, "rb") as f:
+        data = f.read()
+    magic, manifest, _, xml_offset, xml_length, _, _ = snapshot_header.unpack_from(data)
+    assert magic == b"ARSNAP01"
+    return manifest, data[xml_offset:xml_offset + xml_length].decode()
+
+
+def write_snapshot(data):
+    # The server may still have the old file mapped, so replace it rather than change it
+    with open(snapshot_path + ".test", "wb") as f:
+        f.write(data)
+    os.replace(snapshot_path + ".test", snapshot_path)
+
+
+def reload_unchanged():
+    # A write that changes nothing reloads the models without changing the manifest
+    with open(os.path.join(model_path, "logging.conf"), "a"):
+        pass
+    time.sleep(1.5)
+
+
+def get_api_xml():
+    response = requests.get("{}/api.xml".format(server_uri), verify=False, auth=server_auth)
+    assert response.status_code == 200
+    return response.text
+
+
+def test_reload_snapshot_written():
+    xml = get_api_xml()
+    _, snapshot = read_snapshot()
+    assert snapshot == xml
+
+
+def test_reload_snapshot_stale():
+    get_api_xml()
+    manifest, _ = read_snapshot()
+    url = "{}{}/reloadtest/value".format(server_uri, docroot)
+    apteryx.set("/reloadtest/value", "hello")
+    try:
+        add_model()
+        assert wait_for_status(url, 200).status_code == 200
+        # The models changed, so the snapshot is rebuilt rather than used
+        xml = get_api_xml()
+        assert "reloadtest" in xml
+        new_manifest, snapshot = read_snapshot()
+        assert new_manifest != manifest
+        assert snapshot == xml
+    finally:
+        remove_model()
+    assert wait_for_status(url, 404).status_code == 404
+    assert "reloadtest" not in get_api_xml()
+
+
+def test_reload_snapshot_corrupt():
+    xml = get_api_xml()
+    with open(snapshot_path, "rb") as f:
+        data = f.read()
+    # Keep the header (and manifest) but cut the dump short
+    write_snapshot(data[:snapshot_header.size + 16])
+    reload_unchanged()
+    assert get_api_xml() == xml
+    _, snapshot = read_snapshot()
+    assert snapshot == xml
+
+
+def test_reload_snapshot_rebuilt():
+    xml = get_api_xml()
+    os.unlink(snapshot_path)
+    reload_unchanged()
+    assert get_api_xml() == xml
+    _, snapshot = read_snapshot()
+    assert snapshot == xml
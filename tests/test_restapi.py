@@ -25,7 +25,7 @@ else:
 
 
 def test_restapi_api_xml():
-    response = requests.get("{}{}.xml".format(server_uri, docroot), verify=False, auth=server_auth)
+    response = requests.get("{}{}.xml".format(server_uri, docroot), verify=False, auth=server_auth, headers={"Accept-Encoding": "identity"})
     xml = etree.fromstring(response.content)
     print(etree.tostring(xml, pretty_print=True, encoding="unicode"))
     assert response.status_code == 200
@@ -55,6 +55,38 @@ def test_restapi_ns_api_xml():
         assert node in ns_default
 
 
+def test_restapi_api_xml_etag():
+    response = requests.get("{}{}.xml".format(server_uri, docroot), verify=False, auth=server_auth, headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert "Content-Encoding" not in response.headers
+    assert int(response.headers["Content-Length"]) == len(response.content)
+    etag = response.headers["ETag"]
+    response = requests.get("{}{}.xml".format(server_uri, docroot), verify=False, auth=server_auth, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert len(response.content) == 0
+    response = requests.get("{}{}.xml".format(server_uri, docroot), verify=False, auth=server_auth, headers={"If-None-Match": "1234"})
+    assert response.status_code == 200
+    assert response.headers["ETag"] == etag
+
+
+def test_restapi_api_xml_gzip():
+    plain = requests.get("{}{}.xml".format(server_uri, docroot), verify=False, auth=server_auth, headers={"Accept-Encoding": "identity"})
+    response = requests.get("{}{}.xml".format(server_uri, docroot), verify=False, auth=server_auth, headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Content-Type"] == "text/xml"
+    assert int(response.headers["Content-Length"]) < len(plain.content)
+    assert response.content == plain.content
+
+
+def test_restapi_api_html_etag():
+    response = requests.get("{}{}.html".format(server_uri, docroot), verify=False, auth=server_auth)
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "text/html"
+    response = requests.get("{}{}.html".format(server_uri, docroot), verify=False, auth=server_auth, headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+
+
 def test_restapi_get_single_node():
     response = requests.get("{}{}/test/settings/priority".format(server_uri, docroot), verify=False, auth=server_auth)
     print(json.dumps(response.json(), indent=4, sort_keys=True))
@@ -2354,3 +2386,20 @@ def test_restapi_rpc_get_rpcs():
     ]
 }
 """)
+
+
+def test_restapi_server_timing():
+    response = requests.get("{}{}/test/settings".format(server_uri, docroot), verify=False, auth=server_auth)
+    assert response.status_code == 200
+    assert "Server-Timing" not in response.headers
+    response = requests.get("{}{}/test/settings".format(server_uri, docroot), verify=False, auth=server_auth, headers={"X-Server-Timing": "on"})
+    print(response.headers["Server-Timing"])
+    assert response.status_code == 200
+    assert response.json()["settings"]["priority"] == "1"
+    stages = dict(metric.strip().split(";dur=") for metric in response.headers["Server-Timing"].split(","))
+    assert "parse" in stages and "query" in stages and "serialize" in stages and "total" in stages
+    assert all(float(duration) >= 0 for duration in stages.values())
+    response = requests.patch("{}{}/test/settings".format(server_uri, docroot), verify=False, auth=server_auth, headers={"X-Server-Timing": "on"},
+                              data='{"priority": "2"}')
+    assert response.status_code == 204
+    assert "apply" in response.headers["Server-Timing"]
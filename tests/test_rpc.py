@@ -1,7 +1,10 @@
 import apteryx
 import json
+import os
 import requests
+import time
 from conftest import server_uri, server_auth, docroot, set_restconf_headers
+from test_metrics import get_metrics
 
 
 def test_restconf_rpc_no_input():
@@ -436,3 +439,263 @@ def test_restconf_rpc_list_with_input():
     assert response.status_code == 204
     assert len(response.content) == 0
     assert apteryx.get("/t4:test/state/users/fred/age") == "74"
+
+
+def test_rpc_job_not_found():
+    response = requests.get("{}{}/.jobs/00000000-0000-0000-0000-000000000000".format(server_uri, docroot), auth=server_auth)
+    assert response.status_code == 404
+
+
+# Handlers from models/testing-rpc.lua
+
+def test_rpc_handler_exact_beats_wildcard():
+    response = requests.post("{}{}/data/testing-rpc:rpctest/pick-exact".format(server_uri, docroot), auth=server_auth, headers=set_restconf_headers)
+    assert response.status_code == 200
+    assert response.json() == {"testing-rpc:output": {"handler": "exact"}}
+
+
+def test_rpc_handler_wildcard():
+    response = requests.post("{}{}/data/testing-rpc:rpctest/pick-other".format(server_uri, docroot), auth=server_auth, headers=set_restconf_headers)
+    assert response.status_code == 200
+    assert response.json() == {"testing-rpc:output": {"handler": "wildcard"}}
+
+
+def test_rpc_handler_wildcard_list_entry():
+    response = requests.post("{}{}/data/testing-rpc:rpctest/deep/item=a/run".format(server_uri, docroot), auth=server_auth, headers=set_restconf_headers)
+    assert response.status_code == 204
+
+
+def test_rpc_handler_wildcard_single_segment():
+    # "/rpctest/deep/item/*/run" must not match "/rpctest/deep/item/a/sub/run"
+    response = requests.post("{}{}/data/testing-rpc:rpctest/deep/item=a/sub/run".format(server_uri, docroot), auth=server_auth, headers=set_restconf_headers)
+    assert response.status_code == 501
+    assert response.json()["ietf-restconf:errors"]["error"][0]["error-tag"] == "operation-not-supported"
+
+
+def rpc_job_start():
+    response = requests.post("{}{}/rpctest/slow".format(server_uri, docroot), auth=server_auth, data='{"value": "hello"}')
+    assert response.status_code == 202
+    location = response.headers["Location"]
+    job = response.json()["job"]
+    assert location == "{}/.jobs/{}".format(docroot, job["id"])
+    assert job["rpc"] == "/rpctest/slow"
+    return job["id"], "{}{}".format(server_uri, location)
+
+
+def test_rpc_job_poll():
+    job_id, url = rpc_job_start()
+    for _ in range(50):
+        response = requests.get(url, auth=server_auth)
+        assert response.status_code == 200
+        job = response.json()["job"]
+        if job["status"] == "completed":
+            break
+        assert job["status"] == "running"
+        time.sleep(0.1)
+    assert job == {"id": job_id, "rpc": "/rpctest/slow", "status": "completed", "status-code": 200, "result": {"echo": "hello"}}
+
+
+def test_rpc_inline_while_jobs_run():
+    # Jobs run in Lua states of their own, so they cannot hold up other RPCs (run.sh uses -j 2)
+    urls = []
+    for _ in range(2):
+        response = requests.post("{}{}/rpctest/slow".format(server_uri, docroot), auth=server_auth, data='{"value": "busy", "seconds": "3"}')
+        assert response.status_code == 202
+        urls.append("{}{}".format(server_uri, response.headers["Location"]))
+    time.sleep(0.5)
+    start = time.monotonic()
+    response = requests.post("{}{}/data/testing-rpc:rpctest/pick-exact".format(server_uri, docroot), auth=server_auth, headers=set_restconf_headers)
+    assert response.status_code == 200
+    assert time.monotonic() - start < 1
+    for url in urls:
+        assert requests.get(url, auth=server_auth).json()["job"]["status"] == "running"
+
+
+def test_rpc_job_watch():
+    job_id, url = rpc_job_start()
+    response = requests.get(url, stream=True, auth=server_auth, headers={"Accept": "text/event-stream"}, timeout=5)
+    assert response.status_code == 200
+    events = [line for line in response.iter_lines(decode_unicode=True) if line.startswith("data: ")]
+    response.close()
+    assert len(events) == 1
+    job = json.loads(events[0][len("data: "):])["job"]
+    assert job == {"id": job_id, "rpc": "/rpctest/slow", "status": "completed", "status-code": 200, "result": {"echo": "hello"}}
+
+
+def rpc_lookup(query):
+    response = requests.get("{}{}/rpctest/lookup?{}".format(server_uri, docroot), auth=server_auth)
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_rpc_cache_hit():
+    hits = 'apteryx_rest_rpc_cache_hits_total{handler="/rpctest/lookup"}'
+    misses = 'apteryx_rest_rpc_cache_misses_total{handler="/rpctest/lookup"}'
+    before = get_metrics()
+    first = rpc_lookup("name=hit")
+    assert first["name"] == "hit"
+    assert rpc_lookup("name=hit") == first
+    after = get_metrics()
+    assert after[hits] == before[hits] + 1
+    assert after[misses] == before[misses] + 1
+
+
+def test_rpc_cache_key_fields():
+    first = rpc_lookup("name=key&detail=1")
+    # Only name is in the key
+    assert rpc_lookup("name=key&detail=2") == first
+    other = rpc_lookup("name=other&detail=1")
+    assert other["name"] == "other"
+    assert other["count"] != first["count"]
+
+
+def test_rpc_cache_invalidated_by_post():
+    first = rpc_lookup("name=post")
+    response = requests.post("{}{}/rpctest/lookup".format(server_uri, docroot), auth=server_auth, data='{"name": "post"}')
+    assert response.status_code == 200
+    assert rpc_lookup("name=post")["count"] != first["count"]
+
+
+def test_rpc_cache_invalidated_by_handler():
+    first = rpc_lookup("name=reset")
+    response = requests.post("{}{}/rpctest/lookup-reset".format(server_uri, docroot), auth=server_auth)
+    assert response.status_code == 204
+    assert rpc_lookup("name=reset")["count"] != first["count"]
+
+
+def test_rpc_budget_overrun():
+    overruns = 'apteryx_rest_rpc_budget_overruns_total{handler="/rpctest/spin"}'
+    before = get_metrics()
+    response = requests.post("{}{}/data/testing-rpc:rpctest/spin".format(server_uri, docroot), auth=server_auth, headers=set_restconf_headers)
+    assert response.status_code == 400
+    assert response.json()["ietf-restconf:errors"]["error"][0]["error-tag"] == "operation-failed"
+    after = get_metrics()
+    assert after[overruns] == before[overruns] + 1
+
+
+def test_rpc_views():
+    data = '{"input": {"fields": {"a": "1", "b": "2", "c": "3"}}}'
+    response = requests.post("{}{}/data/testing-rpc:rpctest/view".format(server_uri, docroot), auth=server_auth, headers=set_restconf_headers, data=data)
+    print(response.text)
+    assert response.status_code == 200
+    assert response.json() == {
+        "testing-rpc:output": {
+            "count": "3",
+            "names": "a=1,b=2,c=3",
+            "detail": {"level": "high"},
+            "extra": {"note": "from a table"},
+        }
+    }
+
+
+def test_rpc_views_empty_table():
+    data = '{"input": {"empty": "yes"}}'
+    response = requests.post("{}{}/data/testing-rpc:rpctest/view".format(server_uri, docroot), auth=server_auth, headers=set_restconf_headers, data=data)
+    assert response.status_code == 204
+
+
+def test_rpc_views_input_read_only():
+    data = '{"input": {"write": "yes"}}'
+    response = requests.post("{}{}/data/testing-rpc:rpctest/view".format(server_uri, docroot), auth=server_auth, headers=set_restconf_headers, data=data)
+    assert response.status_code == 400
+    error = response.json()["ietf-restconf:errors"]["error"][0]
+    assert error["error-tag"] == "operation-failed"
+    assert "read-only" in error["error-message"]
+
+
+# run.sh keeps compiled handlers here (-C) and runs them in two Lua states (-j 2)
+rpc_cache_path = os.path.join(os.getcwd(), ".build", "rpc-cache")
+
+
+def rpc_cached_file(name):
+    for entry in os.listdir(rpc_cache_path):
+        path = os.path.join(rpc_cache_path, entry)
+        with open(path, "rb") as f:
+            source = f.readline().split(b" ")[0].decode()
+        if entry.endswith(".luac") and source.endswith(name):
+            return path
+    return None
+
+
+def test_rpc_handler_from_file():
+    response = requests.post("{}{}/rpctest/lazy".format(server_uri, docroot), auth=server_auth)
+    assert response.status_code == 200
+    assert response.json() == {"source": "handlers/lazy.lua"}
+
+
+def test_rpc_handler_file_cached():
+    url = "{}{}/rpctest/lazy".format(server_uri, docroot)
+    assert requests.post(url, auth=server_auth).status_code == 200
+    cached = rpc_cached_file("/handlers/lazy.lua")
+    assert cached is not None
+    before = os.stat(cached)
+    # Load the handler in the other Lua state too - the compiled file is reused, not written again
+    for _ in range(4):
+        assert requests.post(url, auth=server_auth).status_code == 200
+    after = os.stat(cached)
+    assert (after.st_ino, after.st_mtime_ns) == (before.st_ino, before.st_mtime_ns)
+    assert rpc_cached_file("/testing-rpc.lua") is not None
+
+
+def rpc_texts(data):
+    if isinstance(data, dict):
+        return [text for key, value in data.items() for text in ([value] if key == "text" else rpc_texts(value))]
+    if isinstance(data, list):
+        return [text for value in data for text in rpc_texts(value)]
+    return []
+
+
+def test_rpc_stream_json_array():
+    response = requests.post("{}{}/rpctest/dump".format(server_uri, docroot), auth=server_auth)
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/json"
+    chunks = response.json()
+    assert len(chunks) == 3
+    assert [rpc_texts(chunk) for chunk in chunks] == [["one"], ["two"], ["three"]]
+
+
+def test_rpc_stream_ndjson():
+    response = requests.post("{}{}/rpctest/dump".format(server_uri, docroot), auth=server_auth, headers={"Accept": "application/stream+json"})
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/stream+json"
+    chunks = [json.loads(line) for line in response.text.splitlines() if line]
+    assert [rpc_texts(chunk) for chunk in chunks] == [["one"], ["two"], ["three"]]
+
+
+def test_rpc_stream_sse():
+    response = requests.post("{}{}/rpctest/dump".format(server_uri, docroot), auth=server_auth, headers={"Accept": "text/event-stream"})
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "text/event-stream"
+    events = [line for line in response.text.splitlines() if line]
+    assert all(event.startswith("data: ") for event in events)
+    chunks = [json.loads(event[len("data: "):]) for event in events]
+    assert [rpc_texts(chunk) for chunk in chunks] == [["one"], ["two"], ["three"]]
+
+
+def test_rpc_stream_error_is_last_chunk():
+    response = requests.post("{}{}/rpctest/dump".format(server_uri, docroot), auth=server_auth, data='{"fail": "yes"}')
+    assert response.status_code == 200
+    chunks = response.json()
+    assert len(chunks) == 2
+    assert rpc_texts(chunks[0]) == ["one"]
+    assert chunks[1] == {"message": "dump failed"}
+
+
+def test_rpc_stream_no_output_node():
+    # Nothing is streamed - the chunks are merged into one output that has no schema to render it
+    response = requests.post("{}{}/rpctest/dump-raw".format(server_uri, docroot), auth=server_auth)
+    assert response.status_code == 500
+    assert not response.text.startswith("[")
+
+
+def test_rpc_stream_merged_in_job():
+    response = requests.post("{}{}/rpctest/dump-job".format(server_uri, docroot), auth=server_auth)
+    assert response.status_code == 202
+    url = "{}{}".format(server_uri, response.headers["Location"])
+    for _ in range(50):
+        job = requests.get(url, auth=server_auth).json()["job"]
+        if job["status"] == "completed":
+            break
+        time.sleep(0.1)
+    assert job["status-code"] == 200
+    assert sorted(rpc_texts(job["result"])) == ["one", "three", "two"]
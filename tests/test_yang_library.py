@@ -107,6 +107,11 @@ def test_restconf_yang_library_tree():
                         "namespace": "http://test.com/ns/yang/testing-4",
                         "revision": "2024-02-01"
                     },
+                    {
+                        "name": "testing-rpc",
+                        "namespace": "http://test.com/ns/yang/testing-rpc",
+                        "revision": "2024-06-01"
+                    },
                     {
                         "name": "testing2-augmented",
                         "namespace": "http://test.com/ns/yang/testing2-augmented",
@@ -201,6 +206,11 @@ def test_restconf_yang_library_data():
                         "namespace": "http://test.com/ns/yang/testing-4",
                         "revision": "2024-02-01"
                     },
+                    {
+                        "name": "testing-rpc",
+                        "namespace": "http://test.com/ns/yang/testing-rpc",
+                        "revision": "2024-06-01"
+                    },
                     {
                         "name": "testing2-augmented",
                         "namespace": "http://test.com/ns/yang/testing2-augmented",
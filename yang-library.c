@@ -166,8 +166,9 @@ schema_set_model_information (sch_instance *schema, GNode *root)
  * by restconf.
  *
  * @param g_schema - The root schema xml node
+ * @return the new content-id (to be freed by the caller)
  */
-void
+char *
 yang_library_create (sch_instance *schema)
 {
     GNode *root;
@@ -175,7 +176,7 @@ yang_library_create (sch_instance *schema)
     GNode *datastore;
     GNode *tmp;
     GNode *sch_tmp;
-    time_t now = time (NULL);
+    gint64 now = g_get_real_time ();
     char set_id[24];
 
     root = APTERYX_NODE (NULL, g_strdup (YANG_LIBRARY_PATH));
@@ -200,6 +201,7 @@ yang_library_create (sch_instance *schema)
      * on the clock */
     snprintf (set_id, sizeof (set_id), "%" PRIx64 "", now);
     apteryx_set (YANG_LIBRARY_CONTENT_ID, set_id);
+    return g_strdup (set_id);
 }
 
 /**